@@ -0,0 +1,83 @@
+'''
+offline benchmarks, no database needed
+
+python -m benchmarks -o results.json
+python -m benchmarks -o new.json --compare results.json
+'''
+import time
+import timeit
+import statistics
+from collections import OrderedDict
+
+
+BENCHMARKS = OrderedDict()
+
+DEFAULT_REPEAT = 5
+DEFAULT_MIN_TIME = 0.2
+
+
+def benchmark(name):
+    '''
+    register a function returning results of a benchmark group,
+    dict of case name to `measure` result
+    '''
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def measure(func, repeat=DEFAULT_REPEAT, min_time=DEFAULT_MIN_TIME):
+    '''
+    seconds per call of func, best and median of `repeat` runs
+    '''
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    if elapsed < min_time:
+        number = max(1, int(number * min_time / elapsed))
+    runs = [t / number for t in timer.repeat(repeat, number)]
+    return {
+        'number': number,
+        'best': min(runs),
+        'median': statistics.median(runs),
+        'ops_per_sec': 1 / min(runs),
+    }
+
+
+def measure_threads(func, threads, calls):
+    '''
+    run func `calls` times in each of `threads` threads,
+    return throughput and latency percentiles
+    '''
+    from threading import Thread, Barrier
+
+    barrier = Barrier(threads + 1)
+    latencies = [None] * threads
+
+    def worker(index):
+        samples = []
+        barrier.wait()
+        for _ in range(calls):
+            start = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - start)
+        latencies[index] = samples
+
+    workers = [Thread(target=worker, args=(i, )) for i in range(threads)]
+    for worker_thread in workers:
+        worker_thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.join()
+    elapsed = time.perf_counter() - start
+
+    samples = sorted(s for thread_samples in latencies for s in thread_samples)
+    return {
+        'threads': threads,
+        'calls': len(samples),
+        'elapsed': elapsed,
+        'ops_per_sec': len(samples) / elapsed,
+        'p50': samples[len(samples) // 2],
+        'p99': samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+    }
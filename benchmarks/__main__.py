@@ -0,0 +1,79 @@
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+
+from . import BENCHMARKS
+from . import statements, rows, dispatch, pool  # noqa: F401, registering
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def run(names):
+    results = {}
+    for name, func in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        print('running {}'.format(name), file=sys.stderr)
+        try:
+            results[name] = func()
+        except ImportError as e:
+            # driver of backend not installed
+            results[name] = {'skipped': str(e)}
+    return results
+
+
+def compare(results, baseline):
+    for name, cases in results.items():
+        base_cases = baseline.get(name, {})
+        for case, result in cases.items():
+            base = base_cases.get(case)
+            if not isinstance(result, dict) or not isinstance(base, dict) or \
+                    'ops_per_sec' not in result or 'ops_per_sec' not in base:
+                continue
+            ratio = result['ops_per_sec'] / base['ops_per_sec']
+            print('{:<28} {:<28} {:>14.1f} ops/s {:>7.2f}x'.format(
+                name, case, result['ops_per_sec'], ratio))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('-o', '--output', help='json file of results')
+    parser.add_argument(
+        '-b', '--bench', action='append', choices=list(BENCHMARKS),
+        help='benchmark to run, all by default')
+    parser.add_argument('--compare', help='json file of baseline results')
+    args = parser.parse_args(argv)
+
+    output = {
+        'meta': {
+            'commit': git_commit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'results': run(args.bench),
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2, default=str)
+    else:
+        json.dump(output, sys.stdout, indent=2, default=str)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(output['results'], json.load(f)['results'])
+
+
+if __name__ == '__main__':
+    main()
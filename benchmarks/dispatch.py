@@ -0,0 +1,57 @@
+from . import benchmark, measure
+from .stubs import StubPool, stub_mysql_pool
+
+
+DB = {'type': 'benchmark', 'conf': {'host': '127.0.0.1', 'port': 3306}}
+FILTERS = [('=', 'id', 1)]
+
+
+@benchmark('session_dispatch')
+def session_dispatch():
+    '''
+    overhead of reaching the pool from session, by default connection,
+    by conf (json lookup) and as a bound collection
+    '''
+    from curd.session import Session, DB_CONNECTION_POOL
+
+    DB_CONNECTION_POOL['benchmark'] = StubPool
+    try:
+        session = Session([DB])
+        pool = session.using()
+        users = session.collection('db.table')
+        results = {
+            'pool_direct': measure(
+                lambda: pool.filter('db.table', FILTERS)),
+            'session_getattr': measure(
+                lambda: session.filter('db.table', FILTERS)),
+            'session_using_default': measure(
+                lambda: session.using().filter('db.table', FILTERS)),
+            'session_using_db': measure(
+                lambda: session.using(DB).filter('db.table', FILTERS)),
+            'session_using_new_db': measure(
+                lambda: session.using(dict(DB)).filter('db.table', FILTERS)),
+            'session_collection': measure(
+                lambda: users.filter(FILTERS)),
+        }
+        session.close()
+    finally:
+        DB_CONNECTION_POOL.pop('benchmark', None)
+    return results
+
+
+@benchmark('mysql_pool_dispatch')
+def mysql_pool_dispatch():
+    '''
+    one thread, pool checkout and function call around a stub connection
+    '''
+    pool = stub_mysql_pool({})
+    conn = pool.acquire()
+    pool.release(conn)
+    results = {
+        'connection_direct': measure(
+            lambda: conn.execute('SELECT 1')),
+        'pool': measure(
+            lambda: pool.execute('SELECT 1')),
+    }
+    pool.close()
+    return results
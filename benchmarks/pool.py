@@ -0,0 +1,41 @@
+from . import benchmark, measure_threads
+from .stubs import stub_mysql_pool
+
+
+THREADS = (1, 2, 4, 8, 16, 32, 64)
+CALLS_PER_THREAD = 2000
+POOL_MAX_SIZE = 16
+
+
+@benchmark('mysql_pool_checkout')
+def mysql_pool_checkout():
+    '''
+    execute through MysqlConnectionPool against stub connections,
+    more threads than `pool_max_size` wait for checkout
+    '''
+    results = {}
+    for threads in THREADS:
+        pool = stub_mysql_pool({'pool_max_size': POOL_MAX_SIZE})
+        calls = max(100, CALLS_PER_THREAD // threads)
+        result = measure_threads(
+            lambda: pool.execute('SELECT 1'), threads, calls)
+        result['pool'] = pool.stats()
+        results['threads_{}'.format(threads)] = result
+        pool.close()
+    return results
+
+
+@benchmark('mysql_pool_checkout_latency')
+def mysql_pool_checkout_latency():
+    '''
+    same with 1ms per statement, contention of a busy pool
+    '''
+    results = {}
+    for threads in THREADS:
+        pool = stub_mysql_pool({'pool_max_size': POOL_MAX_SIZE}, latency=0.001)
+        result = measure_threads(
+            lambda: pool.execute('SELECT 1'), threads, 50)
+        result['pool'] = pool.stats()
+        results['threads_{}'.format(threads)] = result
+        pool.close()
+    return results
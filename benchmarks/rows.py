@@ -0,0 +1,42 @@
+from collections import namedtuple
+
+from . import benchmark, measure
+
+
+COLUMNS = ['id', 'text', 'count', 'score', 'created_at']
+ROW_COUNT = 10000
+
+
+def make_rows(count=ROW_COUNT):
+    return tuple(
+        (i, 'text {}'.format(i), i % 100, i / 3, None) for i in range(count)
+    )
+
+
+@benchmark('row_conversion')
+def row_conversion():
+    '''
+    mysql rows arrive as tuples, DictCursor zips each one with field names,
+    cassandra rows are namedtuples converted with `_asdict`
+    '''
+    from curd.connections.utils.rows import convert_rows
+
+    rows = make_rows()
+    Row = namedtuple('Row', COLUMNS)
+    named_rows = [Row(*row) for row in rows]
+
+    results = {
+        'dict_cursor': measure(
+            lambda: [dict(zip(COLUMNS, row)) for row in rows], repeat=3),
+        'cassandra_asdict': measure(
+            lambda: [row._asdict() for row in named_rows], repeat=3),
+    }
+    for row_format in ('dict', 'tuple', 'columnar', 'numpy', 'pandas'):
+        try:
+            convert_rows(COLUMNS, rows[:1], row_format)
+        except Exception:
+            # numpy / pandas not installed
+            continue
+        results[row_format] = measure(
+            lambda: convert_rows(COLUMNS, rows, row_format), repeat=3)
+    return results
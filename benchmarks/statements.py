@@ -0,0 +1,69 @@
+from datetime import datetime
+
+from . import benchmark, measure
+
+
+DATA = {'id': 1, 'text': 'text', 'count': 10, 'created_at': datetime.now()}
+FILTERS = [('=', 'id', 1), ('>', 'count', 5), ('IN', 'text', ['a', 'b', 'c'])]
+ROWS = [dict(DATA, id=i) for i in range(100)]
+
+
+@benchmark('sql_statements')
+def sql_statements():
+    from curd.connections.utils import LRUCache
+    from curd.connections.utils.sql import (
+        query_parameters_from_create,
+        query_parameters_from_create_many,
+        query_parameters_from_update,
+        query_parameters_from_delete,
+        query_parameters_from_filter
+    )
+
+    cases = {
+        'create': lambda cache: query_parameters_from_create(
+            'db.table', DATA, 'INSERT', cache=cache),
+        'create_upsert': lambda cache: query_parameters_from_create(
+            'db.table', DATA, 'UPSERT', cache=cache),
+        'create_many_100': lambda cache: query_parameters_from_create_many(
+            'db.table', ROWS, 'INSERT', cache=cache),
+        'update': lambda cache: query_parameters_from_update(
+            'db.table', FILTERS, DATA, cache=cache),
+        'delete': lambda cache: query_parameters_from_delete(
+            'db.table', FILTERS, cache=cache),
+        'filter': lambda cache: query_parameters_from_filter(
+            'db.table', FILTERS, ['id', 'text'], '-id', 10, cache=cache),
+        'filter_no_filters': lambda cache: query_parameters_from_filter(
+            'db.table', [], None, None, None, cache=cache),
+    }
+    results = {}
+    for name, build in cases.items():
+        results[name] = measure(lambda: build(None))
+        cache = LRUCache(1024)
+        results[name + '_cached'] = measure(lambda: build(cache))
+    return results
+
+
+@benchmark('cql_statements')
+def cql_statements():
+    from curd.connections.utils.cql import (
+        query_parameters_from_create,
+        query_parameters_from_update,
+        query_parameters_from_delete,
+        query_parameters_from_filter
+    )
+
+    filters = [('=', 'id', 1), ('>', 'count', 5)]
+    return {
+        'create': measure(
+            lambda: query_parameters_from_create('ks.table', DATA)),
+        'create_lwt': measure(
+            lambda: query_parameters_from_create(
+                'ks.table', DATA, 'INSERT', True)),
+        'update': measure(
+            lambda: query_parameters_from_update('ks.table', filters, DATA)),
+        'delete': measure(
+            lambda: query_parameters_from_delete('ks.table', filters)),
+        'filter': measure(
+            lambda: query_parameters_from_filter(
+                'ks.table', filters, ['id', 'text'], None, 10)),
+    }
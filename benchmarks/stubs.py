@@ -0,0 +1,72 @@
+'''
+connections answering without a database
+'''
+import time
+
+
+class StubCursor(object):
+    description = (('id', ), ('text', ))
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.rows = []
+
+    def execute(self, query, params=None):
+        if self.latency:
+            time.sleep(self.latency)
+        self.rows = [(1, 'text')]
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class StubConnection(object):
+    def __init__(self, latency=0):
+        self.latency = latency
+
+    def cursor(self, cursor_class=None):
+        return StubCursor(self.latency)
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        pass
+
+
+def stub_mysql_pool(conf, latency=0):
+    '''
+    MysqlConnectionPool whose connections skip the network
+    '''
+    from curd.connections.mysql import MysqlConnection, MysqlConnectionPool
+
+    class StubMysqlConnection(MysqlConnection):
+        def connect(self, conf):
+            self.conn = StubConnection(latency)
+            self.cursor = self.conn.cursor()
+            self.connected_at = time.time()
+
+    class StubMysqlConnectionPool(MysqlConnectionPool):
+        def get_connection(self):
+            return StubMysqlConnection(
+                self._conf, self.statement_cache, self.retry_policy)
+
+    return StubMysqlConnectionPool(conf)
+
+
+class StubPool(object):
+    '''
+    pool returning rows at once, for dispatch overhead
+    '''
+
+    def __init__(self, conf, *args, **kwargs):
+        self.rows = [{'id': 1, 'text': 'text'}]
+
+    def filter(self, collection, filters=None, fields=None, **kwargs):
+        return self.rows
+
+    def close(self):
+        pass
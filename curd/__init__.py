@@ -1,5 +1,10 @@
 from .errors import (
     ConnectError, UnexpectedError, OperationFailure, ProgrammingError,
-    DuplicateKeyError
+    DuplicateKeyError, BatchError, PoolTimeoutError, CircuitOpenError,
+    BufferFullError
 )
-from .session import Session, F, SimpleCollection
+from .session import Session, AsyncSession, F, SimpleCollection
+from .cache import BaseCache, LocalCache
+from .connections.retry import RetryBudget
+from .writer import BufferedWriter
+from .sharding import ShardMap, ShardedCollection
@@ -0,0 +1,288 @@
+import os
+import time
+from threading import Lock
+from functools import partial
+from contextlib import contextmanager
+from collections import OrderedDict
+from datetime import datetime
+
+
+MISSING = object()
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 60
+
+NOT_CACHE_KEY_KWARGS = ('timeout', 'retry', 'use_cache')
+WRITE_FUNCTIONS = ('create', 'create_many', 'update', 'delete')
+
+
+class BaseCache(object):
+    '''
+    result cache backend, values are grouped by namespace to be invalidated
+    '''
+
+    def get(self, namespace, key):
+        '''
+        return MISSING when not cached
+        '''
+        raise NotImplementedError
+
+    def set(self, namespace, key, value, ttl=None):
+        raise NotImplementedError
+
+    def invalidate(self, namespace):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class LocalCache(BaseCache):
+    '''
+    in process LRU cache with ttl, safe for threads and fork
+    '''
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.pid = os.getpid()
+
+        self._lock = Lock()
+        # (namespace, key) -> (expire_at, value)
+        self._data = OrderedDict()
+        self._namespaces = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _check_pid(self):
+        if os.getpid() != self.pid:
+            # lock may be held by a thread not existing in child
+            self._lock = Lock()
+            self._data = OrderedDict()
+            self._namespaces = {}
+            self.pid = os.getpid()
+
+    def _remove(self, item):
+        self._data.pop(item, None)
+        keys = self._namespaces.get(item[0])
+        if keys is not None:
+            keys.discard(item[1])
+            if not keys:
+                del self._namespaces[item[0]]
+
+    def get(self, namespace, key):
+        self._check_pid()
+        item = (namespace, key)
+        with self._lock:
+            cached = self._data.get(item, None)
+            if cached is None:
+                self.misses += 1
+                return MISSING
+            expire_at, value = cached
+            if expire_at is not None and expire_at < time.time():
+                self._remove(item)
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(item)
+            self.hits += 1
+            return value
+
+    def set(self, namespace, key, value, ttl=None):
+        self._check_pid()
+        if ttl is None:
+            ttl = self.ttl
+        expire_at = time.time() + ttl if ttl else None
+        item = (namespace, key)
+        with self._lock:
+            self._data[item] = (expire_at, value)
+            self._data.move_to_end(item)
+            self._namespaces.setdefault(namespace, set()).add(key)
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def invalidate(self, namespace):
+        self._check_pid()
+        with self._lock:
+            for key in self._namespaces.pop(namespace, ()):
+                self._data.pop((namespace, key), None)
+            self.invalidations += 1
+
+    def clear(self):
+        self._check_pid()
+        with self._lock:
+            self._data.clear()
+            self._namespaces.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+def freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    elif isinstance(value, (set, frozenset)):
+        return frozenset(freeze(v) for v in value)
+    elif isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    elif value is None or isinstance(
+            value, (str, bytes, int, float, bool, datetime)):
+        return value
+    else:
+        return repr(value)
+
+
+def copy_rows(rows):
+    if isinstance(rows, list):
+        return [dict(row) for row in rows]
+    elif rows is not None:
+        return dict(rows)
+    return rows
+
+
+class CachedConnection(object):
+    '''
+    read through cache of get / filter / exist of a connection,
+    invalidated by create / create_many / update / delete of same collection,
+    writes by `execute` are not seen.
+    rows of a read are not cached when a write of the collection finished
+    while they were fetched, they may be stale
+    '''
+
+    def __init__(self, conn, cache, name):
+        self._conn = conn
+        self.cache = cache
+        self.name = name
+        self.pid = os.getpid()
+        self._lock = Lock()
+        # namespace -> count of writes finished
+        self._generations = {}
+
+    def __getattr__(self, item):
+        return getattr(self._conn, item)
+
+    def _namespace(self, collection):
+        return self.name, collection
+
+    def _generation_lock(self):
+        if os.getpid() != self.pid:
+            # may be held by a thread of parent
+            self._lock = Lock()
+            self.pid = os.getpid()
+        return self._lock
+
+    def _read(self, func, collection, filters, fields, *args, **kwargs):
+        if not kwargs.pop('use_cache', True) or \
+                kwargs.get('row_format', 'dict') != 'dict':
+            return getattr(self._conn, func)(
+                collection, filters, fields, *args, **kwargs)
+
+        key = (
+            func,
+            tuple(
+                (op.upper(), freeze(k), freeze(v))
+                for op, k, v in (filters or [])
+            ),
+            freeze(fields),
+            freeze(args),
+            tuple(sorted(
+                (k, freeze(v)) for k, v in kwargs.items()
+                if k not in NOT_CACHE_KEY_KWARGS
+            ))
+        )
+        namespace = self._namespace(collection)
+        rows = self.cache.get(namespace, key)
+        if rows is MISSING:
+            generation = self._generations.get(namespace, 0)
+            rows = getattr(self._conn, func)(
+                collection, filters, fields, *args, **kwargs)
+            with self._generation_lock():
+                if self._generations.get(namespace, 0) == generation:
+                    self.cache.set(namespace, key, copy_rows(rows))
+            return rows
+        return copy_rows(rows)
+
+    def filter(self, collection, filters=None, fields=None, order_by=None,
+               limit=None, **kwargs):
+        return self._read(
+            'filter', collection, filters, fields, order_by, limit, **kwargs)
+
+    def get(self, collection, filters=None, fields=None, **kwargs):
+        return self._read('get', collection, filters, fields, **kwargs)
+
+    def exist(self, collection, filters, **kwargs):
+        if filters:
+            fields = [filters[0][1]]
+            return bool(self.get(collection, filters, fields, **kwargs))
+        else:
+            return self._conn.exist(collection, filters, **kwargs)
+
+    def _invalidate(self, collection):
+        namespace = self._namespace(collection)
+        with self._generation_lock():
+            self._generations[namespace] = \
+                self._generations.get(namespace, 0) + 1
+            self.cache.invalidate(namespace)
+
+    def _write(self, func, collection, *args, **kwargs):
+        try:
+            return getattr(self._conn, func)(collection, *args, **kwargs)
+        finally:
+            self._invalidate(collection)
+
+    def create(self, collection, *args, **kwargs):
+        return self._write('create', collection, *args, **kwargs)
+
+    def create_many(self, collection, *args, **kwargs):
+        return self._write('create_many', collection, *args, **kwargs)
+
+    def update(self, collection, *args, **kwargs):
+        return self._write('update', collection, *args, **kwargs)
+
+    def delete(self, collection, *args, **kwargs):
+        return self._write('delete', collection, *args, **kwargs)
+    
+    def transaction(self):
+        return self._pin(self._conn.transaction())
+    
+    def pinned(self):
+        return self._pin(self._conn.pinned())
+    
+    @contextmanager
+    def _pin(self, pinned):
+        '''
+        operations in block skip cache,
+        collections written are invalidated on exit
+        '''
+        written = set()
+        try:
+            with pinned as conn:
+                for func in WRITE_FUNCTIONS:
+                    setattr(conn, func, partial(
+                        self._track_write, getattr(conn, func), written))
+                yield conn
+        finally:
+            for collection in written:
+                self._invalidate(collection)
+    
+    @staticmethod
+    def _track_write(write, written, collection, *args, **kwargs):
+        written.add(collection)
+        return write(collection, *args, **kwargs)
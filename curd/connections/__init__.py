@@ -1,22 +1,253 @@
+import asyncio
 import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from ..errors import ProgrammingError
+from ..errors import ProgrammingError, BatchError
+from .utils.rows import MergedRows, order_fields, merge_rows
 
 
 logger = logging.Logger('curd')
 
 DEFAULT_FILTER_LIMIT = None
 DEFAULT_TIMEOUT = 3600 * 10
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_FETCH_SIZE = 1000
+DEFAULT_CONCURRENCY = 100
+DEFAULT_GET_MANY_CHUNK_SIZE = 500
 
-CREATE_MODE = ('INSERT', 'IGNORE', 'REPLACE')
+SCATTER_ERROR_POLICIES = ('raise', 'partial')
+
+CREATE_MODE = ('INSERT', 'IGNORE', 'REPLACE', 'UPSERT')
 FILTER_OP = ('<', '>', '>=', '<=', '=', '!=', 'IN')
 CURD_FUNCTIONS = (
-    'create', 'update', 'get', 'delete', 'filter', 'exist', 'execute'
+    'create', 'create_many', 'update', 'get', 'delete', 'filter', 'exist',
+    'execute', 'iter_filter', 'iter_execute', 'scan', 'get_many',
+    'execute_concurrent'
+)
+ITER_FUNCTIONS = ('iter_filter', 'iter_execute')
+ASYNC_CURD_FUNCTIONS = (
+    'create', 'create_many', 'update', 'get', 'delete', 'filter', 'exist',
+    'execute'
 )
 
 OP_RETRY_WARNING = 'RETRY: {}'
 
 
+def scan_by_keyset(filter_func, collection, key='id',
+                   batch_size=DEFAULT_FETCH_SIZE, filters=None, fields=None,
+                   prefetch=True, **kwargs):
+    '''
+    yield rows of collection page by page ordered by key,
+    each page seeks from the last key of previous page instead of OFFSET,
+    next page is fetched in background while current page is consumed
+    '''
+    keys = [key] if isinstance(key, str) else list(key)
+    desc = [k.startswith('-') for k in keys]
+    if any(desc) and not all(desc):
+        raise ProgrammingError('scan keys must be in the same order')
+    names = [k.lstrip('-') for k in keys]
+    op = '<' if desc[0] else '>'
+    
+    filters = list(filters or [])
+    if fields:
+        fields = list(fields) + [n for n in names if n not in fields]
+        
+    def fetch(last):
+        page_filters = filters
+        if last is not None:
+            if len(names) == 1:
+                page_filters = filters + [(op, names[0], last[0])]
+            else:
+                page_filters = filters + [(op, tuple(names), last)]
+        return filter_func(
+            collection, page_filters, fields,
+            order_by=keys, limit=batch_size, **kwargs
+        )
+    
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        rows = fetch(None)
+        while rows:
+            last = tuple(rows[-1][n] for n in names)
+            has_more = len(rows) >= batch_size
+            if has_more and executor:
+                future = executor.submit(fetch, last)
+            yield from rows
+            if not has_more:
+                break
+            rows = future.result() if executor else fetch(last)
+    finally:
+        if executor:
+            executor.shutdown(wait=False)
+
+
+def tag_rows(rows, source_field, source):
+    for row in rows:
+        row[source_field] = source
+        yield row
+
+
+def scatter_filter(executor, conns, collection, filters=None, fields=None,
+                   order_by=None, limit=DEFAULT_FILTER_LIMIT,
+                   on_error='raise', source_field=None, **kwargs):
+    '''
+    same filter on all conns in parallel from executor, sorted rows of each
+    merged by a heap on `order_by` until `limit` rows,
+    `source_field` set to index of conn on merged rows when given
+
+    on_error:
+        raise: raise first error, pending queries are cancelled
+        partial: rows of the others, errors in `MergedRows.errors`
+    '''
+    query_fields = check_scatter_filter(fields, order_by, on_error, kwargs)
+    futures = {
+        executor.submit(
+            conn.filter, collection, filters, query_fields, order_by, limit,
+            **kwargs
+        ): index
+        for index, conn in enumerate(conns)
+    }
+    results, errors = [[] for _ in conns], {}
+    try:
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                if on_error == 'raise':
+                    raise
+                errors[index] = e
+    finally:
+        for future in futures:
+            future.cancel()
+    return merge_scatter_rows(
+        results, errors, fields, order_by, limit, source_field)
+
+
+async def async_scatter_filter(conns, collection, filters=None, fields=None,
+                               order_by=None, limit=DEFAULT_FILTER_LIMIT,
+                               on_error='raise', source_field=None,
+                               **kwargs):
+    '''
+    scatter_filter of async conns, queries run in event loop
+    '''
+    query_fields = check_scatter_filter(fields, order_by, on_error, kwargs)
+    tasks = [
+        asyncio.ensure_future(conn.filter(
+            collection, filters, query_fields, order_by, limit, **kwargs))
+        for conn in conns
+    ]
+    try:
+        results = await asyncio.gather(
+            *tasks, return_exceptions=on_error == 'partial')
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    errors = {}
+    for index, result in enumerate(results):
+        if isinstance(result, Exception):
+            errors[index] = result
+            results[index] = []
+    return merge_scatter_rows(
+        results, errors, fields, order_by, limit, source_field)
+
+
+def check_scatter_filter(fields, order_by, on_error, kwargs):
+    '''
+    fields to query on each conn
+    '''
+    if on_error not in SCATTER_ERROR_POLICIES:
+        raise ProgrammingError(
+            'on_error should be one of {}'.format(SCATTER_ERROR_POLICIES))
+    if kwargs.get('row_format', 'dict') != 'dict':
+        raise ProgrammingError('rows of scatter filter are merged as dict')
+    return order_fields(fields, order_by)[0]
+
+
+def merge_scatter_rows(results, errors, fields, order_by, limit,
+                       source_field):
+    if source_field:
+        results = [
+            tag_rows(rows, source_field, index)
+            for index, rows in enumerate(results)
+        ]
+    extra = order_fields(fields, order_by)[1]
+    rows = MergedRows(merge_rows(results, order_by, limit), errors)
+    for row in rows if extra else ():
+        for name in extra:
+            row.pop(name, None)
+    return rows
+
+
+def check_lookup_row_format(kwargs):
+    '''
+    rows of lookup are put back to their values by key, as dict
+    '''
+    if kwargs.get('row_format', 'dict') != 'dict':
+        raise ProgrammingError('rows of get_many are dict')
+
+
+def chunk_lookup_values(values, chunk_size):
+    '''
+    unique values of lookup split in chunks
+    '''
+    unique_values = list(OrderedDict.fromkeys(values))
+    return [
+        unique_values[start:start + chunk_size]
+        for start in range(0, len(unique_values), chunk_size)
+    ]
+
+
+def lookup_fields(fields, key):
+    '''
+    fields of lookup query, with key to put rows back to their values
+    '''
+    if fields and key not in fields:
+        return list(fields) + [key]
+    return fields
+
+
+def collect_lookup_rows(key, values, chunks, results, fields=None,
+                        as_dict=False):
+    '''
+    rows of each chunk keyed by `key`, in input order or a dict of
+    value -> row, raise BatchError with errors by value of failed chunks
+    '''
+    strip_key = bool(fields) and key not in fields
+    rows, errors = {}, {}
+    for chunk, result in zip(chunks, results):
+        if isinstance(result, Exception):
+            for value in chunk:
+                errors[value] = result
+            continue
+        for row in result:
+            value = row.pop(key) if strip_key else row[key]
+            rows.setdefault(value, row)
+    
+    if not as_dict:
+        rows = [rows.get(v) for v in values]
+    if errors:
+        raise BatchError(errors, rows)
+    return rows
+
+
+def collect_statement_results(results):
+    '''
+    rows of each statement in input order, raise BatchError with errors
+    by index of failed statements
+    '''
+    errors = {}
+    for index, result in enumerate(results):
+        if isinstance(result, Exception):
+            errors[index] = result
+            results[index] = None
+    if errors:
+        raise BatchError(errors, results)
+    return results
+
+
 class BaseConnection(object):
     def _check_filters(self, filters):
         if filters is None:
@@ -31,6 +262,10 @@ class BaseConnection(object):
     
     def create(self, collection, data, mode='INSERT', **kwargs):
         raise NotImplementedError
+    
+    def create_many(self, collection, rows, mode='INSERT',
+                    chunk_size=DEFAULT_CHUNK_SIZE, **kwargs):
+        raise NotImplementedError
 
     def update(self, collection, data, filters, **kwargs):
         raise NotImplementedError
@@ -42,6 +277,39 @@ class BaseConnection(object):
                order_by=None, limit=DEFAULT_FILTER_LIMIT, **kwargs):
         raise NotImplementedError
     
+    def iter_filter(self, collection, filters=None, fields=None,
+                    order_by=None, limit=DEFAULT_FILTER_LIMIT,
+                    batch_size=DEFAULT_FETCH_SIZE, **kwargs):
+        raise NotImplementedError
+    
+    def get_many(self, collection, key, values, fields=None, as_dict=False,
+                 chunk_size=DEFAULT_GET_MANY_CHUNK_SIZE,
+                 concurrency=DEFAULT_CONCURRENCY, **kwargs):
+        raise NotImplementedError
+    
+    def execute_concurrent(self, statements, concurrency=DEFAULT_CONCURRENCY,
+                           **kwargs):
+        raise NotImplementedError
+    
+    def transaction(self):
+        raise ProgrammingError('transaction not supported')
+    
+    def pinned(self):
+        raise ProgrammingError('pinned connection not supported')
+    
+    def warmup(self, n=None):
+        '''
+        open connections ahead of first operation, return count opened
+        '''
+        return 0
+    
+    def scan(self, collection, key='id', batch_size=DEFAULT_FETCH_SIZE,
+             filters=None, fields=None, prefetch=True, **kwargs):
+        return scan_by_keyset(
+            self.filter, collection, key, batch_size, filters, fields,
+            prefetch, **kwargs
+        )
+    
     def get(self, collection, filters=None, fields=None, **kwargs):
         rows = self.filter(collection, filters, fields, limit=1, **kwargs)
         if rows:
@@ -59,3 +327,24 @@ class BaseConnection(object):
                 return False
         else:
             raise ProgrammingError('exist without filter is not supported')
+
+
+class AsyncBaseConnection(BaseConnection):
+    async def get(self, collection, filters=None, fields=None, **kwargs):
+        rows = await self.filter(
+            collection, filters, fields, limit=1, **kwargs)
+        if rows:
+            return rows[0]
+        else:
+            return None
+
+    async def exist(self, collection, filters, **kwargs):
+        if filters:
+            fields = [filters[0][1]]
+            data = await self.get(collection, filters, fields=fields, **kwargs)
+            if data:
+                return True
+            else:
+                return False
+        else:
+            raise ProgrammingError('exist without filter is not supported')
@@ -0,0 +1,170 @@
+import os
+import asyncio
+
+from ..errors import (
+    UnexpectedError, OperationFailure, ProgrammingError,
+    DuplicateKeyError, BatchError
+)
+from .utils.cql import (
+    query_parameters_from_create,
+    query_parameters_from_update,
+    query_parameters_from_delete,
+    query_parameters_from_filter,
+)
+from .cassandra import CassandraConnectionPool, wrap_error
+from . import (
+    AsyncBaseConnection, DEFAULT_FILTER_LIMIT, DEFAULT_CHUNK_SIZE
+)
+
+
+def wait_response_future(response_future):
+    '''
+    bridge a driver ResponseFuture to an asyncio future of all rows
+    '''
+    loop = asyncio.get_event_loop()
+    future = loop.create_future()
+    rows = []
+
+    def set_result():
+        if not future.done():
+            future.set_result(rows)
+
+    def set_exception(e):
+        if not future.done():
+            future.set_exception(e)
+
+    def on_success(page):
+        rows.extend(page)
+        if response_future.has_more_pages:
+            response_future.start_fetching_next_page()
+        else:
+            loop.call_soon_threadsafe(set_result)
+
+    def on_error(e):
+        loop.call_soon_threadsafe(set_exception, e)
+
+    response_future.add_callbacks(on_success, on_error)
+    return future
+
+
+class AsyncCassandraConnectionPool(AsyncBaseConnection):
+    '''
+    cassandra session driven by execute_async,
+    connecting and preparing are shared with CassandraConnectionPool
+    '''
+
+    def __init__(self, conf, retry_budget=None):
+        self._pool = CassandraConnectionPool(conf, retry_budget)
+
+    async def connect(self, conf):
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._pool.connect, conf)
+
+    async def close(self):
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._pool.close)
+
+    async def _execute(self, query, params, timeout):
+        pool = self._pool
+        if not pool.session:
+            await self.connect(pool._conf)
+
+        try:
+            if isinstance(params, dict) and query not in pool.prepared_cache:
+                # preparing is a blocking round trip, once per statement
+                loop = asyncio.get_event_loop()
+                statement, params = await loop.run_in_executor(
+                    None, pool._prepare, query, params)
+            else:
+                statement, params = pool._prepare(query, params)
+            rows = await wait_response_future(
+                pool.session.execute_async(statement, params, timeout=timeout)
+            )
+        except Exception as e:
+            pool._on_error(query, e)
+            raise wrap_error(e)
+        else:
+            return rows
+
+    async def execute(self, query, params=None, retry=None, timeout=None):
+        pool = self._pool
+        if os.getpid() != pool.pid:
+            pool.discard()
+
+        if retry is None:
+            retry = pool.max_op_fail_retry
+
+        if timeout is None:
+            timeout = pool.default_timeout
+
+        retry_no = 0
+        pool.retry_policy.before_call()
+        while True:
+            try:
+                rows = await self._execute(query, params, timeout)
+            except OperationFailure as e:
+                delay = pool.retry_policy.retry(e, retry_no, retry)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                retry_no += 1
+            except ProgrammingError:
+                pool.retry_policy.on_success()
+                raise
+            except UnexpectedError as e:
+                pool.retry_policy.on_error(e)
+                await self.close()
+                raise
+            else:
+                pool.retry_policy.on_success()
+                return [row._asdict() for row in rows]
+
+    async def create(self, collection, data, mode='INSERT', lwt=None,
+                     **kwargs):
+        if lwt is None:
+            lwt = self._pool.lwt
+        query, params = query_parameters_from_create(
+            collection, data, mode.upper(), lwt)
+        rows = await self.execute(query, params, **kwargs)
+        if rows and mode.upper() != 'IGNORE' and not rows[0].get('applied', True):
+            raise DuplicateKeyError
+
+    async def create_many(self, collection, rows, mode='INSERT',
+                          chunk_size=DEFAULT_CHUNK_SIZE, **kwargs):
+        semaphore = asyncio.Semaphore(chunk_size)
+
+        async def create(data):
+            async with semaphore:
+                await self.create(collection, data, mode, **kwargs)
+
+        results = await asyncio.gather(
+            *[create(data) for data in rows], return_exceptions=True
+        )
+        errors = {}
+        for index, result in enumerate(results):
+            if isinstance(result, Exception):
+                errors[index] = result
+        if errors:
+            raise BatchError(errors)
+
+    async def update(self, collection, data, filters, lwt=None, **kwargs):
+        if lwt is None:
+            lwt = self._pool.lwt
+        filters = self._check_filters(filters)
+        query, params = query_parameters_from_update(
+            collection, filters, data, lwt)
+        await self.execute(query, params, **kwargs)
+
+    async def delete(self, collection, filters, **kwargs):
+        filters = self._check_filters(filters)
+        query, params = query_parameters_from_delete(collection, filters)
+        await self.execute(query, params, **kwargs)
+
+    async def filter(self, collection, filters=None, fields=None,
+                     order_by=None, limit=DEFAULT_FILTER_LIMIT, **kwargs):
+        # cache of session is skipped by it, no cache here
+        kwargs.pop('use_cache', None)
+        filters = self._check_filters(filters)
+        query, params = query_parameters_from_filter(
+            collection, filters, fields, order_by, limit)
+        return await self.execute(query, params, **kwargs)
@@ -0,0 +1,231 @@
+import os
+import copy
+import asyncio
+
+import aiomysql
+
+from ..errors import (
+    OperationFailure, ProgrammingError, ConnectError,
+    PoolTimeoutError,
+    DuplicateKeyError, BatchError
+)
+from . import logger
+from .utils import LRUCache
+from .retry import RetryPolicy
+from .utils.sql import (
+    query_parameters_from_create,
+    query_parameters_from_create_many,
+    query_parameters_from_update,
+    query_parameters_from_delete,
+    query_parameters_from_filter
+)
+from .mysql import (
+    MysqlConnection, CURD_CONF_KEYS,
+    DEFAULT_POOL_MIN_SIZE, DEFAULT_POOL_MAX_SIZE, DEFAULT_POOL_ACQUIRE_TIMEOUT,
+    DEFAULT_POOL_MAX_LIFETIME, DEFAULT_STATEMENT_CACHE_SIZE
+)
+from . import (
+    AsyncBaseConnection, DEFAULT_FILTER_LIMIT, DEFAULT_TIMEOUT,
+    DEFAULT_CHUNK_SIZE
+)
+
+
+class AsyncMysqlConnectionPool(AsyncBaseConnection):
+    '''
+    mysql pool on aiomysql, bound to the event loop it is first used in
+    '''
+    pe_mysql_error_code_list = MysqlConnection.pe_mysql_error_code_list
+    pe_duplicate_entry_key_error_code = \
+        MysqlConnection.pe_duplicate_entry_key_error_code
+
+    of_mysql_error_code_list = MysqlConnection.of_mysql_error_code_list
+    of_mysql_retry_error_code_list = \
+        MysqlConnection.of_mysql_retry_error_code_list
+
+    _wrap_error = MysqlConnection._wrap_error
+    patch_execute_as_tidb = MysqlConnection.patch_execute_as_tidb
+
+    def __init__(self, conf, retry_budget=None):
+        self._conf = conf
+        self.pid = os.getpid()
+        self.pool = None
+        self._pool_lock = None
+
+        self.max_op_fail_retry = conf.get('max_op_fail_retry', 0)
+        self.default_timeout = conf.get('timeout', DEFAULT_TIMEOUT)
+        self.acquire_timeout = conf.get(
+            'pool_acquire_timeout', DEFAULT_POOL_ACQUIRE_TIMEOUT)
+
+        self.statement_cache = LRUCache(conf.get(
+            'statement_cache_size', DEFAULT_STATEMENT_CACHE_SIZE))
+        self.retry_policy = RetryPolicy(conf, retry_budget)
+
+    async def _connect(self, conf):
+        conf = copy.deepcopy(conf)
+
+        minsize = conf.get('pool_min_size', DEFAULT_POOL_MIN_SIZE)
+        maxsize = conf.get('pool_max_size', DEFAULT_POOL_MAX_SIZE)
+        recycle = conf.get('pool_max_lifetime', DEFAULT_POOL_MAX_LIFETIME)
+
+        conf.pop('max_op_fail_retry', None)
+        conf.pop('timeout', None)
+        for key in CURD_CONF_KEYS:
+            conf.pop(key, None)
+
+        conf['use_unicode'] = True
+        conf['charset'] = 'utf8mb4'
+        conf['autocommit'] = True
+
+        if conf.pop('tidb_patch', False):
+            self.patch_execute_as_tidb()
+
+        return await aiomysql.create_pool(
+            minsize=minsize, maxsize=maxsize, pool_recycle=recycle, **conf
+        )
+
+    async def connect(self, conf):
+        if self._pool_lock is None:
+            self._pool_lock = asyncio.Lock()
+        async with self._pool_lock:
+            if self.pool is None:
+                try:
+                    self.pool = await self._connect(conf)
+                except Exception as e:
+                    raise ConnectError(origin_error=e)
+
+    async def close(self):
+        if self.pool:
+            self.pool.close()
+            try:
+                await self.pool.wait_closed()
+            except Exception as e:
+                logger.warning(str(e))
+        self.pool = None
+
+    async def _execute(self, query, params, timeout):
+        if self.pool is None:
+            await self.connect(self._conf)
+
+        try:
+            conn = await asyncio.wait_for(
+                self.pool.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeoutError(
+                'no connection available in {}s'.format(self.acquire_timeout)
+            )
+        except Exception as e:
+            raise ConnectError(origin_error=e)
+
+        try:
+            cursor = await conn.cursor(aiomysql.DictCursor)
+            await asyncio.wait_for(cursor.execute(query, params), timeout)
+            rows = await cursor.fetchall()
+            await cursor.close()
+        except asyncio.TimeoutError as e:
+            # the connection is in the middle of a query, drop it
+            conn.close()
+            raise OperationFailure(origin_error=e)
+        except Exception as e:
+            error = self._wrap_error(e)
+            if not isinstance(error, ProgrammingError):
+                conn.close()
+            raise error
+        else:
+            return list(rows)
+        finally:
+            self.pool.release(conn)
+
+    async def execute(self, query, params=None, retry=None, timeout=None):
+        if os.getpid() != self.pid:
+            # the pool belongs to parent process, abandon it
+            self.pool, self._pool_lock = None, None
+            self.pid = os.getpid()
+
+        if retry is None:
+            retry = self.max_op_fail_retry
+
+        if timeout is None:
+            timeout = self.default_timeout
+
+        retry_no = 0
+        self.retry_policy.before_call()
+        while True:
+            try:
+                rows = await self._execute(query, params, timeout)
+            except OperationFailure as e:
+                delay = self.retry_policy.retry(e, retry_no, retry)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                retry_no += 1
+            except ProgrammingError:
+                self.retry_policy.on_success()
+                raise
+            except Exception as e:
+                self.retry_policy.on_error(e)
+                raise
+            else:
+                self.retry_policy.on_success()
+                return rows
+
+    async def create(self, collection, data, mode='INSERT',
+                     compress_fields=None, update_fields=None, **kwargs):
+        query, params = query_parameters_from_create(
+            collection, data, mode.upper(), compress_fields, update_fields,
+            cache=self.statement_cache
+        )
+        try:
+            await self.execute(query, params, **kwargs)
+        except ProgrammingError as e:
+            if e._origin_error.args[0] == self.pe_duplicate_entry_key_error_code:
+                raise DuplicateKeyError(str(e._origin_error))
+            else:
+                raise
+
+    async def create_many(self, collection, rows, mode='INSERT',
+                          compress_fields=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                          update_fields=None, **kwargs):
+        rows = list(rows)
+        errors = {}
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            query, params = query_parameters_from_create_many(
+                collection, chunk, mode.upper(), compress_fields,
+                update_fields, cache=self.statement_cache
+            )
+            try:
+                await self.execute(query, params, **kwargs)
+            except ProgrammingError as e:
+                if e._origin_error.args[0] != self.pe_duplicate_entry_key_error_code:
+                    raise
+                for index, data in enumerate(chunk, start):
+                    try:
+                        await self.create(
+                            collection, data, mode, compress_fields, **kwargs
+                        )
+                    except DuplicateKeyError as dup_error:
+                        errors[index] = dup_error
+        if errors:
+            raise BatchError(errors)
+
+    async def update(self, collection, data, filters, **kwargs):
+        filters = self._check_filters(filters)
+        query, params = query_parameters_from_update(
+            collection, filters, data, cache=self.statement_cache)
+        await self.execute(query, params, **kwargs)
+
+    async def delete(self, collection, filters, **kwargs):
+        filters = self._check_filters(filters)
+        query, params = query_parameters_from_delete(
+            collection, filters, cache=self.statement_cache)
+        await self.execute(query, params, **kwargs)
+
+    async def filter(self, collection, filters=None, fields=None,
+                     order_by=None, limit=DEFAULT_FILTER_LIMIT, **kwargs):
+        # cache of session is skipped by it, no cache here
+        kwargs.pop('use_cache', None)
+        filters = self._check_filters(filters)
+        query, params = query_parameters_from_filter(
+            collection, filters, fields, order_by, limit,
+            cache=self.statement_cache)
+        return await self.execute(query, params, **kwargs)
@@ -1,18 +1,27 @@
 import os
+import re
 import copy
 import time
-from threading import RLock
+import weakref
+from threading import RLock, Thread
+from collections import deque
 
 from cassandra.auth import PlainTextAuthProvider
 from cassandra.cluster import Cluster
+from cassandra.query import SimpleStatement
+from cassandra.cqlengine.statements import ValueQuoter
 from cassandra import Timeout, OperationTimedOut, InvalidRequest
 
 from ..errors import (
     UnexpectedError, OperationFailure, ProgrammingError,
     ConnectError,
-    DuplicateKeyError
+    DuplicateKeyError, BatchError
 )
 from . import logger
+from .utils import LRUCache, fingerprint
+from .retry import RetryPolicy
+from .utils.rows import Rows, convert_rows, check_row_format
+from ..instrument import HOOKS, OperationEvent, emit
 from .utils.cql import (
     query_parameters_from_create,
     query_parameters_from_update,
@@ -20,25 +29,71 @@ from .utils.cql import (
     query_parameters_from_filter,
 )
 from . import (
-    BaseConnection, DEFAULT_FILTER_LIMIT, DEFAULT_TIMEOUT, OP_RETRY_WARNING
+    BaseConnection, DEFAULT_FILTER_LIMIT, DEFAULT_TIMEOUT,
+    DEFAULT_CHUNK_SIZE, DEFAULT_FETCH_SIZE, DEFAULT_CONCURRENCY,
+    chunk_lookup_values, lookup_fields, collect_lookup_rows,
+    collect_statement_results, check_lookup_row_format
 )
 
 
 TIME_INTERVAL_TO_ACQUIRE_LOCK = 0.5
 
+DEFAULT_PREPARED_STATEMENT_CACHE_SIZE = 512
+
+NAMED_PARAM_PATTERN = re.compile(r'%\((\w+)\)s')
+SCHEMA_CHANGE_PREFIXES = ('CREATE', 'ALTER', 'DROP')
+
+
+_POOLS = weakref.WeakSet()
+
+
+def _reset_pools_after_fork():
+    for pool in list(_POOLS):
+        pool._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
+
+def wrap_error(e):
+    if isinstance(e, (Timeout, OperationTimedOut)):
+        return OperationFailure(origin_error=e)
+    elif isinstance(e, InvalidRequest):
+        return ProgrammingError(origin_error=e)
+    else:
+        return UnexpectedError(origin_error=e)
+
 
 class CassandraConnectionPool(BaseConnection):
+    '''
+    retry_backoff / breaker_failure_threshold ...: see RetryPolicy,
+    circuit breaker is shared by the cluster session, state in `stats()`
+    lwt: create with IF NOT EXISTS (DuplicateKeyError raised) and update
+         with IF EXISTS, off by default, `lwt` of create / update overrides
+    fork_warmup: connect in background in a forked child, the cluster of
+         parent is dropped there without shutdown
+    '''
     
-    def __init__(self, conf):
+    def __init__(self, conf, retry_budget=None):
         self._conf = conf
         self.pid = os.getpid()
         self.cluster, self.session = None, None
 
         self.max_op_fail_retry = conf.get('max_op_fail_retry', 0)
         self.default_timeout = conf.get('timeout', DEFAULT_TIMEOUT)
+        self.lwt = conf.get('lwt', False)
 
         self.cluster_init_lock = RLock()
         
+        # query -> (PreparedStatement, param names)
+        self.prepared_cache = LRUCache(conf.get(
+            'prepared_statement_cache_size',
+            DEFAULT_PREPARED_STATEMENT_CACHE_SIZE
+        ))
+        self.retry_policy = RetryPolicy(conf, retry_budget)
+        _POOLS.add(self)
+        
     def _connect(self, conf):
         conf = copy.deepcopy(conf)
 
@@ -87,26 +142,218 @@ class CassandraConnectionPool(BaseConnection):
                 logger.warning(str(e))
 
         self.cluster, self.session = None, None
+        self.prepared_cache.clear()
+
+    def discard(self):
+        '''
+        forget cluster of parent process, its io threads are not running in
+        forked child and shutdown would close sockets of parent
+        '''
+        self.cluster, self.session = None, None
+        self.prepared_cache = LRUCache(self.prepared_cache.maxsize)
+        self.pid = os.getpid()
+
+    def warmup(self, n=None):
+        '''
+        connect the cluster session now instead of at first operation
+        '''
+        if self.session:
+            return 0
+        self.connect(self._conf)
+        return 1
+
+    def _after_fork(self):
+        self.cluster_init_lock = RLock()
+        self.discard()
+        self.retry_policy._after_fork()
+        if self._conf.get('fork_warmup'):
+            def warmup():
+                try:
+                    self.warmup()
+                except Exception as e:
+                    logger.warning(str(e))
+            Thread(target=warmup, daemon=True).start()
+
+    def stats(self):
+        return {
+            'prepared_cache': self.prepared_cache.stats(),
+            'retry': self.retry_policy.stats(),
+        }
+        
+    def _prepare(self, query, params):
+        '''
+        prepare query with named params like %(0)s once, return bound statement
+        '''
+        if not self.prepared_cache.maxsize or not isinstance(params, dict):
+            return query, params
+        
+        cached = self.prepared_cache.get(query)
+        if cached is None:
+            names = []
+            
+            def replace(match):
+                names.append(match.group(1))
+                return '?'
+                
+            prepared = self.session.prepare(
+                NAMED_PARAM_PATTERN.sub(replace, query))
+            cached = (prepared, names)
+            self.prepared_cache.set(query, cached)
+        
+        prepared, names = cached
+        values = []
+        for name in names:
+            value = params[name]
+            if isinstance(value, ValueQuoter):
+                value = value.value
+            values.append(value)
+        return prepared.bind(values), None
+    
+    def _on_error(self, query, e):
+        if not isinstance(e, (Timeout, OperationTimedOut)):
+            # stale prepared statement after schema change
+            self.prepared_cache.pop(query)
         
     def _execute(self, query, params, **kwargs):
         if not self.session:
             self.connect(self._conf)
         
         try:
-            result = list(self.session.execute(query, params, **kwargs))
-        except (Timeout, OperationTimedOut) as e:
-            raise OperationFailure(origin_error=e)
-        except InvalidRequest as e:
-            raise ProgrammingError(origin_error=e)
+            statement, params = self._prepare(query, params)
+            result = self.session.execute(statement, params, **kwargs)
+            result = Rows(result, result.column_names or ())
         except Exception as e:
-            raise UnexpectedError(origin_error=e)
+            self._on_error(query, e)
+            raise wrap_error(e)
         else:
+            if query.lstrip()[:6].upper() in SCHEMA_CHANGE_PREFIXES:
+                self.prepared_cache.clear()
             return result
+    
+    def _execute_all(self, statements, concurrency, timeout,
+                     row_format='dict'):
+        if not self.session:
+            self.connect(self._conf)
+        
+        results = []
+        inflight = deque()
         
-    def execute(self, query, params=None, retry=None, timeout=None):
+        def collect():
+            query, future = inflight.popleft()
+            try:
+                if isinstance(future, Exception):
+                    raise future
+                rows = future.result()
+                if row_format == 'dict':
+                    results.append([row._asdict() for row in rows])
+                else:
+                    results.append(convert_rows(
+                        rows.column_names or (), list(rows), row_format))
+            except Exception as e:
+                self._on_error(query, e)
+                results.append(wrap_error(e))
+                
+        for query, params in statements:
+            if len(inflight) >= concurrency:
+                collect()
+            try:
+                statement, params = self._prepare(query, params)
+                future = self.session.execute_async(
+                    statement, params, timeout=timeout)
+            except Exception as e:
+                future = e
+            inflight.append((query, future))
+        while inflight:
+            collect()
+        return results
+    
+    def _execute_concurrent(self, op, collection, build_time, statements,
+                            concurrency, retry=None, timeout=None,
+                            row_format='dict'):
+        '''
+        execute (query, params) pairs with at most `concurrency` in flight,
+        return rows or error of each statement in input order
+        '''
+        check_row_format(row_format)
         if os.getpid() != self.pid:
-            self.close()
-            self.pid = os.getpid()
+            self.discard()
+
+        if retry is None:
+            retry = self.max_op_fail_retry
+
+        if timeout is None:
+            timeout = self.default_timeout
+        
+        start = time.perf_counter()
+        results = [None] * len(statements)
+        pending = list(range(len(statements)))
+        retry_no = 0
+        self.retry_policy.before_call()
+        while True:
+            failed = []
+            pending_results = self._execute_all(
+                [statements[i] for i in pending], concurrency, timeout,
+                row_format
+            )
+            for index, result in zip(pending, pending_results):
+                results[index] = result
+                if isinstance(result, OperationFailure):
+                    failed.append(index)
+            if not failed:
+                errors = [r for r in results if isinstance(r, Exception)]
+                if not errors or len(errors) < len(results):
+                    self.retry_policy.on_success()
+                elif errors:
+                    # no statement answered, host health unknown
+                    self.retry_policy.on_error(errors[0])
+                break
+            delay = self.retry_policy.retry(
+                results[failed[0]], retry_no, retry)
+            if delay is None:
+                break
+            time.sleep(delay)
+            retry_no += 1
+            pending = failed
+        
+        if HOOKS and statements:
+            errors = [r for r in results if isinstance(r, Exception)]
+            emit(OperationEvent(
+                'cassandra', op, collection,
+                statements[0][0], statements[0][1],
+                fingerprint(statements[0][0]),
+                build_time=build_time,
+                network_time=time.perf_counter() - start,
+                rows=sum(len(r) for r in results if isinstance(r, list)),
+                retries=retry_no,
+                error=type(errors[0]).__name__ if errors else None
+            ))
+        return results
+        
+    def execute_concurrent(self, statements, concurrency=DEFAULT_CONCURRENCY,
+                           **kwargs):
+        '''
+        execute (query, params) pairs concurrently, return rows of each
+        in input order, raise BatchError with errors by index
+        '''
+        return collect_statement_results(self._execute_concurrent(
+            'execute_concurrent', None, 0, list(statements), concurrency,
+            **kwargs
+        ))
+        
+    def execute(self, query, params=None, retry=None, timeout=None,
+                row_format='dict'):
+        return self._execute_op(
+            'execute', None, 0, query, params, retry, timeout, row_format)
+    
+    def _execute_op(self, op, collection, build_time, query, params=None,
+                    retry=None, timeout=None, row_format='dict'):
+        '''
+        row_format: dict / tuple / columnar / numpy / pandas, see convert_rows,
+        rows of driver are namedtuples already
+        '''
+        check_row_format(row_format)
+        if os.getpid() != self.pid:
+            self.discard()
 
         if retry is None:
             retry = self.max_op_fail_retry
@@ -114,46 +361,235 @@ class CassandraConnectionPool(BaseConnection):
         if timeout is None:
             timeout = self.default_timeout
 
+        start = time.perf_counter()
+        network_time, rows, error = None, None, None
         retry_no = 0
-        while True:
-            try:
-                rows = self._execute(query, params, timeout=timeout)
-            except OperationFailure as e:
-                # self.close()
-                if retry_no < retry:
-                    logger.warning(OP_RETRY_WARNING.format(str(e)))
+        try:
+            self.retry_policy.before_call()
+            while True:
+                try:
+                    rows = self._execute(query, params, timeout=timeout)
+                except OperationFailure as e:
+                    # self.close()
+                    delay = self.retry_policy.retry(e, retry_no, retry)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
                     retry_no += 1
+                except ProgrammingError:
+                    self.retry_policy.on_success()
+                    raise
+                except (UnexpectedError, Exception, KeyboardInterrupt) as e:
+                    self.close()
+                    self.retry_policy.on_error(e)
+                    raise
                 else:
+                    self.retry_policy.on_success()
+                    network_time = time.perf_counter() - start
+                    if row_format == 'dict':
+                        return [row._asdict() for row in rows]
+                    return convert_rows(rows.columns, rows, row_format)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if HOOKS:
+                end = time.perf_counter()
+                if network_time is None:
+                    network_time = end - start
+                emit(OperationEvent(
+                    'cassandra', op, collection, query, params,
+                    fingerprint(query),
+                    build_time=build_time,
+                    network_time=network_time,
+                    convert_time=end - start - network_time,
+                    rows=len(rows) if rows else 0,
+                    retries=retry_no,
+                    error=type(error).__name__ if error else None
+                ))
+        
+    def _execute_page(self, query, params, batch_size, paging_state, timeout):
+        if not self.session:
+            self.connect(self._conf)
+        
+        try:
+            statement, params = self._prepare(query, params)
+            if isinstance(statement, str):
+                statement = SimpleStatement(statement)
+            statement.fetch_size = batch_size
+            return self.session.execute(
+                statement, params, timeout=timeout, paging_state=paging_state
+            )
+        except Exception as e:
+            self._on_error(query, e)
+            raise wrap_error(e)
+    
+    def iter_execute(self, query, params=None, batch_size=DEFAULT_FETCH_SIZE,
+                     retry=None, timeout=None):
+        '''
+        yield rows fetched `batch_size` at a time with driver paging,
+        each page is retried from its paging state
+        '''
+        if os.getpid() != self.pid:
+            self.discard()
+
+        if retry is None:
+            retry = self.max_op_fail_retry
+
+        if timeout is None:
+            timeout = self.default_timeout
+        
+        paging_state = None
+        while True:
+            retry_no = 0
+            self.retry_policy.before_call()
+            while True:
+                try:
+                    result = self._execute_page(
+                        query, params, batch_size, paging_state, timeout
+                    )
+                except OperationFailure as e:
+                    delay = self.retry_policy.retry(e, retry_no, retry)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    retry_no += 1
+                except ProgrammingError:
+                    self.retry_policy.on_success()
                     raise
-            except ProgrammingError:
+                except (UnexpectedError, Exception, KeyboardInterrupt) as e:
+                    self.close()
+                    self.retry_policy.on_error(e)
                     raise
-            except (UnexpectedError, Exception, KeyboardInterrupt):
-                self.close()
-                raise
-            else:
-                return [row._asdict() for row in rows]
+                else:
+                    self.retry_policy.on_success()
+                    break
+            for row in result.current_rows:
+                yield row._asdict()
+            paging_state = result.paging_state
+            if not paging_state:
+                break
         
-    def create(self, collection, data, mode='INSERT', **kwargs):
+    def create(self, collection, data, mode='INSERT', lwt=None, **kwargs):
+        if lwt is None:
+            lwt = self.lwt
+        start = time.perf_counter()
         query, params = query_parameters_from_create(
-            collection, data, mode.upper())
-        rows = self.execute(query, params, **kwargs)
+            collection, data, mode.upper(), lwt)
+        rows = self._execute_op(
+            'create', collection, time.perf_counter() - start,
+            query, params, **kwargs
+        )
         if rows and mode.upper() != 'IGNORE' and not rows[0].get('applied', True):
             raise DuplicateKeyError
+    
+    def create_many(self, collection, rows, mode='INSERT',
+                    chunk_size=DEFAULT_CHUNK_SIZE, lwt=None, **kwargs):
+        '''
+        insert rows with concurrent executes, at most `chunk_size` in flight,
+        raise BatchError with errors of each failed row
+        '''
+        if lwt is None:
+            lwt = self.lwt
+        # rows of lwt results are read as dict, nothing returned
+        kwargs.pop('row_format', None)
+        start = time.perf_counter()
+        statements = [
+            query_parameters_from_create(collection, data, mode.upper(), lwt)
+            for data in rows
+        ]
+        results = self._execute_concurrent(
+            'create_many', collection, time.perf_counter() - start,
+            statements, chunk_size, **kwargs
+        )
+        errors = {}
+        for index, result in enumerate(results):
+            if isinstance(result, Exception):
+                errors[index] = result
+            elif (result and mode.upper() != 'IGNORE' and
+                    not result[0].get('applied', True)):
+                errors[index] = DuplicateKeyError()
+        if errors:
+            raise BatchError(errors)
 
-    def update(self, collection, data, filters, **kwargs):
+    def update(self, collection, data, filters, lwt=None, **kwargs):
+        if lwt is None:
+            lwt = self.lwt
+        start = time.perf_counter()
         filters = self._check_filters(filters)
-        query, params = query_parameters_from_update(collection, filters, data)
-        self.execute(query, params, **kwargs)
+        query, params = query_parameters_from_update(
+            collection, filters, data, lwt)
+        self._execute_op(
+            'update', collection, time.perf_counter() - start,
+            query, params, **kwargs
+        )
         
     def delete(self, collection, filters, **kwargs):
+        start = time.perf_counter()
         filters = self._check_filters(filters)
         query, params = query_parameters_from_delete(collection, filters)
-        self.execute(query, params, **kwargs)
+        self._execute_op(
+            'delete', collection, time.perf_counter() - start,
+            query, params, **kwargs
+        )
         
     def filter(self, collection, filters=None, fields=None,
                order_by=None, limit=DEFAULT_FILTER_LIMIT, **kwargs):
+        # cache of session is skipped by it, no cache here
+        kwargs.pop('use_cache', None)
+        start = time.perf_counter()
         filters = self._check_filters(filters)
         query, params = query_parameters_from_filter(
             collection, filters, fields, order_by, limit)
-        rows = self.execute(query, params, **kwargs)
+        rows = self._execute_op(
+            'filter', collection, time.perf_counter() - start,
+            query, params, **kwargs
+        )
         return rows
+    
+    def get_many(self, collection, key, values, fields=None, as_dict=False,
+                 chunk_size=1, concurrency=DEFAULT_CONCURRENCY, **kwargs):
+        '''
+        concurrent lookups of `key` in values, a point lookup per value by
+        default (routed to its replica), `IN` of at most `chunk_size` values
+        when chunk_size > 1,
+        return rows (or None) in input order, or a dict of value -> row,
+        raise BatchError with errors by value
+        '''
+        check_lookup_row_format(kwargs)
+        start = time.perf_counter()
+        values = list(values)
+        chunks = chunk_lookup_values(values, chunk_size)
+        query_fields = lookup_fields(fields, key)
+        statements = [
+            query_parameters_from_filter(
+                collection, [('=', key, chunk[0])], query_fields, limit=1)
+            if len(chunk) == 1 else
+            query_parameters_from_filter(
+                collection, [('IN', key, chunk)], query_fields)
+            for chunk in chunks
+        ]
+        results = self._execute_concurrent(
+            'get_many', collection, time.perf_counter() - start,
+            statements, concurrency, **kwargs
+        )
+        return collect_lookup_rows(
+            key, values, chunks, results, fields, as_dict)
+    
+    def iter_filter(self, collection, filters=None, fields=None,
+                    order_by=None, limit=DEFAULT_FILTER_LIMIT,
+                    batch_size=DEFAULT_FETCH_SIZE, **kwargs):
+        filters = self._check_filters(filters)
+        query, params = query_parameters_from_filter(
+            collection, filters, fields, order_by, limit)
+        yield from self.iter_execute(query, params, batch_size, **kwargs)
+    
+    def scan(self, collection, key=None, batch_size=DEFAULT_FETCH_SIZE,
+             filters=None, fields=None, prefetch=True, **kwargs):
+        '''
+        partition keys can only be ranged by token, so rows are paged by the
+        driver in token order, `key` and `prefetch` are ignored
+        '''
+        return self.iter_filter(
+            collection, filters, fields, batch_size=batch_size, **kwargs
+        )
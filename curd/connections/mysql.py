@@ -1,25 +1,37 @@
 import os
 import copy
-import queue
-from functools import partial
+import time
+import weakref
+from collections import deque
+from functools import partial, wraps
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Lock, Thread, local
 
 import pymysql
 
 from ..errors import (
     UnexpectedError, OperationFailure, ProgrammingError,
-    ConnectError,
-    DuplicateKeyError
+    ConnectError, PoolTimeoutError, WrappedError,
+    DuplicateKeyError, BatchError
 )
 from . import logger
+from .utils import LRUCache, fingerprint
+from .retry import RetryPolicy, RETRY_CONF_KEYS
+from .utils.rows import convert_rows, check_row_format
+from ..instrument import HOOKS, OperationEvent, emit
 from .utils.sql import (
     query_parameters_from_create,
+    query_parameters_from_create_many,
     query_parameters_from_update,
     query_parameters_from_delete,
     query_parameters_from_filter
 )
 from . import (
-    BaseConnection, DEFAULT_FILTER_LIMIT, DEFAULT_TIMEOUT, OP_RETRY_WARNING,
-    CURD_FUNCTIONS
+    BaseConnection, DEFAULT_FILTER_LIMIT, DEFAULT_TIMEOUT,
+    DEFAULT_CHUNK_SIZE, DEFAULT_FETCH_SIZE, DEFAULT_CONCURRENCY,
+    DEFAULT_GET_MANY_CHUNK_SIZE, CURD_FUNCTIONS, ITER_FUNCTIONS,
+    scan_by_keyset, chunk_lookup_values, lookup_fields, collect_lookup_rows,
+    collect_statement_results, check_lookup_row_format
 )
 
 # https://www.briandunning.com/error-codes/?source=MySQL
@@ -48,6 +60,57 @@ OF_TIDB_ERROR_CODE_LIST = OF_MYSQL_ERROR_CODE_LIST + \
 OF_TIDB_RETRY_ERROR_CODE_LIST = OF_MYSQL_RETRY_ERROR_CODE_LIST + \
                                 TIDB_ADDITION_ERROR_CODE_LIST
 
+DEFAULT_POOL_MIN_SIZE = 0
+DEFAULT_POOL_MAX_SIZE = 32
+DEFAULT_POOL_ACQUIRE_TIMEOUT = 60
+DEFAULT_POOL_MAX_IDLE_TIME = 600
+DEFAULT_POOL_MAX_LIFETIME = 3600
+DEFAULT_POOL_PING_INTERVAL = 30
+DEFAULT_STATEMENT_CACHE_SIZE = 1024
+DEFAULT_REPLICA_EJECT_TIME = 30
+DEFAULT_POOL_FORK_WARMUP = 0
+
+READ_STRATEGIES = ('round_robin', 'least_inflight')
+REPLICA_SET_CONF_KEYS = (
+    'primary', 'replicas', 'read_strategy', 'replica_eject_time',
+    'read_after_write_pin'
+)
+READ_FUNCTIONS = ('get', 'filter', 'exist', 'get_many')
+
+CURD_CONF_KEYS = (
+    'pool_min_size', 'pool_max_size', 'pool_acquire_timeout',
+    'pool_max_idle_time', 'pool_max_lifetime', 'pool_ping_interval',
+    'pool_fork_warmup', 'statement_cache_size'
+) + RETRY_CONF_KEYS
+
+_POOLS = weakref.WeakSet()
+
+
+def _reset_pools_after_fork():
+    for pool in list(_POOLS):
+        pool._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    # sockets of parent are dropped in child before anything uses them
+    os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
+
+def result_columns(cursor):
+    '''
+    names of result columns, a duplicated name is prefixed by its table
+    like DictCursor does
+    '''
+    columns = [d[0] for d in cursor.description or ()]
+    if len(set(columns)) < len(columns):
+        columns = []
+        for field in cursor._result.fields:
+            name = field.name
+            if name in columns:
+                name = field.table_name + '.' + name
+            columns.append(name)
+    return columns
+
 
 class MysqlConnection(BaseConnection):
     pe_mysql_error_code_list = PE_MYSQL_ERROR_CODE_LIST
@@ -56,10 +119,25 @@ class MysqlConnection(BaseConnection):
     of_mysql_error_code_list = OF_MYSQL_ERROR_CODE_LIST
     of_mysql_retry_error_code_list = OF_MYSQL_RETRY_ERROR_CODE_LIST
     
-    def __init__(self, conf):
+    def __init__(self, conf, statement_cache=None, retry_policy=None):
         self._conf = conf
         self.pid = os.getpid()
         self.conn, self.cursor = None, None
+        self.connected_at, self.last_used_at = None, time.time()
+        # seconds waited in pool for current checkout
+        self.pool_wait_time = 0
+        self.pool_generation = 0
+        # statements run in an explicit transaction, no retry or reconnect
+        self.in_transaction = False
+        
+        if statement_cache is None:
+            statement_cache = LRUCache(conf.get(
+                'statement_cache_size', DEFAULT_STATEMENT_CACHE_SIZE))
+        self.statement_cache = statement_cache
+        
+        if retry_policy is None:
+            retry_policy = RetryPolicy(conf)
+        self.retry_policy = retry_policy
 
         self.max_op_fail_retry = conf.get('max_op_fail_retry', 0)
         self.default_timeout = conf.get('timeout', DEFAULT_TIMEOUT)
@@ -69,6 +147,8 @@ class MysqlConnection(BaseConnection):
 
         self.max_op_fail_retry = conf.pop('max_op_fail_retry', 0)
         self.default_timeout = conf.pop('timeout', DEFAULT_TIMEOUT)
+        for key in CURD_CONF_KEYS:
+            conf.pop(key, None)
         
         conf['use_unicode'] = True
         conf['charset'] = 'utf8mb4'
@@ -81,7 +161,8 @@ class MysqlConnection(BaseConnection):
             self.patch_execute_as_tidb()
 
         conn = pymysql.connect(**conf)
-        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        # rows fetched as tuples, converted after network time is taken
+        cursor = conn.cursor()
         return conn, cursor
     
     def connect(self, conf):
@@ -89,6 +170,22 @@ class MysqlConnection(BaseConnection):
             self.conn, self.cursor = self._connect(conf)
         except Exception as e:
             raise ConnectError(origin_error=e)
+        self.connected_at = time.time()
+    
+    def ping(self):
+        '''
+        check the socket is still alive, close it if not
+        '''
+        if not self.conn:
+            return True
+        try:
+            self.conn.ping(reconnect=False)
+        except Exception as e:
+            logger.warning(str(e))
+            self.close()
+            return False
+        else:
+            return True
     
     def close(self):
         if self.cursor:
@@ -104,126 +201,1030 @@ class MysqlConnection(BaseConnection):
                 logger.warning(str(e))
 
         self.conn, self.cursor = None, None
+        self.connected_at = None
+    
+    def discard(self):
+        '''
+        drop socket inherited from parent process without COM_QUIT,
+        parent keeps its session
+        '''
+        if self.conn:
+            try:
+                self.conn._force_close()
+            except Exception as e:
+                logger.warning(str(e))
+        self.conn, self.cursor = None, None
+        self.connected_at = None
+        self.in_transaction = False
+        self.pid = os.getpid()
+        
+    def _wrap_error(self, e):
+        if isinstance(e, pymysql.err.ProgrammingError):
+            return ProgrammingError(origin_error=e)
+        elif isinstance(e.args, tuple) and len(e.args) >= 1:
+            if e.args[0] in self.pe_mysql_error_code_list:
+                return ProgrammingError(origin_error=e)
+            elif e.args[0] in self.of_mysql_error_code_list:
+                return OperationFailure(origin_error=e)
+            else:
+                return UnexpectedError(origin_error=e)
+        else:
+            return UnexpectedError(origin_error=e)
         
-    def _execute(self, query, params, timeout):
+    def _execute(self, query, params, timeout, cursor_class=None):
         if not self.cursor:
+            if self.in_transaction:
+                raise OperationFailure('connection lost in transaction')
             self.connect(self._conf)
             
         self.conn._read_timeout = timeout
         self.conn._write_timeout = timeout
         
+        if cursor_class:
+            cursor = self.conn.cursor(cursor_class)
+        else:
+            cursor = self.cursor
+        
         try:
-            self.cursor.execute(query, params)
-        except pymysql.err.ProgrammingError as e:
-            raise ProgrammingError(origin_error=e)
+            cursor.execute(query, params)
         except Exception as e:
-            if isinstance(e.args, tuple) and len(e.args) >= 1:
-                if e.args[0] in self.pe_mysql_error_code_list:
-                    raise ProgrammingError(origin_error=e)
-                elif e.args[0] in self.of_mysql_error_code_list:
-                    raise OperationFailure(origin_error=e)
-                else:
-                    raise UnexpectedError(origin_error=e)
-            else:
-                raise UnexpectedError(origin_error=e)
+            raise self._wrap_error(e)
         else:
-            return list(self.cursor.fetchall())
+            if cursor_class:
+                return cursor
+            return result_columns(cursor), cursor.fetchall()
             
-    def execute(self, query, params=None, retry=None, timeout=None):
+    def execute(self, query, params=None, retry=None, timeout=None,
+                row_format='dict'):
+        return self._execute_op(
+            'execute', None, 0, query, params, retry, timeout, row_format)
+    
+    def _execute_op(self, op, collection, build_time, query, params=None,
+                    retry=None, timeout=None, row_format='dict'):
+        '''
+        row_format: dict / tuple / columnar / numpy / pandas, see convert_rows
+        '''
+        check_row_format(row_format)
         if os.getpid() != self.pid:
-            self.close()
-            self.pid = os.getpid()
+            self.discard()
 
         if retry is None:
             retry = self.max_op_fail_retry
+        if self.in_transaction:
+            retry = 0
             
         if timeout is None:
             timeout = self.default_timeout
-            
+        
+        pool_wait_time, self.pool_wait_time = self.pool_wait_time, 0
+        start = time.perf_counter()
+        network_time, rows, error = None, None, None
         retry_no = 0
+        try:
+            self.retry_policy.before_call()
+            while True:
+                try:
+                    columns, rows = self._execute(query, params, timeout)
+                except OperationFailure as e:
+                    self.close()
+                    delay = self.retry_policy.retry(e, retry_no, retry)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    retry_no += 1
+                except ProgrammingError:
+                    self.retry_policy.on_success()
+                    raise
+                except (UnexpectedError, Exception, KeyboardInterrupt) as e:
+                    self.close()
+                    self.retry_policy.on_error(e)
+                    raise
+                else:
+                    self.retry_policy.on_success()
+                    network_time = time.perf_counter() - start
+                    return convert_rows(columns, rows, row_format)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if HOOKS:
+                end = time.perf_counter()
+                if network_time is None:
+                    network_time = end - start
+                emit(OperationEvent(
+                    'mysql', op, collection, query, params,
+                    fingerprint(query),
+                    build_time=build_time,
+                    pool_wait_time=pool_wait_time,
+                    network_time=network_time,
+                    convert_time=end - start - network_time,
+                    rows=len(rows) if rows else 0,
+                    retries=retry_no,
+                    error=type(error).__name__ if error else None
+                ))
+
+    def iter_execute(self, query, params=None, batch_size=DEFAULT_FETCH_SIZE,
+                     retry=None, timeout=None):
+        '''
+        yield rows fetched `batch_size` at a time with a server side cursor,
+        retry only happens before the first row
+        '''
+        if os.getpid() != self.pid:
+            self.discard()
+
+        if retry is None:
+            retry = self.max_op_fail_retry
+        if self.in_transaction:
+            retry = 0
+
+        if timeout is None:
+            timeout = self.default_timeout
+
+        retry_no = 0
+        self.retry_policy.before_call()
         while True:
             try:
-                rows = self._execute(query, params, timeout)
+                cursor = self._execute(
+                    query, params, timeout, pymysql.cursors.SSDictCursor
+                )
             except OperationFailure as e:
                 self.close()
-                if retry_no < retry:
-                    logger.warning(OP_RETRY_WARNING.format(str(e)))
-                    retry_no += 1
-                else:
+                delay = self.retry_policy.retry(e, retry_no, retry)
+                if delay is None:
                     raise
+                time.sleep(delay)
+                retry_no += 1
             except ProgrammingError:
+                self.retry_policy.on_success()
                 raise
-            except (UnexpectedError, Exception, KeyboardInterrupt):
+            except (UnexpectedError, Exception, KeyboardInterrupt) as e:
                 self.close()
+                self.retry_policy.on_error(e)
                 raise
             else:
-                return rows
+                self.retry_policy.on_success()
+                break
+        
+        finished = False
+        try:
+            while True:
+                try:
+                    rows = cursor.fetchmany(batch_size)
+                except Exception as e:
+                    raise self._wrap_error(e)
+                if not rows:
+                    finished = True
+                    break
+                yield from rows
+        finally:
+            if finished:
+                cursor.close()
+            else:
+                # skipping the rest of an unbuffered result means reading it
+                # all, drop the socket instead
+                self._drop_unbuffered(cursor)
+
+    def _drop_unbuffered(self, cursor):
+        '''
+        close socket without QUIT, the unread result is detached so neither
+        cursor nor result read it when collected
+        '''
+        result, cursor._result = cursor._result, None
+        if result is not None:
+            result.unbuffered_active = False
+        cursor.connection = None
+        if self.conn:
+            self.conn._result = None
+            try:
+                self.conn._force_close()
+            except Exception as e:
+                logger.warning(str(e))
+        self.conn, self.cursor = None, None
+        self.connected_at = None
 
-    def create(self, collection, data, mode='INSERT', compress_fields=None, **kwargs):
+    def create(self, collection, data, mode='INSERT', compress_fields=None,
+               update_fields=None, **kwargs):
+        '''
+        mode: INSERT / IGNORE / REPLACE / UPSERT,
+        UPSERT updates `update_fields` (all fields by default) of the row
+        with duplicated key by ON DUPLICATE KEY UPDATE
+        '''
+        start = time.perf_counter()
         query, params = query_parameters_from_create(
-            collection, data, mode.upper(), compress_fields
+            collection, data, mode.upper(), compress_fields, update_fields,
+            cache=self.statement_cache
         )
         try:
-            self.execute(query, params, **kwargs)
+            self._execute_op(
+                'create', collection, time.perf_counter() - start,
+                query, params, **kwargs
+            )
         except ProgrammingError as e:
             if e._origin_error.args[0] == self.pe_duplicate_entry_key_error_code:
                 raise DuplicateKeyError(str(e._origin_error))
             else:
                 raise
+    
+    def create_many(self, collection, rows, mode='INSERT', compress_fields=None,
+                    chunk_size=DEFAULT_CHUNK_SIZE, update_fields=None,
+                    **kwargs):
+        '''
+        insert rows with one multi-row statement per chunk,
+        raise BatchError with DuplicateKeyError of each duplicated row
+        '''
+        rows = list(rows)
+        errors = {}
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            build_start = time.perf_counter()
+            query, params = query_parameters_from_create_many(
+                collection, chunk, mode.upper(), compress_fields,
+                update_fields, cache=self.statement_cache
+            )
+            try:
+                self._execute_op(
+                    'create_many', collection,
+                    time.perf_counter() - build_start, query, params, **kwargs
+                )
+            except ProgrammingError as e:
+                if e._origin_error.args[0] != self.pe_duplicate_entry_key_error_code:
+                    raise
+                # the statement is rolled back as a whole, find out which
+                # rows are duplicated by inserting them one by one
+                for index, data in enumerate(chunk, start):
+                    try:
+                        self.create(
+                            collection, data, mode, compress_fields, **kwargs
+                        )
+                    except DuplicateKeyError as dup_error:
+                        errors[index] = dup_error
+        if errors:
+            raise BatchError(errors)
 
     def update(self, collection, data, filters, **kwargs):
+        start = time.perf_counter()
         filters = self._check_filters(filters)
-        query, params = query_parameters_from_update(collection, filters, data)
-        self.execute(query, params, **kwargs)
+        query, params = query_parameters_from_update(
+            collection, filters, data, cache=self.statement_cache)
+        self._execute_op(
+            'update', collection, time.perf_counter() - start,
+            query, params, **kwargs
+        )
 
     def delete(self, collection, filters, **kwargs):
+        start = time.perf_counter()
         filters = self._check_filters(filters)
-        query, params = query_parameters_from_delete(collection, filters)
-        self.execute(query, params, **kwargs)
+        query, params = query_parameters_from_delete(
+            collection, filters, cache=self.statement_cache)
+        self._execute_op(
+            'delete', collection, time.perf_counter() - start,
+            query, params, **kwargs
+        )
         
     def filter(self, collection, filters=None, fields=None,
                order_by=None, limit=DEFAULT_FILTER_LIMIT, **kwargs):
+        # cache of session is skipped by it, no cache here
+        kwargs.pop('use_cache', None)
+        start = time.perf_counter()
         filters = self._check_filters(filters)
         query, params = query_parameters_from_filter(
-            collection, filters, fields, order_by, limit)
-        rows = self.execute(query, params, **kwargs)
+            collection, filters, fields, order_by, limit,
+            cache=self.statement_cache)
+        rows = self._execute_op(
+            'filter', collection, time.perf_counter() - start,
+            query, params, **kwargs
+        )
         return rows
     
+    def iter_filter(self, collection, filters=None, fields=None,
+                    order_by=None, limit=DEFAULT_FILTER_LIMIT,
+                    batch_size=DEFAULT_FETCH_SIZE, **kwargs):
+        filters = self._check_filters(filters)
+        query, params = query_parameters_from_filter(
+            collection, filters, fields, order_by, limit,
+            cache=self.statement_cache)
+        yield from self.iter_execute(query, params, batch_size, **kwargs)
+    
+    def _get_chunk(self, collection, key, chunk, fields, **kwargs):
+        start = time.perf_counter()
+        query, params = query_parameters_from_filter(
+            collection, [('IN', key, chunk)], lookup_fields(fields, key),
+            cache=self.statement_cache)
+        return self._execute_op(
+            'get_many', collection, time.perf_counter() - start,
+            query, params, **kwargs
+        )
+    
+    def get_many(self, collection, key, values, fields=None, as_dict=False,
+                 chunk_size=DEFAULT_GET_MANY_CHUNK_SIZE,
+                 concurrency=DEFAULT_CONCURRENCY, **kwargs):
+        '''
+        lookups of `key` in values by `IN` of at most `chunk_size` values,
+        chunks run one by one on this connection, see pool for concurrency
+        '''
+        check_lookup_row_format(kwargs)
+        values = list(values)
+        chunks = chunk_lookup_values(values, chunk_size)
+        results = []
+        for chunk in chunks:
+            try:
+                results.append(
+                    self._get_chunk(collection, key, chunk, fields, **kwargs))
+            except (OperationFailure, UnexpectedError) as e:
+                results.append(e)
+        return collect_lookup_rows(
+            key, values, chunks, results, fields, as_dict)
+    
+    def _execute_statement(self, statement, **kwargs):
+        query, params = statement
+        try:
+            return self.execute(query, params, **kwargs)
+        except (WrappedError, DuplicateKeyError) as e:
+            return e
+    
+    def execute_concurrent(self, statements, concurrency=DEFAULT_CONCURRENCY,
+                           **kwargs):
+        '''
+        execute (query, params) pairs one by one on this connection, see
+        pool for concurrency, return rows of each in input order,
+        raise BatchError with errors by index
+        '''
+        return collect_statement_results([
+            self._execute_statement(statement, **kwargs)
+            for statement in statements
+        ])
+    
+    def scan(self, collection, key='id', batch_size=DEFAULT_FETCH_SIZE,
+             filters=None, fields=None, prefetch=False, **kwargs):
+        '''
+        pages are fetched one by one, a prefetch thread would share the
+        socket with caller (like writes in a pinned scan)
+        '''
+        return scan_by_keyset(
+            self.filter, collection, key, batch_size, filters, fields,
+            False, **kwargs
+        )
+    
+    def begin(self):
+        if not self.cursor:
+            self.connect(self._conf)
+        try:
+            self.conn.begin()
+        except Exception as e:
+            self.close()
+            raise self._wrap_error(e)
+        self.in_transaction = True
+    
+    def commit(self):
+        self.in_transaction = False
+        if not self.conn:
+            raise OperationFailure('connection lost in transaction')
+        try:
+            self.conn.commit()
+        except Exception as e:
+            self.close()
+            raise self._wrap_error(e)
+    
+    def rollback(self):
+        self.in_transaction = False
+        if not self.conn:
+            return
+        try:
+            self.conn.rollback()
+        except Exception as e:
+            logger.warning(str(e))
+            self.close()
+        
     def patch_execute_as_tidb(self):
         self.of_mysql_error_code_list = OF_TIDB_ERROR_CODE_LIST
         self.of_mysql_retry_error_code_list = OF_TIDB_RETRY_ERROR_CODE_LIST
 
 
+class MysqlTransaction(object):
+    '''
+    operations of CURD_FUNCTIONS on one connection checked out of pool,
+    in a transaction committed on exit or rolled back on error when
+    `transaction` is True, statements are not retried in a transaction
+    
+    with session.transaction() as tx:
+        tx.create(collection, item)
+        tx.update(collection, data, filters)
+    '''
+    
+    def __init__(self, pool, transaction=True):
+        self.pool = pool
+        self.transaction = transaction
+        self.conn = None
+    
+    def __enter__(self):
+        if self.conn is not None:
+            raise ProgrammingError('transaction is already entered')
+        conn = self.pool.acquire()
+        if self.transaction:
+            try:
+                conn.begin()
+            except:
+                self.pool.release(conn)
+                raise
+        self.conn = conn
+        for func in CURD_FUNCTIONS:
+            setattr(self, func, getattr(conn, func))
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        conn, self.conn = self.conn, None
+        for func in CURD_FUNCTIONS:
+            self.__dict__.pop(func, None)
+        try:
+            if self.transaction:
+                if exc_type is None:
+                    conn.commit()
+                else:
+                    conn.rollback()
+        finally:
+            self.pool.release(conn)
+
+
 class MysqlConnectionPool(object):
-    def __init__(self, *args, **kwargs):
-        self.conn_queue = queue.Queue()
-        self._args = args
-        self._kwargs = kwargs
+    '''
+    bounded pool of MysqlConnection
+
+    conf keys
+    pool_min_size: idle connections kept from eviction
+    pool_max_size: max connections opened
+    pool_acquire_timeout: seconds to wait for a connection when exhausted
+    pool_max_idle_time: seconds before an idle connection is closed
+    pool_max_lifetime: seconds before a connection is closed
+    pool_ping_interval: ping an idle connection before use after seconds
+    pool_fork_warmup: connections opened in background in a forked child
+    statement_cache_size: sql statements cached by shape, shared by pool
+    retry_backoff / breaker_failure_threshold ...: see RetryPolicy,
+    circuit breaker is shared by pool, state in `stats()`
+    
+    connections inherited by a forked child are dropped without COM_QUIT,
+    parent keeps them
+    '''
+    connection_class = MysqlConnection
+    
+    def __init__(self, conf, retry_budget=None):
+        self._conf = conf
+        self.pid = os.getpid()
+        
+        self.min_size = conf.get('pool_min_size', DEFAULT_POOL_MIN_SIZE)
+        self.max_size = conf.get('pool_max_size', DEFAULT_POOL_MAX_SIZE)
+        self.acquire_timeout = conf.get(
+            'pool_acquire_timeout', DEFAULT_POOL_ACQUIRE_TIMEOUT)
+        self.max_idle_time = conf.get(
+            'pool_max_idle_time', DEFAULT_POOL_MAX_IDLE_TIME)
+        self.max_lifetime = conf.get(
+            'pool_max_lifetime', DEFAULT_POOL_MAX_LIFETIME)
+        self.ping_interval = conf.get(
+            'pool_ping_interval', DEFAULT_POOL_PING_INTERVAL)
+        self.fork_warmup = conf.get(
+            'pool_fork_warmup', DEFAULT_POOL_FORK_WARMUP)
+        
+        self._cond = Condition()
+        # bumped by fork, connections checked out before are not returned
+        self._generation = 0
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._created = 0
+        self._evicted = 0
+        
+        self.statement_cache = LRUCache(conf.get(
+            'statement_cache_size', DEFAULT_STATEMENT_CACHE_SIZE))
+        self.retry_policy = RetryPolicy(conf, retry_budget)
+        _POOLS.add(self)
 
         for func in CURD_FUNCTIONS:
-            setattr(self, func, partial(self._wrap_func, func))
+            if hasattr(self, func):
+                # implemented by pool itself
+                continue
+            elif func in ITER_FUNCTIONS:
+                setattr(self, func, self._bind_iter_func(func))
+            else:
+                setattr(self, func, self._bind_func(func))
+        self._get_chunk = self._bind_func('_get_chunk')
+        self._execute_statement = self._bind_func('_execute_statement')
 
     def get_connection(self):
-        return MysqlConnection(*self._args, **self._kwargs)
+        return self.connection_class(
+            self._conf, self.statement_cache, self.retry_policy)
+    
+    def _expired(self, conn, now):
+        if self.max_lifetime and conn.connected_at and \
+                now - conn.connected_at > self.max_lifetime:
+            return True
+        return False
+    
+    def _evict_idle(self, now):
+        evicted = []
+        while self._idle and self._size > self.min_size:
+            conn = self._idle[0]
+            if self._expired(conn, now) or (
+                    self.max_idle_time and
+                    now - conn.last_used_at > self.max_idle_time):
+                self._idle.popleft()
+                self._size -= 1
+                self._evicted += 1
+                evicted.append(conn)
+            else:
+                break
+        return evicted
+    
+    def acquire(self):
+        now = time.time()
+        wait_start = time.perf_counter()
+        deadline = None
+        conn, evicted = None, []
+        with self._cond:
+            while True:
+                evicted.extend(self._evict_idle(now))
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                elif self._size < self.max_size:
+                    self._size += 1
+                    self._created += 1
+                    break
+                
+                if deadline is None:
+                    self._waits += 1
+                    deadline = now + self.acquire_timeout
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(
+                        'no connection available in {}s'.format(
+                            self.acquire_timeout)
+                    )
+                self._cond.wait(remaining)
+                now = time.time()
+            self._in_use += 1
+            generation = self._generation
+            
+        for c in evicted:
+            c.close()
+            
+        if conn is None:
+            conn = self.get_connection()
+        elif conn.pid != os.getpid():
+            conn.discard()
+        elif self._expired(conn, now):
+            conn.close()
+            with self._cond:
+                self._evicted += 1
+        elif now - conn.last_used_at > self.ping_interval and not conn.ping():
+            with self._cond:
+                self._evicted += 1
+        conn.pool_wait_time = time.perf_counter() - wait_start
+        conn.pool_generation = generation
+        return conn
+    
+    def release(self, conn):
+        conn.last_used_at = time.time()
+        with self._cond:
+            if conn.pool_generation != self._generation:
+                # checked out in parent before fork
+                conn.discard()
+                return
+            self._in_use -= 1
+            self._idle.append(conn)
+            self._cond.notify()
+    
+    def warmup(self, n=None):
+        '''
+        open connections until pool holds `n` (pool_min_size by default),
+        return count opened
+        '''
+        if n is None:
+            n = self.min_size
+        n = min(n, self.max_size)
+        opened = 0
+        while True:
+            with self._cond:
+                if self._size >= n:
+                    return opened
+                self._size += 1
+                self._created += 1
+                generation = self._generation
+            
+            conn = self.get_connection()
+            try:
+                conn.connect(self._conf)
+            except Exception:
+                with self._cond:
+                    if generation == self._generation:
+                        self._size -= 1
+                    self._cond.notify()
+                raise
+            conn.last_used_at = time.time()
+            with self._cond:
+                if generation != self._generation:
+                    conn.discard()
+                    return opened
+                self._idle.append(conn)
+                self._cond.notify()
+            opened += 1
+    
+    def _warmup_in_background(self, n):
+        def warmup():
+            try:
+                self.warmup(n)
+            except Exception as e:
+                logger.warning(str(e))
+        Thread(target=warmup, daemon=True).start()
+    
+    def _after_fork(self):
+        '''
+        in child: locks may be held by threads of parent, idle sockets are
+        shared with parent, start over
+        '''
+        self._cond = Condition()
+        idle, self._idle = self._idle, deque()
+        for conn in idle:
+            conn.discard()
+        self._size, self._in_use = 0, 0
+        self._generation += 1
+        self.pid = os.getpid()
+        self.statement_cache = LRUCache(self.statement_cache.maxsize)
+        self.retry_policy._after_fork()
+        if self.fork_warmup:
+            self._warmup_in_background(self.fork_warmup)
+
+    def transaction(self):
+        return MysqlTransaction(self)
+    
+    def pinned(self):
+        '''
+        one connection for all operations in block, autocommit kept
+        '''
+        return MysqlTransaction(self, transaction=False)
 
-    def _wrap_func(self, func, *args, **kwargs):
+    def scan(self, collection, key='id', batch_size=DEFAULT_FETCH_SIZE,
+             filters=None, fields=None, prefetch=True, **kwargs):
+        '''
+        each page is fetched with its own pooled connection
+        '''
+        return scan_by_keyset(
+            self.filter, collection, key, batch_size, filters, fields,
+            prefetch, **kwargs
+        )
+
+    def get_many(self, collection, key, values, fields=None, as_dict=False,
+                 chunk_size=DEFAULT_GET_MANY_CHUNK_SIZE,
+                 concurrency=DEFAULT_CONCURRENCY, **kwargs):
+        '''
+        lookups of `key` in values by `IN` of at most `chunk_size` values,
+        chunks run in parallel on up to `concurrency` pooled connections,
+        duplicated values are fetched once,
+        return rows (or None) in input order, or a dict of value -> row,
+        raise BatchError with errors by value
+        '''
+        check_lookup_row_format(kwargs)
+        values = list(values)
+        chunks = chunk_lookup_values(values, chunk_size)
+        workers = min(concurrency, self.max_size, len(chunks))
+
+        def get_chunk(chunk):
+            try:
+                return self._get_chunk(
+                    collection, key, chunk, fields, **kwargs)
+            except (OperationFailure, UnexpectedError) as e:
+                return e
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(get_chunk, chunks))
+        else:
+            results = [get_chunk(chunk) for chunk in chunks]
+        return collect_lookup_rows(
+            key, values, chunks, results, fields, as_dict)
+    
+    def execute_concurrent(self, statements, concurrency=DEFAULT_CONCURRENCY,
+                           **kwargs):
+        '''
+        execute (query, params) pairs in parallel on up to `concurrency`
+        pooled connections, return rows of each in input order,
+        raise BatchError with errors by index
+        '''
+        statements = list(statements)
+        workers = min(concurrency, self.max_size, len(statements))
+
+        def execute(statement):
+            return self._execute_statement(statement, **kwargs)
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(execute, statements))
+        else:
+            results = [execute(statement) for statement in statements]
+        return collect_statement_results(results)
+    
+    def _bind_func(self, func):
+        '''
+        function of connection class called on a checked out connection,
+        looked up once instead of per call
+        '''
+        method = getattr(self.connection_class, func)
+        acquire, release = self.acquire, self.release
+        
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            conn = acquire()
+            try:
+                return method(conn, *args, **kwargs)
+            finally:
+                release(conn)
+        return wrapper
+    
+    def _bind_iter_func(self, func):
+        method = getattr(self.connection_class, func)
+        acquire, release = self.acquire, self.release
+        
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            conn = acquire()
+            try:
+                yield from method(conn, *args, **kwargs)
+            finally:
+                release(conn)
+        return wrapper
+            
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'created': self._created,
+                'evicted': self._evicted,
+                'statement_cache': self.statement_cache.stats(),
+                'retry': self.retry_policy.stats(),
+            }
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, deque()
+            self._size -= len(idle)
+        for conn in idle:
+            conn.close()
+
+
+class MysqlReplicaSetPool(object):
+    '''
+    route reads to replicas and writes to primary
+
+    {
+        'type': 'mysql',
+        'conf': {
+            'primary': {'host': '10.0.0.1', 'port': 3306},
+            'replicas': [
+                {'host': '10.0.0.2', 'port': 3306},
+                {'host': '10.0.0.3', 'port': 3306}
+            ],
+            'user': 'user',
+            'password': 'password',
+            'read_strategy': 'round_robin',
+            'replica_eject_time': 30,
+            'read_after_write_pin': 0
+        }
+    }
+
+    other keys are shared by primary and replicas.
+    get / filter / exist / get_many / iter_filter / scan go to a replica
+    (`use_primary=True` to skip), a failed replica is ejected for
+    `replica_eject_time` seconds, primary is used when no replica left.
+    values of get_many chunks failed on a replica are looked up again on
+    the next one.
+    `execute` / `iter_execute` go to primary unless `use_primary=False`.
+    reads of a thread go to primary `read_after_write_pin` seconds after
+    its last write.
+    '''
+
+    def __init__(self, conf, retry_budget=None):
+        shared = {
+            k: v for k, v in conf.items() if k not in REPLICA_SET_CONF_KEYS
+        }
+        self.primary = MysqlConnectionPool(
+            dict(shared, **conf['primary']), retry_budget)
+        self.replicas = [
+            MysqlConnectionPool(dict(shared, **replica), retry_budget)
+            for replica in conf.get('replicas', [])
+        ]
+
+        self.read_strategy = conf.get('read_strategy', 'round_robin')
+        if self.read_strategy not in READ_STRATEGIES:
+            raise ProgrammingError('not supported read strategy')
+        self.eject_time = conf.get(
+            'replica_eject_time', DEFAULT_REPLICA_EJECT_TIME)
+        self.read_after_write_pin = conf.get('read_after_write_pin', 0)
+
+        self._lock = Lock()
+        self._next = 0
+        self._inflight = [0] * len(self.replicas)
+        self._ejected_until = [0] * len(self.replicas)
+        self._local = local()
+        _POOLS.add(self)
+
+        for func in CURD_FUNCTIONS:
+            if hasattr(self, func):
+                continue
+            elif func in READ_FUNCTIONS:
+                setattr(self, func, partial(self._read, func))
+            else:
+                setattr(self, func, partial(self._write, func))
+
+    def _pinned(self):
+        if self.read_after_write_pin:
+            last_write = getattr(self._local, 'last_write', 0)
+            return time.time() - last_write < self.read_after_write_pin
+        return False
+
+    def _acquire_replica(self, exclude):
+        now = time.time()
+        with self._lock:
+            candidates = [
+                i for i in range(len(self.replicas))
+                if i not in exclude and self._ejected_until[i] <= now
+            ]
+            if not candidates:
+                return None
+            if self.read_strategy == 'least_inflight':
+                index = min(candidates, key=lambda i: self._inflight[i])
+            else:
+                index = candidates[self._next % len(candidates)]
+                self._next += 1
+            self._inflight[index] += 1
+            return index
+
+    def _release_replica(self, index, error=None):
+        with self._lock:
+            self._inflight[index] -= 1
+            if error is not None:
+                self._ejected_until[index] = time.time() + self.eject_time
+        if error is not None:
+            logger.warning('EJECT REPLICA {}: {}'.format(index, str(error)))
+
+    def _read(self, func, *args, use_primary=False, **kwargs):
+        if use_primary or self._pinned():
+            return getattr(self.primary, func)(*args, **kwargs)
+
+        tried = set()
+        while True:
+            index = self._acquire_replica(tried)
+            if index is None:
+                return getattr(self.primary, func)(*args, **kwargs)
+            tried.add(index)
+            try:
+                result = getattr(self.replicas[index], func)(*args, **kwargs)
+            except (ConnectError, OperationFailure) as e:
+                self._release_replica(index, e)
+            except:
+                self._release_replica(index)
+                raise
+            else:
+                self._release_replica(index)
+                return result
+
+    def get_many(self, collection, key, values, fields=None, as_dict=False,
+                 use_primary=False, **kwargs):
+        values = list(values)
+        if use_primary or self._pinned():
+            return self.primary.get_many(
+                collection, key, values, fields, as_dict, **kwargs)
+
+        rows, pending, tried = {}, values, set()
+        while True:
+            index = self._acquire_replica(tried)
+            if index is None:
+                pool = self.primary
+            else:
+                tried.add(index)
+                pool = self.replicas[index]
+            error = None
+            try:
+                found = pool.get_many(
+                    collection, key, pending, fields, as_dict=True, **kwargs)
+            except BatchError as e:
+                # chunk errors by value, rows of other chunks in results
+                found, error = e.results or {}, e
+            except (ConnectError, OperationFailure) as e:
+                if index is None:
+                    raise
+                self._release_replica(index, e)
+                continue
+            except:
+                if index is not None:
+                    self._release_replica(index)
+                raise
+            rows.update(found)
+            if index is None:
+                break
+            failed = [
+                e for e in (error.errors.values() if error else ())
+                if isinstance(e, (ConnectError, OperationFailure))
+            ]
+            self._release_replica(index, failed[0] if failed else None)
+            if not failed:
+                break
+            pending = [v for v in pending if v in error.errors]
+
+        if not as_dict:
+            rows = [rows.get(v) for v in values]
+        if error is not None:
+            raise BatchError(error.errors, rows)
+        return rows
+
+    def _write(self, func, *args, **kwargs):
         try:
-            conn = self.conn_queue.get_nowait()
-        except queue.Empty:
-            conn = self.get_connection()
+            return getattr(self.primary, func)(*args, **kwargs)
+        finally:
+            if self.read_after_write_pin:
+                self._local.last_write = time.time()
+
+    def execute(self, query, params=None, use_primary=True, **kwargs):
+        if use_primary:
+            return self._write('execute', query, params, **kwargs)
+        return self._read('execute', query, params, **kwargs)
+
+    def transaction(self):
+        return self.primary.transaction()
+    
+    def pinned(self):
+        return self.primary.pinned()
+
+    def _read_iter(self, func, *args, use_primary=False, **kwargs):
+        if use_primary or self._pinned():
+            yield from getattr(self.primary, func)(*args, **kwargs)
+            return
 
+        index = self._acquire_replica(())
+        if index is None:
+            yield from getattr(self.primary, func)(*args, **kwargs)
+            return
+        error = None
         try:
-            return getattr(conn, func)(*args, **kwargs)
-        except:
+            yield from getattr(self.replicas[index], func)(*args, **kwargs)
+        except (ConnectError, OperationFailure) as e:
+            error = e
             raise
         finally:
-            self.conn_queue.put_nowait(conn)
+            self._release_replica(index, error)
+
+    def iter_filter(self, *args, **kwargs):
+        return self._read_iter('iter_filter', *args, **kwargs)
+
+    def iter_execute(self, query, params=None, use_primary=True, **kwargs):
+        return self._read_iter(
+            'iter_execute', query, params, use_primary=use_primary, **kwargs)
+
+    def scan(self, collection, key='id', batch_size=DEFAULT_FETCH_SIZE,
+             filters=None, fields=None, prefetch=True, **kwargs):
+        return scan_by_keyset(
+            self.filter, collection, key, batch_size, filters, fields,
+            prefetch, **kwargs
+        )
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            replicas = [
+                dict(
+                    replica.stats(),
+                    inflight=self._inflight[i],
+                    ejected=self._ejected_until[i] > now
+                )
+                for i, replica in enumerate(self.replicas)
+            ]
+        return {'primary': self.primary.stats(), 'replicas': replicas}
+
+    def _after_fork(self):
+        # primary and replicas reset by their own hooks
+        self._lock = Lock()
+        self._inflight = [0] * len(self.replicas)
+        self._local = local()
+
+    def warmup(self, n=None):
+        opened = self.primary.warmup(n)
+        for replica in self.replicas:
+            opened += replica.warmup(n)
+        return opened
 
     def close(self):
-        while True:
-            try:
-                conn = self.conn_queue.get_nowait()
-            except queue.Empty:
-                break
-            else:
-                conn.close()
+        self.primary.close()
+        for replica in self.replicas:
+            replica.close()
+
+
+def mysql_connection_pool(conf, retry_budget=None):
+    if 'primary' in conf:
+        return MysqlReplicaSetPool(conf, retry_budget)
+    return MysqlConnectionPool(conf, retry_budget)
@@ -0,0 +1,259 @@
+import time
+import random
+from threading import Lock
+
+from ..errors import CircuitOpenError, OperationFailure, ConnectError
+from . import logger, OP_RETRY_WARNING
+
+
+DEFAULT_RETRY_BACKOFF = 0.05
+DEFAULT_RETRY_BACKOFF_MAX = 2
+DEFAULT_RETRY_BUDGET_RATIO = 0.1
+DEFAULT_RETRY_BUDGET_MIN_PER_SECOND = 10
+DEFAULT_RETRY_BUDGET_MAX_TOKENS = 100
+DEFAULT_BREAKER_RESET_TIMEOUT = 30
+DEFAULT_BREAKER_HALF_OPEN_CALLS = 1
+
+BREAKER_CLOSED = 'closed'
+BREAKER_OPEN = 'open'
+BREAKER_HALF_OPEN = 'half_open'
+
+RETRY_CONF_KEYS = (
+    'retry_backoff', 'retry_backoff_max', 'breaker_failure_threshold',
+    'breaker_reset_timeout', 'breaker_half_open_calls'
+)
+
+
+class RetryBudget(object):
+    '''
+    token bucket limiting retries to a ratio of requests,
+    each request deposits `ratio` token, each retry withdraws one,
+    `min_per_second` tokens are deposited each second for low traffic
+    '''
+
+    def __init__(self, ratio=DEFAULT_RETRY_BUDGET_RATIO,
+                 min_per_second=DEFAULT_RETRY_BUDGET_MIN_PER_SECOND,
+                 max_tokens=DEFAULT_RETRY_BUDGET_MAX_TOKENS):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+
+        self._lock = Lock()
+        self._tokens = max_tokens
+        self._refilled_at = time.monotonic()
+        self.requests = 0
+        self.retries = 0
+        self.rejected = 0
+
+    def _after_fork(self):
+        # lock may be held by a thread of parent
+        self._lock = Lock()
+
+    def _refill(self, now):
+        self._tokens = min(
+            self.max_tokens,
+            self._tokens + (now - self._refilled_at) * self.min_per_second
+        )
+        self._refilled_at = now
+
+    def deposit(self):
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.retries += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def stats(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                'tokens': self._tokens,
+                'max_tokens': self.max_tokens,
+                'requests': self.requests,
+                'retries': self.retries,
+                'rejected': self.rejected,
+            }
+
+
+class CircuitBreaker(object):
+    '''
+    open after `failure_threshold` consecutive failures, calls fail fast
+    with CircuitOpenError, after `reset_timeout` seconds `half_open_calls`
+    probes are let through, closed by a successful probe
+    '''
+
+    def __init__(self, failure_threshold,
+                 reset_timeout=DEFAULT_BREAKER_RESET_TIMEOUT,
+                 half_open_calls=DEFAULT_BREAKER_HALF_OPEN_CALLS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+
+        self._lock = Lock()
+        self._state = BREAKER_CLOSED
+        self._failures = 0
+        self._probes = 0
+        self._opened_at = 0
+        self.opened = 0
+        self.rejected = 0
+
+    def _after_fork(self):
+        self._lock = Lock()
+
+    def _open(self):
+        if self._state != BREAKER_OPEN:
+            self.opened += 1
+            logger.warning('CIRCUIT OPEN: {} failures'.format(self._failures))
+        self._state = BREAKER_OPEN
+        self._opened_at = time.monotonic()
+
+    def before_call(self):
+        with self._lock:
+            if self._state == BREAKER_OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpenError(
+                        'circuit open for {}s'.format(self.reset_timeout))
+                self._state = BREAKER_HALF_OPEN
+                self._probes = 0
+            if self._state == BREAKER_HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    self.rejected += 1
+                    raise CircuitOpenError('circuit half open, probing')
+                self._probes += 1
+
+    def allow_retry(self):
+        with self._lock:
+            return self._state == BREAKER_CLOSED
+
+    def on_success(self):
+        with self._lock:
+            self._state = BREAKER_CLOSED
+            self._failures = 0
+            self._probes = 0
+
+    def on_ignored(self):
+        '''
+        call ended without telling whether host is healthy,
+        its probe is given back when half open
+        '''
+        with self._lock:
+            if self._state == BREAKER_HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    def on_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == BREAKER_HALF_OPEN or \
+                    self._failures >= self.failure_threshold:
+                self._open()
+
+    def state(self):
+        with self._lock:
+            state = self._state
+            if state == BREAKER_OPEN and \
+                    time.monotonic() - self._opened_at >= self.reset_timeout:
+                state = BREAKER_HALF_OPEN
+            return {
+                'state': state,
+                'failures': self._failures,
+                'opened': self.opened,
+                'rejected': self.rejected,
+            }
+
+
+class RetryPolicy(object):
+    '''
+    backoff, budget and circuit breaker shared by connections of a pool
+
+    conf keys
+    retry_backoff: base seconds of exponential backoff with full jitter
+    retry_backoff_max: max seconds of a backoff
+    breaker_failure_threshold: consecutive failures to open circuit,
+                               0 to disable circuit breaker
+    breaker_reset_timeout: seconds before probing an open circuit
+    breaker_half_open_calls: probes let through when half open
+    '''
+
+    def __init__(self, conf, budget=None):
+        self.backoff = conf.get('retry_backoff', DEFAULT_RETRY_BACKOFF)
+        self.backoff_max = conf.get(
+            'retry_backoff_max', DEFAULT_RETRY_BACKOFF_MAX)
+        self.budget = budget
+
+        threshold = conf.get('breaker_failure_threshold', 0)
+        if threshold:
+            self.breaker = CircuitBreaker(
+                threshold,
+                conf.get(
+                    'breaker_reset_timeout', DEFAULT_BREAKER_RESET_TIMEOUT),
+                conf.get(
+                    'breaker_half_open_calls', DEFAULT_BREAKER_HALF_OPEN_CALLS)
+            )
+        else:
+            self.breaker = None
+
+    def _after_fork(self):
+        if self.breaker:
+            self.breaker._after_fork()
+        if self.budget:
+            self.budget._after_fork()
+
+    def before_call(self):
+        '''
+        raise CircuitOpenError when circuit is open
+        '''
+        if self.breaker:
+            self.breaker.before_call()
+        if self.budget:
+            self.budget.deposit()
+
+    def on_success(self):
+        if self.breaker:
+            self.breaker.on_success()
+
+    def on_failure(self):
+        if self.breaker:
+            self.breaker.on_failure()
+
+    def on_error(self, error):
+        '''
+        only errors of host or network count as failures, others (like a
+        deadlock, lock wait timeout or an interrupt) leave breaker as it is
+        '''
+        if isinstance(error, (OperationFailure, ConnectError)):
+            self.on_failure()
+        elif self.breaker:
+            self.breaker.on_ignored()
+
+    def retry(self, error, retry_no, retry):
+        '''
+        record a retriable failure,
+        return seconds to sleep before next try, None when not retrying
+        '''
+        self.on_failure()
+        if retry_no >= retry:
+            return None
+        if self.breaker and not self.breaker.allow_retry():
+            return None
+        if self.budget and not self.budget.withdraw():
+            return None
+        logger.warning(OP_RETRY_WARNING.format(str(error)))
+        if not self.backoff:
+            return 0
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff * 2 ** retry_no))
+
+    def stats(self):
+        return {
+            'breaker': self.breaker.state() if self.breaker else None,
+            'budget': self.budget.stats() if self.budget else None,
+        }
@@ -0,0 +1,80 @@
+import re
+import zlib
+from threading import Lock
+from collections import OrderedDict
+
+
+PLACEHOLDER_LIST_PATTERN = re.compile(r'\(\?(?:, \?)*\)')
+PLACEHOLDER_ROWS_PATTERN = re.compile(r'\(\?\)(?:, \(\?\))+')
+PLACEHOLDER_PATTERN = re.compile(r'%\(\w+\)s|%s')
+
+
+def normalize_query(query):
+    '''
+    statement shape of a query, placeholders become ?,
+    IN lists and multi-row VALUES are collapsed
+    '''
+    query = PLACEHOLDER_PATTERN.sub('?', query)
+    query = PLACEHOLDER_LIST_PATTERN.sub('(?)', query)
+    return PLACEHOLDER_ROWS_PATTERN.sub('(?), ...', query)
+
+
+def fingerprint(query):
+    return '{:08x}'.format(zlib.crc32(normalize_query(query).encode()))
+
+
+class LRUCache(object):
+    '''
+    thread safe LRU mapping with hit / miss counters, maxsize 0 disables it
+    '''
+    
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+    
+    def set(self, key, value):
+        if not self.maxsize:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def __contains__(self, key):
+        return key in self._data
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
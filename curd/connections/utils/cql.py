@@ -66,26 +66,30 @@ def assignment_clauses_from_data(data):
     return assignment_clauses
 
 
-def query_parameters_from_create(collection, data, mode='INSERT'):
+def query_parameters_from_create(collection, data, mode='INSERT', lwt=False):
+    '''
+    INSERT of cassandra overwrites, IF NOT EXISTS (a lightweight transaction)
+    is added for IGNORE, and for INSERT when `lwt`
+    '''
     assignment_clauses = assignment_clauses_from_data(data)
-    if mode == 'REPLACE':
+    if mode == 'IGNORE' or (mode == 'INSERT' and lwt):
         statement = InsertStatement(
             table=collection, assignments=assignment_clauses,
+            if_not_exists=True
         )
     else:
         statement = InsertStatement(
             table=collection, assignments=assignment_clauses,
-            if_not_exists=True
         )
     return str(statement), statement.get_context()
 
 
-def query_parameters_from_update(collection, filters, data):
+def query_parameters_from_update(collection, filters, data, lwt=False):
     where_clauses = where_clauses_from_filters(filters)
     assignment_clauses = assignment_clauses_from_data(data)
     statement = UpdateStatement(
         table=collection, assignments=assignment_clauses,
-        where=where_clauses, if_exists=True
+        where=where_clauses, if_exists=lwt
     )
     return str(statement), statement.get_context()
 
@@ -0,0 +1,146 @@
+import heapq
+import importlib
+from itertools import chain, islice
+
+from ...errors import ProgrammingError
+
+
+ROW_FORMATS = ('dict', 'tuple', 'columnar', 'numpy', 'pandas')
+
+
+class Rows(list):
+    '''
+    rows as tuples sharing one column list
+    '''
+
+    def __init__(self, rows=(), columns=()):
+        super().__init__(rows)
+        self.columns = list(columns)
+
+
+class MergedRows(list):
+    '''
+    rows merged from several connections,
+    `errors` maps index of failed connection to its error
+    '''
+
+    def __init__(self, rows=(), errors=None):
+        super().__init__(rows)
+        self.errors = errors or {}
+
+
+def check_row_format(row_format):
+    if row_format not in ROW_FORMATS:
+        raise ProgrammingError(
+            'row_format should be one of {}'.format(ROW_FORMATS))
+
+
+def import_optional(name, row_format):
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        raise ProgrammingError(
+            '{} is required for row_format {}'.format(name, row_format))
+
+
+def convert_rows(columns, rows, row_format):
+    '''
+    convert tuple rows to `row_format` in bulk
+
+    dict: list of dicts
+    tuple: Rows, list of tuples with `columns`
+    columnar: dict of column name to list of values
+    numpy: numpy structured array
+    pandas: pandas DataFrame
+    '''
+    columns = list(columns)
+    if row_format == 'dict':
+        return [dict(zip(columns, row)) for row in rows]
+    elif row_format == 'tuple':
+        return Rows(rows, columns)
+    elif row_format == 'columnar':
+        values = zip(*rows) if rows else [()] * len(columns)
+        return {column: list(v) for column, v in zip(columns, values)}
+    elif row_format == 'numpy':
+        numpy = import_optional('numpy', row_format)
+        if not rows:
+            return numpy.zeros(0, dtype=[(c, object) for c in columns])
+        return numpy.rec.fromrecords(list(rows), names=columns)
+    elif row_format == 'pandas':
+        pandas = import_optional('pandas', row_format)
+        return pandas.DataFrame.from_records(list(rows), columns=columns)
+    else:
+        check_row_format(row_format)
+
+
+def parse_order_by(order_by):
+    '''
+    ['a', '-b'] -> [('a', False), ('b', True)], True for descending
+    '''
+    return [
+        (field[1:], True) if field.startswith('-') else (field, False)
+        for field in order_by or ()
+    ]
+
+
+class OrderKey(object):
+    '''
+    sort key of a row on fields of mixed directions,
+    None sorts first ascending like mysql
+    '''
+    __slots__ = ('values', 'desc')
+
+    def __init__(self, values, desc):
+        self.values = values
+        self.desc = desc
+
+    def __lt__(self, other):
+        for value, other_value, desc in zip(
+                self.values, other.values, self.desc):
+            if value == other_value:
+                continue
+            if value is None:
+                less = True
+            elif other_value is None:
+                less = False
+            else:
+                less = value < other_value
+            return not less if desc else less
+        return False
+
+
+def row_order_key(order_by):
+    '''
+    key function of dict rows for sorted / heapq.merge
+    '''
+    fields = parse_order_by(order_by)
+    names = [name for name, _ in fields]
+    desc = [d for _, d in fields]
+    return lambda row: OrderKey([row[name] for name in names], desc)
+
+
+def order_fields(fields, order_by):
+    '''
+    fields to query so rows can be merged by order_by,
+    and the ones added to drop after merge
+    '''
+    if not fields:
+        return fields, []
+    extra = [
+        name for name, _ in parse_order_by(order_by) if name not in fields
+    ]
+    return list(fields) + extra, extra
+
+
+def merge_rows(results, order_by=None, limit=None):
+    '''
+    lazily merge row lists each sorted by `order_by` into one,
+    stop after `limit` rows, concatenated when no order
+    '''
+    if order_by:
+        rows = heapq.merge(*results, key=row_order_key(order_by))
+    else:
+        rows = chain.from_iterable(results)
+    if limit is not None:
+        rows = islice(rows, limit)
+    return rows
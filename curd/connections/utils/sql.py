@@ -1,32 +1,36 @@
 from datetime import datetime, timezone
 
+from ...errors import ProgrammingError
+
+
+def normalize_value(value):
+    if isinstance(value, datetime) and value.tzinfo:
+        return value.astimezone(tz=timezone.utc).replace(tzinfo=None)
+    elif isinstance(value, list) or isinstance(value, tuple):
+        return [normalize_value(v) for v in value]
+    else:
+        return value
+
 
 class BaseClause(object):
     def __init__(self, field, value):
         self._field = field
         self._value = value
         
+    @staticmethod
+    def quote(field):
+        return '.'.join(
+            ['`{}`'.format(i) for i in field.replace('`', '').split('.')])
+        
     @property
     def field(self):
-        return '.'.join(
-            ['`{}`'.format(i) for i in self._field.replace('`', '').split('.')])
+        if isinstance(self._field, (list, tuple)):
+            return '({})'.format(', '.join(self.quote(f) for f in self._field))
+        return self.quote(self._field)
     
     @property
     def value(self):
-        if isinstance(self._value, datetime) and self._value.tzinfo:
-            return self._value.astimezone(tz=timezone.utc).replace(tzinfo=None)
-        elif isinstance(self._value, list) or isinstance(self._value, tuple):
-            value = []
-            for v in self._value:
-                if isinstance(self._value, datetime) and self._value.tzinfo:
-                    value.append(
-                        v.astimezone(tz=timezone.utc).replace(tzinfo=None)
-                    )
-                else:
-                    value.append(v)
-            return value
-        else:
-            return self._value
+        return normalize_value(self._value)
         
         
 class WhereClause(BaseClause):
@@ -78,6 +82,19 @@ class BaseSQLStatement(object):
                         )
                     )
                     
+                    for v in where_clause.value:
+                        self.params.append(v)
+                elif isinstance(where_clause._field, (list, tuple)):
+                    # row constructor like (`a`, `b`) > (%s, %s)
+                    value_count = len(where_clause.value)
+                    segs.append(
+                        '{} {} {}'.format(
+                            where_clause.field,
+                            where_clause.operator,
+                            '({})'.format(', '.join(['%s']*value_count))
+                        )
+                    )
+
                     for v in where_clause.value:
                         self.params.append(v)
                 else:
@@ -168,14 +185,16 @@ class DeleteStatement(BaseSQLStatement):
     
     
 class CreateStatement(BaseSQLStatement):
-    BASE_QUERY = '{} INTO {} ({}) VALUES ({})'
+    BASE_QUERY = '{} INTO {} ({}) VALUES ({}){}'
     
-    def __init__(self, table, assignments, mode, compress_fields):
+    def __init__(self, table, assignments, mode, compress_fields,
+                 update_fields=None):
         super().__init__()
         self.table = table
         self.assignments = assignments
         self.mode = mode
         self.compress_fields = compress_fields
+        self.update_fields = update_fields
         
     def generate_query_mode(self, mode):
         if mode == 'INSERT':
@@ -184,6 +203,19 @@ class CreateStatement(BaseSQLStatement):
             return 'INSERT IGNORE'
         elif mode == 'REPLACE':
             return 'REPLACE'
+        elif mode == 'UPSERT':
+            return 'INSERT'
+        
+    def generate_query_upsert(self, assignments, update_fields):
+        if self.mode != 'UPSERT':
+            return ''
+        if update_fields:
+            fields = [FieldClause(f).field for f in update_fields]
+        else:
+            fields = [a.field for a in assignments]
+        return ' ON DUPLICATE KEY UPDATE {}'.format(
+            ', '.join('{0}=VALUES({0})'.format(f) for f in fields)
+        )
         
     def generate_query_fields_values(self, assignments, compress_fields):
         fields = [a.field for a in assignments]
@@ -209,8 +241,43 @@ class CreateStatement(BaseSQLStatement):
             self.assignments, self.compress_fields
         )
         
+        query_upsert = self.generate_query_upsert(
+            self.assignments, self.update_fields)
+        
+        self.query = self.BASE_QUERY.format(
+            query_mode, query_table, query_fields, query_values, query_upsert
+        )
+        return self.query, self.params
+    
+    
+class CreateManyStatement(CreateStatement):
+    BASE_QUERY = '{} INTO {} ({}) VALUES {}{}'
+    
+    def __init__(self, table, rows, mode, compress_fields,
+                 update_fields=None):
+        super().__init__(table, rows[0], mode, compress_fields, update_fields)
+        self.rows = rows
+        
+    def as_sql(self):
+        query_mode = self.generate_query_mode(self.mode)
+        
+        query_table = self.generate_query_field(self.table)
+        
+        query_fields, query_values = self.generate_query_fields_values(
+            self.rows[0], self.compress_fields
+        )
+        for assignments in self.rows[1:]:
+            for a in assignments:
+                self.params.append(a.value)
+        query_values = ', '.join(
+            ['({})'.format(query_values)] * len(self.rows)
+        )
+        
+        query_upsert = self.generate_query_upsert(
+            self.rows[0], self.update_fields)
+        
         self.query = self.BASE_QUERY.format(
-            query_mode, query_table, query_fields, query_values
+            query_mode, query_table, query_fields, query_values, query_upsert
         )
         return self.query, self.params
     
@@ -262,18 +329,108 @@ def assignment_clauses_clauses_from_filters(data):
     return assignment_clauses
 
 
-def query_parameters_from_create(collection, data, mode='INSERT', compress_fields=None):
+def filters_shape(filters):
+    shape = []
+    for op, k, v in filters:
+        if op == 'IN' or isinstance(k, (list, tuple)):
+            k, v = (tuple(k) if isinstance(k, list) else k), len(v)
+        else:
+            v = v is None
+        shape.append((op, k, v))
+    return tuple(shape)
+
+
+def filters_params(filters):
+    params = []
+    for op, k, v in filters:
+        if op == 'IN' or isinstance(k, (list, tuple)):
+            params.extend(normalize_value(v))
+        else:
+            params.append(normalize_value(v))
+    return params
+
+
+def compress_fields_shape(compress_fields):
+    if type(compress_fields) == list:
+        return tuple(compress_fields)
+    return None
+
+
+def check_rows_keys(rows):
+    keys = list(rows[0].keys())
+    for data in rows:
+        if len(data) != len(keys) or any(k not in data for k in keys):
+            raise ProgrammingError('create_many rows must have the same keys')
+    return keys
+
+
+def query_parameters_from_create(collection, data, mode='INSERT',
+                                 compress_fields=None, update_fields=None,
+                                 cache=None):
+    if cache is not None:
+        key = (
+            'create', collection, tuple(data), mode,
+            compress_fields_shape(compress_fields),
+            tuple(update_fields) if update_fields else None
+        )
+        query = cache.get(key)
+        if query is not None:
+            return query, [normalize_value(v) for v in data.values()]
+    
     table = FieldClause(collection)
     assignments = assignment_clauses_clauses_from_filters(data)
-    query, params = CreateStatement(table, assignments, mode, compress_fields).as_sql()
+    query, params = CreateStatement(
+        table, assignments, mode, compress_fields, update_fields).as_sql()
+    
+    if cache is not None:
+        cache.set(key, query)
+    return query, params
+
+
+def query_parameters_from_create_many(
+        collection, rows, mode='INSERT', compress_fields=None,
+        update_fields=None, cache=None):
+    keys = check_rows_keys(rows)
+    if cache is not None:
+        key = (
+            'create_many', collection, tuple(keys), len(rows), mode,
+            compress_fields_shape(compress_fields),
+            tuple(update_fields) if update_fields else None
+        )
+        query = cache.get(key)
+        if query is not None:
+            return query, [
+                normalize_value(data[k]) for data in rows for k in keys
+            ]
+    
+    table = FieldClause(collection)
+    assignment_rows = [
+        [AssignmentClause(k, data[k]) for k in keys] for data in rows
+    ]
+    query, params = CreateManyStatement(
+        table, assignment_rows, mode, compress_fields, update_fields).as_sql()
+    
+    if cache is not None:
+        cache.set(key, query)
     return query, params
 
 
-def query_parameters_from_update(collection, filters, data):
+def query_parameters_from_update(collection, filters, data, cache=None):
+    if cache is not None:
+        key = ('update', collection, tuple(data), filters_shape(filters))
+        query = cache.get(key)
+        if query is not None:
+            return query, [
+                normalize_value(v) for v in data.values()
+            ] + filters_params(filters)
+    
     table = FieldClause(collection)
     assignments = assignment_clauses_clauses_from_filters(data)
     where = where_clauses_from_filters(filters)
     query, params = UpdateStatement(table, assignments, where).as_sql()
+    
+    if cache is not None:
+        cache.set(key, query)
     return query, params
 
 
@@ -285,25 +442,47 @@ def query_parameters_from_get(collection, filters, fields=None):
     return query, params
 
 
-def query_parameters_from_delete(collection, filters):
+def query_parameters_from_delete(collection, filters, cache=None):
+    if cache is not None:
+        key = ('delete', collection, filters_shape(filters))
+        query = cache.get(key)
+        if query is not None:
+            return query, filters_params(filters)
+    
     table = FieldClause(collection)
     where = where_clauses_from_filters(filters)
     query, params = DeleteStatement(table, where).as_sql()
+    
+    if cache is not None:
+        cache.set(key, query)
     return query, params
 
 
 def query_parameters_from_filter(
-        collection, filters, fields=None, order_by=None, limit=None):
-    table = FieldClause(collection)
-    where = where_clauses_from_filters(filters)
-    fields = [FieldClause(f) for f in (fields or [])]
-    
+        collection, filters, fields=None, order_by=None, limit=None,
+        cache=None):
     if order_by is None:
         order_by = []
     elif isinstance(order_by, str):
         order_by = [order_by]
+        
+    if cache is not None:
+        key = (
+            'filter', collection, filters_shape(filters),
+            tuple(fields or ()), tuple(order_by), limit
+        )
+        query = cache.get(key)
+        if query is not None:
+            return query, filters_params(filters)
+    
+    table = FieldClause(collection)
+    where = where_clauses_from_filters(filters)
+    fields = [FieldClause(f) for f in (fields or [])]
     order_by = [FieldClause(f) for f in order_by]
     
     query, params = SelectStatement(
         table, fields, where, order_by, limit).as_sql()
+    
+    if cache is not None:
+        cache.set(key, query)
     return query, params
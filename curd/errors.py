@@ -38,9 +38,48 @@ class OperationFailure(WrappedError):
     BASE_MESSAGE = 'OperationFailure'
 
 
+class PoolTimeoutError(OperationFailure):
+    '''
+    no connection available in pool before acquire timeout
+    '''
+    
+    BASE_MESSAGE = 'PoolTimeoutError'
+
+
+class CircuitOpenError(OperationFailure):
+    '''
+    circuit breaker is open after consecutive failures, failing fast
+    '''
+    
+    BASE_MESSAGE = 'CircuitOpenError'
+
+
 class ProgrammingError(WrappedError):
     BASE_MESSAGE = 'ProgrammingError'
 
 
 class DuplicateKeyError(Error):
     pass
+
+
+class BufferFullError(Error):
+    '''
+    rows pending in a BufferedWriter reached its limit
+    '''
+
+
+class BatchError(Error):
+    '''
+    errors of some items in a batch operation,
+    `errors` maps item index (or key) to its error,
+    `results` holds results of the whole batch if any
+    '''
+    
+    def __init__(self, errors, results=None):
+        self.errors = errors
+        self.results = results
+        super().__init__(
+            'BatchError: {} items failed, first error: {!r}'.format(
+                len(errors), next(iter(errors.values()), None)
+            )
+        )
@@ -0,0 +1,173 @@
+import bisect
+from threading import Lock
+
+from .connections import logger
+
+
+# hooks called with OperationEvent after each operation
+HOOKS = []
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+PHASES = ('build_time', 'pool_wait_time', 'network_time', 'convert_time')
+
+
+class OperationEvent(object):
+    '''
+    backend: mysql / cassandra
+    op: create / filter / execute ...
+    collection: None for execute
+    fingerprint: hash of statement shape, see `normalize_query`
+    build_time: seconds building statement
+    pool_wait_time: seconds waiting for a pooled connection
+    network_time: seconds executing statement, retries included
+    convert_time: seconds converting rows (to dicts too, mysql rows are
+                  fetched as tuples)
+    rows: rows returned
+    retries: retry count
+    error: class name of error raised, None if succeeded
+    '''
+
+    __slots__ = (
+        'backend', 'op', 'collection', 'query', 'params', 'fingerprint',
+        'build_time', 'pool_wait_time', 'network_time', 'convert_time',
+        'rows', 'retries', 'error'
+    )
+
+    def __init__(self, backend, op, collection, query, params, fingerprint,
+                 build_time=0, pool_wait_time=0, network_time=0,
+                 convert_time=0, rows=0, retries=0, error=None):
+        self.backend = backend
+        self.op = op
+        self.collection = collection
+        self.query = query
+        self.params = params
+        self.fingerprint = fingerprint
+        self.build_time = build_time
+        self.pool_wait_time = pool_wait_time
+        self.network_time = network_time
+        self.convert_time = convert_time
+        self.rows = rows
+        self.retries = retries
+        self.error = error
+
+    @property
+    def total_time(self):
+        return (
+            self.build_time + self.pool_wait_time + self.network_time +
+            self.convert_time
+        )
+
+    def to_dict(self):
+        data = {k: getattr(self, k) for k in self.__slots__ if k != 'params'}
+        data['total_time'] = self.total_time
+        return data
+
+
+def add_hook(hook):
+    HOOKS.append(hook)
+
+
+def remove_hook(hook):
+    HOOKS.remove(hook)
+
+
+def emit(event):
+    for hook in list(HOOKS):
+        try:
+            hook(event)
+        except Exception as e:
+            logger.warning('HOOK ERROR: {}'.format(str(e)))
+
+
+class HistogramHook(object):
+    '''
+    latency histograms by (backend, op, collection)
+
+    hook = HistogramHook()
+    add_hook(hook)
+    hook.dump() / hook.to_prometheus()
+    '''
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = Lock()
+        self._series = {}
+
+    def __call__(self, event):
+        key = (event.backend, event.op, event.collection or '')
+        total = event.total_time
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {
+                    'count': 0,
+                    'sum': 0,
+                    'buckets': [0] * (len(self.buckets) + 1),
+                    'phases': dict.fromkeys(PHASES, 0),
+                    'rows': 0,
+                    'retries': 0,
+                    'errors': {},
+                }
+            series['count'] += 1
+            series['sum'] += total
+            series['buckets'][bisect.bisect_left(self.buckets, total)] += 1
+            for phase in PHASES:
+                series['phases'][phase] += getattr(event, phase)
+            series['rows'] += event.rows
+            series['retries'] += event.retries
+            if event.error:
+                series['errors'][event.error] = \
+                    series['errors'].get(event.error, 0) + 1
+
+    def dump(self):
+        with self._lock:
+            result = []
+            for (backend, op, collection), series in self._series.items():
+                cumulative, buckets = 0, []
+                for bound, count in zip(
+                        self.buckets + (float('inf'), ), series['buckets']):
+                    cumulative += count
+                    buckets.append((bound, cumulative))
+                result.append({
+                    'backend': backend,
+                    'op': op,
+                    'collection': collection,
+                    'count': series['count'],
+                    'sum': series['sum'],
+                    'buckets': buckets,
+                    'phases': dict(series['phases']),
+                    'rows': series['rows'],
+                    'retries': series['retries'],
+                    'errors': dict(series['errors']),
+                })
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+    def to_prometheus(self, name='curd_operation_seconds'):
+        lines = [
+            '# TYPE {} histogram'.format(name),
+        ]
+        dumped = self.dump()
+        for series in dumped:
+            labels = 'backend="{}",op="{}",collection="{}"'.format(
+                series['backend'], series['op'], series['collection'])
+            for bound, count in series['buckets']:
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                    name, labels, le, count))
+            lines.append('{}_sum{{{}}} {}'.format(name, labels, series['sum']))
+            lines.append('{}_count{{{}}} {}'.format(
+                name, labels, series['count']))
+        lines.append('# TYPE {}_phase_seconds counter'.format(name))
+        for series in dumped:
+            labels = 'backend="{}",op="{}",collection="{}"'.format(
+                series['backend'], series['op'], series['collection'])
+            for phase, value in series['phases'].items():
+                lines.append('{}_phase_seconds{{{},phase="{}"}} {}'.format(
+                    name, labels, phase[:-len('_time')], value))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,143 @@
+import time
+from threading import Lock
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .connections import logger
+from .connections.utils import normalize_query
+
+
+DEFAULT_SLOW_THRESHOLD = 1
+DEFAULT_TOP_N = 20
+DEFAULT_SAMPLE_SIZE = 1024
+DEFAULT_SLOW_LOG_SIZE = 100
+
+SLOW_QUERY_WARNING = 'SLOW: {:.3f}s {}'
+EXPLAIN_PREFIXES = ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'REPLACE')
+TOP_ORDERS = ('total', 'p99', 'count', 'max')
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0
+    samples = sorted(samples)
+    index = min(len(samples) - 1, int(round(p / 100.0 * (len(samples) - 1))))
+    return samples[index]
+
+
+class Profiler(object):
+    '''
+    hook keeping time spent by statement shape, and a log of slow queries
+
+    profiler = Profiler(slow_threshold=0.5, explain=session.using(db).execute)
+    add_hook(profiler)
+    profiler.top(10, by='p99')
+    profiler.slow_queries()
+
+    explain: callable(query, params) returning rows, EXPLAIN of slow mysql
+    statements is captured with it in a background thread, once per shape.
+    cassandra statements with ALLOW FILTERING are flagged as `full_scan`.
+    '''
+
+    def __init__(self, slow_threshold=DEFAULT_SLOW_THRESHOLD,
+                 top_n=DEFAULT_TOP_N, sample_size=DEFAULT_SAMPLE_SIZE,
+                 slow_log_size=DEFAULT_SLOW_LOG_SIZE, explain=None):
+        self.slow_threshold = slow_threshold
+        self.top_n = top_n
+        self.sample_size = sample_size
+        self.explain = explain
+
+        self._lock = Lock()
+        self._shapes = {}
+        self._slow = deque(maxlen=slow_log_size)
+        self._explained = {}
+        self._executor = None
+
+    def __call__(self, event):
+        if event.query.lstrip()[:7].upper() == 'EXPLAIN':
+            return
+
+        total = event.total_time
+        with self._lock:
+            shape = self._shapes.get(event.fingerprint)
+            if shape is None:
+                shape = self._shapes[event.fingerprint] = {
+                    'fingerprint': event.fingerprint,
+                    'statement': normalize_query(event.query),
+                    'backend': event.backend,
+                    'op': event.op,
+                    'collection': event.collection,
+                    'full_scan': 'ALLOW FILTERING' in event.query,
+                    'count': 0,
+                    'errors': 0,
+                    'total': 0,
+                    'max': 0,
+                    'samples': deque(maxlen=self.sample_size),
+                }
+            shape['count'] += 1
+            shape['total'] += total
+            shape['max'] = max(shape['max'], total)
+            shape['samples'].append(total)
+            if event.error:
+                shape['errors'] += 1
+
+        if total >= self.slow_threshold:
+            self._log_slow(event, total, shape['full_scan'])
+
+    def _log_slow(self, event, total, full_scan):
+        logger.warning(SLOW_QUERY_WARNING.format(total, event.query))
+        entry = dict(event.to_dict(), time=time.time(), full_scan=full_scan)
+        entry['explain'] = self._explained.get(event.fingerprint)
+        with self._lock:
+            self._slow.append(entry)
+
+        if (self.explain and event.backend == 'mysql' and
+                entry['explain'] is None and
+                event.query.lstrip()[:7].upper().startswith(EXPLAIN_PREFIXES)):
+            with self._lock:
+                if event.fingerprint in self._explained:
+                    return
+                self._explained[event.fingerprint] = []
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=1)
+            self._executor.submit(
+                self._capture_explain, entry, event.query, event.params)
+
+    def _capture_explain(self, entry, query, params):
+        try:
+            rows = self.explain('EXPLAIN ' + query, params)
+        except Exception as e:
+            logger.warning('EXPLAIN ERROR: {}'.format(str(e)))
+            rows = [{'error': str(e)}]
+        self._explained[entry['fingerprint']] = rows
+        entry['explain'] = rows
+
+    def top(self, n=None, by='total'):
+        if by not in TOP_ORDERS:
+            raise ValueError('order by one of {}'.format(TOP_ORDERS))
+        with self._lock:
+            shapes = []
+            for shape in self._shapes.values():
+                shape = dict(shape)
+                samples = shape.pop('samples')
+                shape['p50'] = percentile(samples, 50)
+                shape['p99'] = percentile(samples, 99)
+                shape['avg'] = shape['total'] / shape['count']
+                shapes.append(shape)
+        shapes.sort(key=lambda shape: shape[by], reverse=True)
+        return shapes[:n or self.top_n]
+
+    def slow_queries(self):
+        with self._lock:
+            return list(self._slow)
+
+    def reset(self):
+        with self._lock:
+            self._shapes = {}
+            self._slow.clear()
+            self._explained = {}
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
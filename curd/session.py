@@ -1,20 +1,29 @@
+import os
 import json
 from functools import partial
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-from .connections import CURD_FUNCTIONS
+from .connections import (
+    CURD_FUNCTIONS, ASYNC_CURD_FUNCTIONS, DEFAULT_FILTER_LIMIT,
+    scatter_filter, async_scatter_filter
+)
 
 from .errors import ProgrammingError
+from .cache import CachedConnection
 
 
 DB_CONNECTION_POOL = {}
 
+# threads of session running `filter_all`
+DEFAULT_SCATTER_WORKERS = 32
+
 try:
-    from .connections.mysql import MysqlConnectionPool
+    from .connections.mysql import mysql_connection_pool
 except Exception:
     pass
 else:
-    DB_CONNECTION_POOL['mysql'] = MysqlConnectionPool
+    DB_CONNECTION_POOL['mysql'] = mysql_connection_pool
 
 try:
     from .connections.cassandra import CassandraConnectionPool
@@ -23,6 +32,22 @@ except Exception:
 else:
     DB_CONNECTION_POOL['cassandra'] = CassandraConnectionPool
 
+ASYNC_DB_CONNECTION_POOL = {}
+
+try:
+    from .connections.aio_mysql import AsyncMysqlConnectionPool
+except Exception:
+    pass
+else:
+    ASYNC_DB_CONNECTION_POOL['mysql'] = AsyncMysqlConnectionPool
+
+try:
+    from .connections.aio_cassandra import AsyncCassandraConnectionPool
+except Exception:
+    pass
+else:
+    ASYNC_DB_CONNECTION_POOL['cassandra'] = AsyncCassandraConnectionPool
+
 
 class Session(object):
     '''
@@ -35,7 +60,13 @@ class Session(object):
             'user': 'user',
             'password': 'password',
             'max_op_fail_retry': 3,
-            'timeout': 60
+            'timeout': 60,
+            'pool_max_size': 32,
+            'pool_acquire_timeout': 60,
+            'retry_backoff': 0.05,
+            'retry_backoff_max': 2,
+            'breaker_failure_threshold': 5,
+            'breaker_reset_timeout': 30
         }
     }
     tidb conf
@@ -59,14 +90,30 @@ class Session(object):
             'username': 'username',
             'password': 'password',
             'max_op_fail_retry': 3,
-            'timeout': 60
+            'timeout': 60,
+            'prepared_statement_cache_size': 512
         }
     }
+    
+    cache: optional BaseCache (like LocalCache) for get / filter / exist,
+    invalidated by writes of the same collection through this session
+    
+    retry_budget: optional RetryBudget shared by all connections of session,
+    limiting retries to a ratio of requests
+    
+    `session.filter` and others are bound to default connection on first
+    access, keep the connection of `session.using(db)` or a
+    `session.collection(path)` for hot paths instead of looking up conf.
     '''
     
-    def __init__(self, dbs=None):
+    curd_functions = CURD_FUNCTIONS
+    
+    def __init__(self, dbs=None, cache=None, retry_budget=None):
         self._connection_cache = OrderedDict()
         self._default_connection = None
+        self._executor, self._executor_pid = None, None
+        self.cache = cache
+        self.retry_budget = retry_budget
         
         if dbs:
             for db in dbs:
@@ -75,45 +122,117 @@ class Session(object):
     def _create_connection(self, db):
         class_conn_pool = DB_CONNECTION_POOL.get(db['type'], None)
         if class_conn_pool:
-            return class_conn_pool(db['conf'])
+            conn = class_conn_pool(db['conf'], self.retry_budget)
+            if self.cache is not None:
+                conn = CachedConnection(conn, self.cache, json.dumps(db))
+            return conn
         else:
             if db['type'] in ['mysql', 'cassandra']:
                 raise ProgrammingError('no database driver')
             else:
                 raise ProgrammingError('not supported database')
         
-    def set_default_connection(self, db):
-        key = json.dumps(db)
-        conn = self._connection_cache.get(key, None)
-        if not conn:
-            conn = self._create_connection(db)
-            self._connection_cache[key] = conn
+    def _set_default(self, conn):
         self._default_connection = conn
+        # drop functions bound to previous default connection
+        for func in self.curd_functions:
+            self.__dict__.pop(func, None)
+        
+    def set_default_connection(self, db):
+        self._set_default(self._get_connection(db))
         
     def _get_connection(self, db):
         key = json.dumps(db)
         conn = self._connection_cache.get(key, None)
-        if conn:
-            return conn
-        else:
+        if not conn:
             conn = self._create_connection(db)
             self._connection_cache[key] = conn
             
             if not self._default_connection:
-                self._default_connection = conn
-            
-            return conn
+                self._set_default(conn)
+        return conn
         
     def using(self, db=None):
         if db:
             return self._get_connection(db)
         else:
             return self._default_connection
+    
+    def collection(self, path, db=None):
+        '''
+        users = session.collection('db.users')
+        users.get([('=', 'id', 1)])
+        
+        operations of one collection bound to its connection
+        '''
+        conn = self.using(db)
+        if not conn:
+            raise ProgrammingError('no database conf')
+        return Collection(conn, path, self.curd_functions)
+        
+    def filter_all(self, dbs, collection, filters=None, fields=None,
+                   order_by=None, limit=DEFAULT_FILTER_LIMIT,
+                   on_error='raise', source_field='_source', **kwargs):
+        '''
+        rows = session.filter_all(
+            [us_conf, eu_conf], 'db.users', filters, order_by=['-id'],
+            limit=10, on_error='partial')
+        
+        same filter on each db in parallel, rows merged by `order_by` and
+        cut at `limit`, `source_field` of a row is index of its db in dbs.
+        on_error='raise' fails at first error, 'partial' returns rows of
+        the others with errors by db index in `rows.errors`
+        '''
+        conns = [self.using(db) for db in dbs]
+        # threads of executor are not copied into a forked child
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(
+                max_workers=DEFAULT_SCATTER_WORKERS,
+                thread_name_prefix='curd-scatter')
+            self._executor_pid = os.getpid()
+        return scatter_filter(
+            self._executor, conns, collection, filters, fields, order_by,
+            limit, on_error, source_field, **kwargs)
+        
+    def warmup(self, n=None):
+        '''
+        session = Session(dbs)
+        session.warmup()
+        
+        open `n` connections (pool_min_size by default) of every db now,
+        before first request, return count opened
+        '''
+        return sum(
+            conn.warmup(n) for conn in list(self._connection_cache.values()))
+        
+    def transaction(self, db=None):
+        '''
+        with session.transaction() as tx:
+            tx.create(collection, item)
+        
+        operations on one connection committed together, mysql only
+        '''
+        conn = self.using(db)
+        if not conn:
+            raise ProgrammingError('no database conf')
+        return conn.transaction()
+    
+    def pinned(self, db=None):
+        '''
+        operations on one connection in autocommit mode, mysql only
+        '''
+        conn = self.using(db)
+        if not conn:
+            raise ProgrammingError('no database conf')
+        return conn.pinned()
         
     def __getattr__(self, item):
-        if item in CURD_FUNCTIONS:
+        if item in self.curd_functions:
             if self._default_connection:
-                return getattr(self._default_connection, item)
+                # cached in instance dict, later lookups skip __getattr__
+                func = getattr(self._default_connection, item)
+                self.__dict__[item] = func
+                return func
             else:
                 raise ProgrammingError('no database conf')
         else:
@@ -123,7 +242,62 @@ class Session(object):
         for k, v in self._connection_cache.items():
             v.close()
         self._connection_cache = OrderedDict()
-        self._default_connection = None
+        self._set_default(None)
+        if self._executor is not None:
+            if self._executor_pid == os.getpid():
+                self._executor.shutdown(wait=False)
+            self._executor, self._executor_pid = None, None
+
+
+class AsyncSession(Session):
+    '''
+    Session with coroutine operations, same db conf as Session
+    
+    session = AsyncSession([mysql_conf])
+    await session.create(collection, item)
+    await session.close()
+    
+    not supported yet: `cache`, and mysql replica set conf
+    (`primary` / `replicas`), both raise ProgrammingError
+    '''
+    
+    curd_functions = ASYNC_CURD_FUNCTIONS
+    
+    def __init__(self, dbs=None, cache=None, retry_budget=None):
+        if cache is not None:
+            raise ProgrammingError('cache not supported by AsyncSession')
+        super().__init__(dbs, retry_budget=retry_budget)
+    
+    def _create_connection(self, db):
+        class_conn_pool = ASYNC_DB_CONNECTION_POOL.get(db['type'], None)
+        if class_conn_pool:
+            if db['type'] == 'mysql' and 'primary' in db['conf']:
+                raise ProgrammingError(
+                    'replica set conf not supported by AsyncSession')
+            return class_conn_pool(db['conf'], self.retry_budget)
+        else:
+            if db['type'] in ['mysql', 'cassandra']:
+                raise ProgrammingError('no database driver')
+            else:
+                raise ProgrammingError('not supported database')
+    
+    async def filter_all(self, dbs, collection, filters=None, fields=None,
+                         order_by=None, limit=DEFAULT_FILTER_LIMIT,
+                         on_error='raise', source_field='_source',
+                         **kwargs):
+        '''
+        see Session.filter_all, queries of dbs gathered in event loop
+        '''
+        conns = [self.using(db) for db in dbs]
+        return await async_scatter_filter(
+            conns, collection, filters, fields, order_by, limit, on_error,
+            source_field, **kwargs)
+    
+    async def close(self):
+        for k, v in self._connection_cache.items():
+            await v.close()
+        self._connection_cache = OrderedDict()
+        self._set_default(None)
 
 
 class F(object):
@@ -152,6 +326,21 @@ class F(object):
         return 'IN', self._value, other
 
 
+class Collection(object):
+    '''
+    functions of a connection with collection bound as first argument
+    '''
+    
+    def __init__(self, conn, path, functions=CURD_FUNCTIONS):
+        self.conn = conn
+        self.path = path
+        
+        for func in functions:
+            method = getattr(conn, func, None)
+            if method is not None:
+                setattr(self, func, partial(method, path))
+
+
 class SimpleCollection(object):
     def __init__(self, session, path, timeout=None, retry=None):
         self.s = session
@@ -0,0 +1,276 @@
+import os
+import zlib
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .errors import ProgrammingError, BatchError
+from .connections import DEFAULT_FILTER_LIMIT, scatter_filter
+
+
+SHARD_STRATEGIES = ('hash', 'range', 'lookup')
+
+
+class ShardMap(object):
+    '''
+    shard key value -> index of shard (a db conf)
+
+    hash: crc32 of the value modulo count of shards, same in every process
+    range: `bounds` sorted, shard i holds bounds[i - 1] <= value < bounds[i],
+        one bound less than shards
+    lookup: `lookup` dict of value -> shard index, `default` index for
+        other values (error when None)
+
+    ShardMap('user_id', [db1, db2, db3], 'range', bounds=[1000, 2000])
+    '''
+
+    def __init__(self, key, shards, strategy='hash', bounds=None,
+                 lookup=None, default=None):
+        if strategy not in SHARD_STRATEGIES:
+            raise ProgrammingError(
+                'shard strategy should be one of {}'.format(SHARD_STRATEGIES))
+        if not shards:
+            raise ProgrammingError('no shard')
+        self.key = key
+        self.shards = list(shards)
+        self.strategy = strategy
+        self.bounds = list(bounds or ())
+        self.lookup = dict(lookup or {})
+        self.default = default
+
+        if strategy == 'range' and (
+                len(self.bounds) != len(self.shards) - 1 or
+                self.bounds != sorted(self.bounds)):
+            raise ProgrammingError(
+                'range shards need sorted bounds, one less than shards')
+
+    @classmethod
+    def from_conf(cls, conf):
+        '''
+        {
+            'key': 'user_id',
+            'strategy': 'hash',
+            'shards': [mysql_conf1, mysql_conf2]
+        }
+        '''
+        return cls(
+            conf['key'], conf['shards'], conf.get('strategy', 'hash'),
+            conf.get('bounds'), conf.get('lookup'), conf.get('default')
+        )
+
+    def index(self, value):
+        if value is None:
+            raise ProgrammingError('shard key {} is None'.format(self.key))
+        if self.strategy == 'hash':
+            if not isinstance(value, bytes):
+                value = str(value).encode('utf8')
+            return zlib.crc32(value) % len(self.shards)
+        elif self.strategy == 'range':
+            return bisect_right(self.bounds, value)
+        index = self.lookup.get(value, self.default)
+        if index is None:
+            raise ProgrammingError(
+                'no shard for {} {!r}'.format(self.key, value))
+        return index
+
+    def indexes(self, filters):
+        '''
+        shards that may hold rows matching filters, all when not routed
+        '''
+        indexes = None
+        low, high = 0, len(self.shards) - 1
+        for op, k, v in filters or ():
+            if k != self.key:
+                continue
+            op = op.upper()
+            if op == '=':
+                found = {self.index(v)}
+            elif op == 'IN':
+                found = {self.index(i) for i in v}
+            elif self.strategy != 'range':
+                continue
+            elif op in ('>', '>='):
+                low = max(low, bisect_right(self.bounds, v))
+                continue
+            elif op == '<':
+                high = min(high, bisect_left(self.bounds, v))
+                continue
+            elif op == '<=':
+                high = min(high, bisect_right(self.bounds, v))
+                continue
+            else:
+                continue
+            indexes = found if indexes is None else indexes & found
+        if indexes is None:
+            indexes = range(len(self.shards))
+        return [i for i in sorted(indexes) if low <= i <= high]
+
+
+class ShardedCollection(object):
+    '''
+    collection split across dbs of a session by a shard key
+
+    users = ShardedCollection(session, 'db.users', shard_map)
+    users.create({'user_id': 1, 'name': 'a'})
+    users.filter([('IN', 'user_id', [1, 2])], order_by=['-id'], limit=10)
+
+    operations go to the shard of the key value in `filters` / `data`,
+    others fan out to all shards in parallel:
+    filter merges rows of shards by `order_by` and stops at `limit`,
+    create_many is split per shard, BatchError keeps input row indexes,
+    update / delete run on every shard matched, shard key can't be updated.
+    '''
+
+    def __init__(self, session, path, shard_map):
+        if isinstance(shard_map, dict):
+            shard_map = ShardMap.from_conf(shard_map)
+        self.path = path
+        self.shard_map = shard_map
+        self.key = shard_map.key
+        self.conns = [session.using(db) for db in shard_map.shards]
+        self._pid = None
+        self._pool = None
+
+    @property
+    def _executor(self):
+        # threads of executor are not copied into a forked child
+        if self._pid != os.getpid():
+            self._pool = ThreadPoolExecutor(
+                max_workers=len(self.conns),
+                thread_name_prefix='curd-shard')
+            self._pid = os.getpid()
+        return self._pool
+
+    def using(self, value):
+        '''
+        connection of the shard holding `value`, for `execute`
+        '''
+        return self.conns[self.shard_map.index(value)]
+
+    def _shard_of_data(self, data):
+        if self.key not in data:
+            raise ProgrammingError('shard key {} missing'.format(self.key))
+        return self.shard_map.index(data[self.key])
+
+    def _run(self, indexes, func):
+        '''
+        func(conn) on shards of indexes in parallel, results in same order
+        '''
+        if len(indexes) == 1:
+            return [func(self.conns[indexes[0]])]
+        futures = [
+            self._executor.submit(func, self.conns[i]) for i in indexes
+        ]
+        return [f.result() for f in futures]
+
+    def create(self, data, mode='INSERT', **kwargs):
+        conn = self.conns[self._shard_of_data(data)]
+        return conn.create(self.path, data, mode, **kwargs)
+
+    def create_many(self, rows, mode='INSERT', **kwargs):
+        rows = list(rows)
+        groups = OrderedDict()
+        for index, data in enumerate(rows):
+            groups.setdefault(self._shard_of_data(data), []).append(index)
+
+        def create_shard(shard):
+            try:
+                self.conns[shard].create_many(
+                    self.path, [rows[i] for i in groups[shard]], mode,
+                    **kwargs)
+            except BatchError as e:
+                return e
+
+        shards = list(groups)
+        if len(shards) == 1:
+            results = [create_shard(shards[0])]
+        else:
+            results = list(self._executor.map(create_shard, shards))
+
+        # row indexes of shard back to indexes of input
+        errors = {}
+        for shard, result in zip(shards, results):
+            if result is not None:
+                for i, error in result.errors.items():
+                    errors[groups[shard][i]] = error
+        if errors:
+            raise BatchError(errors)
+
+    def update(self, data, filters, **kwargs):
+        if self.key in data:
+            raise ProgrammingError('shard key can not be updated')
+        self._run(
+            self.shard_map.indexes(filters),
+            lambda conn: conn.update(self.path, data, filters, **kwargs))
+
+    def delete(self, filters, **kwargs):
+        self._run(
+            self.shard_map.indexes(filters),
+            lambda conn: conn.delete(self.path, filters, **kwargs))
+
+    def filter(self, filters=None, fields=None, order_by=None,
+               limit=DEFAULT_FILTER_LIMIT, **kwargs):
+        indexes = self.shard_map.indexes(filters)
+        if len(indexes) == 1:
+            return self.conns[indexes[0]].filter(
+                self.path, filters, fields, order_by, limit, **kwargs)
+        if kwargs.get('row_format', 'dict') != 'dict':
+            raise ProgrammingError('rows of shards are merged as dict')
+        return list(scatter_filter(
+            self._executor, [self.conns[i] for i in indexes], self.path,
+            filters, fields, order_by, limit, **kwargs))
+
+    def get(self, filters=None, fields=None, **kwargs):
+        rows = self.filter(filters, fields, limit=1, **kwargs)
+        return rows[0] if rows else None
+
+    def exist(self, filters, **kwargs):
+        return any(self._run(
+            self.shard_map.indexes(filters),
+            lambda conn: conn.exist(self.path, filters, **kwargs)))
+
+    def get_many(self, key, values, fields=None, as_dict=False, **kwargs):
+        '''
+        values of shard key are looked up on their shards only
+        '''
+        values = list(values)
+        if key == self.key:
+            groups = OrderedDict()
+            for value in OrderedDict.fromkeys(values):
+                groups.setdefault(
+                    self.shard_map.index(value), []).append(value)
+            indexes = list(groups)
+        else:
+            indexes = list(range(len(self.conns)))
+            groups = {i: values for i in indexes}
+
+        def get_shard(index):
+            try:
+                return self.conns[index].get_many(
+                    self.path, key, groups[index], fields, as_dict=True,
+                    **kwargs)
+            except BatchError as e:
+                return e
+
+        if len(indexes) == 1:
+            results = [get_shard(indexes[0])]
+        else:
+            results = list(self._executor.map(get_shard, indexes))
+
+        rows, errors = {}, {}
+        for result in results:
+            if isinstance(result, BatchError):
+                errors.update(result.errors)
+                result = result.results or {}
+            for value, row in result.items():
+                rows.setdefault(value, row)
+        if not as_dict:
+            rows = [rows.get(v) for v in values]
+        if errors:
+            raise BatchError(errors, rows)
+        return rows
+
+    def close(self):
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.shutdown(wait=False)
+        self._pid, self._pool = None, None
@@ -0,0 +1,252 @@
+import os
+import time
+import weakref
+from threading import Condition, Lock, Thread
+
+from .errors import BufferFullError, ProgrammingError
+from .cache import freeze
+from .connections import logger
+
+
+DEFAULT_MAX_ROWS = 1000
+DEFAULT_MAX_LATENCY_MS = 100
+DEFAULT_BUFFER_FACTOR = 10
+
+WRITER_ERROR_WARNING = 'WRITER ERROR: {} {} {}'
+
+_WRITERS = weakref.WeakSet()
+
+
+def _reset_writers():
+    for writer in list(_WRITERS):
+        writer._reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    # rows buffered before fork are dropped in child, written by parent
+    os.register_at_fork(after_in_child=_reset_writers)
+
+
+class BufferedWriter(object):
+    '''
+    write behind buffer of create / update, flushed in background
+
+    writer = BufferedWriter(session, collection, max_rows=1000,
+                            max_latency_ms=100)
+    writer.create(item)
+    writer.update(data, filters)
+    writer.close()
+
+    creates are grouped by collection and mode, written with `create_many`,
+    updates are written in order after creates of the same flush, in a
+    transaction when supported, one merged into the update just before it
+    when filters are same.
+    a flush happens when `max_rows` are buffered or the oldest one waited
+    `max_latency_ms`. `create` / `update` block when `max_buffer_rows` are
+    pending (`block=False` or `timeout` to raise BufferFullError).
+    on_error: callable(error, op, collection, items), failed rows are dropped
+
+    a forked child starts with an empty buffer, `flush` or `close` before
+    fork to write rows buffered by parent, no I/O is done in fork hooks.
+    '''
+
+    def __init__(self, session, collection=None, max_rows=DEFAULT_MAX_ROWS,
+                 max_latency_ms=DEFAULT_MAX_LATENCY_MS, max_buffer_rows=None,
+                 block=True, timeout=None, on_error=None, db=None):
+        self.conn = session.using(db)
+        if not self.conn:
+            raise ProgrammingError('no database conf')
+        self.collection = collection
+        self.max_rows = max_rows
+        self.max_latency = max_latency_ms / 1000
+        self.max_buffer_rows = max_buffer_rows or \
+            max_rows * DEFAULT_BUFFER_FACTOR
+        self.block = block
+        self.timeout = timeout
+        self.on_error = on_error
+
+        self.queued = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.errors = 0
+        self.blocked = 0
+        self.flush_time = 0
+
+        self._reset()
+        _WRITERS.add(self)
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self._cond = Condition()
+        self._flush_lock = Lock()
+        # (op, collection, mode) -> rows or [(filters key, (data, filters))]
+        self._buffer = {}
+        self._pending = 0
+        self._oldest = None
+        self._closed = False
+        self._thread = None
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = Thread(
+                target=self._run, name='curd-buffered-writer', daemon=True)
+            self._thread.start()
+
+    def _put(self, key, item, merge_key=None):
+        with self._cond:
+            if self._closed:
+                raise ProgrammingError('writer is closed')
+            if self._pending >= self.max_buffer_rows:
+                if not self.block:
+                    raise BufferFullError(
+                        '{} rows pending'.format(self._pending))
+                self.blocked += 1
+                deadline = None if self.timeout is None else \
+                    time.monotonic() + self.timeout
+                while self._pending >= self.max_buffer_rows:
+                    remaining = None if deadline is None else \
+                        deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise BufferFullError(
+                            '{} rows pending after {}s'.format(
+                                self._pending, self.timeout))
+                    self._cond.wait(remaining)
+                    if self._closed:
+                        raise ProgrammingError('writer is closed')
+
+            if merge_key is None:
+                self._buffer.setdefault(key, []).append(item)
+                self._pending += 1
+            else:
+                # only into the last one, an update of overlapping rows
+                # may be queued between two with same filters
+                updates = self._buffer.setdefault(key, [])
+                if updates and updates[-1][0] == merge_key:
+                    updates[-1][1][0].update(item[0])
+                else:
+                    updates.append((merge_key, item))
+                    self._pending += 1
+            self.queued += 1
+            self._start()
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+                # flusher waits without timeout when buffer is empty
+                self._cond.notify_all()
+            elif self._pending >= self.max_rows:
+                self._cond.notify_all()
+
+    def create(self, data, mode='INSERT', collection=None):
+        collection = collection or self.collection
+        self._put(('create', collection, mode.upper()), dict(data))
+
+    def update(self, data, filters, collection=None):
+        collection = collection or self.collection
+        self._put(
+            ('update', collection, None), (dict(data), filters),
+            merge_key=freeze(filters)
+        )
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if self._pending >= self.max_rows:
+                        break
+                    if self._oldest is None:
+                        self._cond.wait()
+                        continue
+                    remaining = self._oldest + self.max_latency - \
+                        time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed:
+                    return
+            self.flush()
+
+    def _take(self):
+        with self._cond:
+            buffer, self._buffer = self._buffer, {}
+            pending, self._pending = self._pending, 0
+            self._oldest = None
+            self._cond.notify_all()
+        return buffer, pending
+
+    def _report(self, error, op, collection, items):
+        self.errors += 1
+        if self.on_error:
+            try:
+                self.on_error(error, op, collection, items)
+            except Exception as e:
+                logger.warning(str(e))
+        else:
+            logger.warning(WRITER_ERROR_WARNING.format(
+                op, collection, str(error)))
+
+    def _write_updates(self, collection, updates):
+        try:
+            tx = self.conn.transaction()
+        except ProgrammingError:
+            for data, filters in updates:
+                self.conn.update(collection, data, filters)
+        else:
+            with tx:
+                for data, filters in updates:
+                    tx.update(collection, data, filters)
+
+    def flush(self):
+        '''
+        write rows buffered, in caller thread
+        '''
+        with self._flush_lock:
+            buffer, pending = self._take()
+            if not buffer:
+                return
+            start = time.perf_counter()
+            creates = [k for k in buffer if k[0] == 'create']
+            updates = [k for k in buffer if k[0] == 'update']
+            for key in creates + updates:
+                op, collection, mode = key
+                items = buffer[key]
+                try:
+                    if op == 'create':
+                        self.conn.create_many(collection, items, mode=mode)
+                    else:
+                        items = [item for _, item in items]
+                        self._write_updates(collection, items)
+                except Exception as e:
+                    self._report(e, op, collection, items)
+            self.flushes += 1
+            self.flushed += pending
+            self.flush_time += time.perf_counter() - start
+
+    def close(self):
+        '''
+        flush rows buffered and stop background thread
+        '''
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+        _WRITERS.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pending': self._pending,
+                'queued': self.queued,
+                'flushed': self.flushed,
+                'flushes': self.flushes,
+                'errors': self.errors,
+                'blocked': self.blocked,
+                'flush_time': self.flush_time,
+            }
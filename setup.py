@@ -10,10 +10,13 @@ setup(
     author_email='jdxin00@gmail.com',
     license='MIT',
     keywords='db operations',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     install_requires=[],
     extras_require={
         'cassandra': ['cassandra-driver==3.11.0'],
-        'mysql': ['PyMySQL==0.7.11']
+        'mysql': ['PyMySQL==0.7.11'],
+        'aiomysql': ['aiomysql'],
+        'numpy': ['numpy'],
+        'pandas': ['pandas']
     }
 )
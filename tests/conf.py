@@ -8,9 +8,21 @@ mysql_conf = {
     }
 }
 
+mysql_replica_set_conf = {
+    'type': 'mysql',
+    'conf': {
+        'primary': {'host': '127.0.0.1', 'port': 3306},
+        'replicas': [{'host': '127.0.0.1', 'port': 3306}],
+        'user': 'root',
+        'password': '',
+        'read_after_write_pin': 1,
+    }
+}
+
 cassandra_conf = {
     'type': 'cassandra',
     'conf': {
         'hosts': ['127.0.0.1'],
+        'lwt': True,
     }
 }
@@ -0,0 +1,1346 @@
+'''
+in-process stand-in for a mysql server, speaking enough of the client /
+server protocol for pymysql to run the statements curd generates against
+an in-memory table store
+
+faults can be injected to load test the pool, retry / backoff, timeouts
+and streaming without a real database:
+
+    latency      seconds slept before answering each query
+    slow_read    seconds slept before each row packet, trips read_timeout
+    drop_rate    probability a query is answered by closing the socket,
+                 the client sees 2013 (lost connection) or 2006 (gone away)
+    reject_rate  probability a new connection is refused with 1040
+                 (too many connections)
+
+`fail_next(kind, count)` injects the same faults deterministically.
+query faults skip the SET statements pymysql sends while connecting, so
+they land on the statements of the test.
+
+    with FakeMysqlServer() as server:
+        session = Session([{'type': 'mysql', 'conf': server.conf}])
+'''
+import re
+import time
+import random
+import socket
+import struct
+import datetime
+import threading
+from decimal import Decimal
+from functools import partial
+
+
+PROTOCOL_VERSION = 10
+SERVER_VERSION = b'5.7.99-curd-fake'
+CHARSET_UTF8MB4 = 45
+CHARSET_BINARY = 63
+
+CLIENT_LONG_PASSWORD = 0x1
+CLIENT_FOUND_ROWS = 0x2
+CLIENT_LONG_FLAG = 0x4
+CLIENT_CONNECT_WITH_DB = 0x8
+CLIENT_PROTOCOL_41 = 0x200
+CLIENT_TRANSACTIONS = 0x2000
+CLIENT_SECURE_CONNECTION = 0x8000
+CLIENT_MULTI_STATEMENTS = 0x10000
+CLIENT_MULTI_RESULTS = 0x20000
+CLIENT_PLUGIN_AUTH = 0x80000
+CLIENT_PLUGIN_AUTH_LENENC_DATA = 0x200000
+SERVER_CAPABILITIES = (
+    CLIENT_LONG_PASSWORD | CLIENT_FOUND_ROWS | CLIENT_LONG_FLAG |
+    CLIENT_CONNECT_WITH_DB | CLIENT_PROTOCOL_41 | CLIENT_TRANSACTIONS |
+    CLIENT_SECURE_CONNECTION | CLIENT_MULTI_STATEMENTS |
+    CLIENT_MULTI_RESULTS | CLIENT_PLUGIN_AUTH
+)
+
+SERVER_STATUS_IN_TRANS = 0x1
+SERVER_STATUS_AUTOCOMMIT = 0x2
+
+COM_QUIT = 0x01
+COM_INIT_DB = 0x02
+COM_QUERY = 0x03
+COM_PING = 0x0e
+
+TYPE_NEWDECIMAL = 0xf6
+TYPE_DOUBLE = 0x05
+TYPE_LONGLONG = 0x08
+TYPE_DATE = 0x0a
+TYPE_DATETIME = 0x0c
+TYPE_JSON = 0xf5
+TYPE_BLOB = 0xfc
+TYPE_VAR_STRING = 0xfd
+
+ER_TOO_MANY_CONNECTIONS = 1040
+ER_DB_CREATE_EXISTS = 1007
+ER_BAD_DB_ERROR = 1049
+ER_NO_DB_ERROR = 1046
+ER_TABLE_EXISTS_ERROR = 1050
+ER_BAD_FIELD_ERROR = 1054
+ER_DUP_ENTRY = 1062
+ER_PARSE_ERROR = 1064
+ER_NO_SUCH_TABLE = 1146
+ER_UNKNOWN_COM_ERROR = 1047
+
+FAULT_KINDS = ('drop', 'reject', 'error', 'slow')
+
+# declared column type prefix -> (python type, wire type, charset)
+COLUMN_TYPES = (
+    (('tinyint', 'smallint', 'mediumint', 'bigint', 'int', 'integer',
+      'bool', 'boolean', 'year'), (int, TYPE_LONGLONG, CHARSET_BINARY)),
+    (('float', 'double', 'real'), (float, TYPE_DOUBLE, CHARSET_BINARY)),
+    (('decimal', 'numeric'), (Decimal, TYPE_NEWDECIMAL, CHARSET_BINARY)),
+    (('datetime', 'timestamp'),
+     (datetime.datetime, TYPE_DATETIME, CHARSET_BINARY)),
+    (('date', ), (datetime.date, TYPE_DATE, CHARSET_BINARY)),
+    (('json', ), (str, TYPE_JSON, CHARSET_UTF8MB4)),
+    (('tinyblob', 'mediumblob', 'longblob', 'blob', 'binary', 'varbinary'),
+     (bytes, TYPE_BLOB, CHARSET_BINARY)),
+)
+DEFAULT_COLUMN_TYPE = (str, TYPE_VAR_STRING, CHARSET_UTF8MB4)
+
+TOKEN_RE = re.compile(r'''
+    (?P<ws>\s+)
+  | (?P<ident>`(?:[^`]|``)*`)
+  | (?P<hex>(?:_binary\s*)?[xX]'[0-9a-fA-F]*')
+  | (?P<bstr>_binary\s*'(?:[^'\\]|\\.|'')*')
+  | (?P<str>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+  | (?P<num>-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+  | (?P<var>@@?[\w.]+)
+  | (?P<word>[A-Za-z_][\w$]*)
+  | (?P<op><=|>=|!=|<>|[=<>(),.*;])
+''', re.X | re.S)
+
+SET_RE = re.compile(r'\s*SET\s', re.I)
+
+END_OF_DEFINITION = (('op', ','), ('op', ')'))
+
+ESCAPES = {
+    '0': '\0', 'b': '\b', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a',
+    '%': '\\%', '_': '\\_',
+}
+ESCAPE_RE = re.compile(r'\\(.)', re.S)
+
+
+class SqlError(Exception):
+    def __init__(self, code, message, sqlstate='HY000'):
+        super().__init__(code, message)
+        self.code = code
+        self.message = message
+        self.sqlstate = sqlstate
+
+
+class ConnectionDropped(Exception):
+    pass
+
+
+def unescape(s):
+    quote = s[0]
+    s = s[1:-1].replace(quote * 2, quote)
+    return ESCAPE_RE.sub(lambda m: ESCAPES.get(m.group(1), m.group(1)), s)
+
+
+def tokenize(sql):
+    tokens, pos = [], 0
+    while pos < len(sql):
+        m = TOKEN_RE.match(sql, pos)
+        if not m:
+            raise SqlError(
+                ER_PARSE_ERROR,
+                'You have an error in your SQL syntax near {!r}'.format(
+                    sql[pos:pos + 20]), '42000')
+        pos = m.end()
+        kind, text = m.lastgroup, m.group()
+        if kind == 'ws':
+            continue
+        elif kind == 'ident':
+            tokens.append(('ident', text[1:-1].replace('``', '`')))
+        elif kind == 'hex':
+            tokens.append(('const', bytes.fromhex(text[text.index("'"):]
+                                                  .strip("'"))))
+        elif kind == 'bstr':
+            value = unescape(text[text.index("'"):])
+            tokens.append(
+                ('const', value.encode('utf8', 'surrogateescape')))
+        elif kind == 'str':
+            tokens.append(('const', unescape(text)))
+        elif kind == 'num':
+            if re.match(r'^-?\d+$', text):
+                tokens.append(('const', int(text)))
+            else:
+                tokens.append(('const', float(text)))
+        elif kind == 'word':
+            upper = text.upper()
+            if upper == 'NULL':
+                tokens.append(('const', None))
+            elif upper in ('TRUE', 'FALSE'):
+                tokens.append(('const', int(upper == 'TRUE')))
+            else:
+                tokens.append(('word', text))
+        else:
+            tokens.append((kind, text))
+    return tokens
+
+
+def sort_key(name, item):
+    # NULL sorts first ascending like mysql
+    value = item[1][name]
+    if value is None:
+        return (False, 0)
+    return (True, value)
+
+
+def column_type(declared):
+    declared = declared.lower()
+    for prefixes, spec in COLUMN_TYPES:
+        if declared.startswith(prefixes):
+            return spec
+    return DEFAULT_COLUMN_TYPE
+
+
+def value_type(value):
+    if isinstance(value, bool) or isinstance(value, int):
+        return int, TYPE_LONGLONG, CHARSET_BINARY
+    elif isinstance(value, float):
+        return float, TYPE_DOUBLE, CHARSET_BINARY
+    elif isinstance(value, Decimal):
+        return Decimal, TYPE_NEWDECIMAL, CHARSET_BINARY
+    elif isinstance(value, datetime.datetime):
+        return datetime.datetime, TYPE_DATETIME, CHARSET_BINARY
+    elif isinstance(value, bytes):
+        return bytes, TYPE_BLOB, CHARSET_BINARY
+    return DEFAULT_COLUMN_TYPE
+
+
+def cast(value, python_type):
+    if value is None or isinstance(value, python_type):
+        return value
+    try:
+        if python_type is bytes:
+            return str(value).encode('utf8')
+        elif python_type is str:
+            if isinstance(value, bytes):
+                return value.decode('utf8')
+            return str(value)
+        elif python_type is int:
+            return int(float(value)) if isinstance(value, str) else int(value)
+        elif python_type is datetime.datetime:
+            return datetime.datetime.fromisoformat(str(value))
+        elif python_type is datetime.date:
+            return datetime.date.fromisoformat(str(value)[:10])
+        return python_type(value)
+    except (TypeError, ValueError):
+        raise SqlError(1366, 'Incorrect value: {!r}'.format(value))
+
+
+def encode_text(value):
+    if value is None:
+        return None
+    elif isinstance(value, bytes):
+        return value
+    elif isinstance(value, bool):
+        return b'1' if value else b'0'
+    elif isinstance(value, datetime.datetime):
+        return value.isoformat(' ').encode()
+    return str(value).encode('utf8')
+
+
+def lenenc_int(n):
+    if n < 251:
+        return struct.pack('<B', n)
+    elif n < 1 << 16:
+        return b'\xfc' + struct.pack('<H', n)
+    elif n < 1 << 24:
+        return b'\xfd' + struct.pack('<I', n)[:3]
+    return b'\xfe' + struct.pack('<Q', n)
+
+
+def lenenc_str(s):
+    if s is None:
+        return b'\xfb'
+    return lenenc_int(len(s)) + s
+
+
+class Column(object):
+    def __init__(self, name, declared='text', auto_increment=False):
+        self.name = name
+        self.python_type, self.type_code, self.charset = column_type(declared)
+        self.auto_increment = auto_increment
+
+
+class Table(object):
+    def __init__(self, db, name, columns, primary_key, auto_increment=1):
+        self.db = db
+        self.name = name
+        self.columns = columns
+        self.column_map = {c.name: c for c in columns}
+        self.primary_key = primary_key
+        self.auto_increment = auto_increment
+        # primary key tuple -> row dict, in insertion order
+        self.rows = {}
+
+    def column(self, name):
+        try:
+            return self.column_map[name]
+        except KeyError:
+            raise SqlError(
+                ER_BAD_FIELD_ERROR,
+                "Unknown column '{}' in '{}'".format(name, self.name),
+                '42S22')
+
+    def cast(self, name, value):
+        return cast(value, self.column(name).python_type)
+
+    def key(self, row):
+        if self.primary_key:
+            return tuple(row[k] for k in self.primary_key)
+        return id(row)
+
+    def insert(self, row, undo):
+        key = self.key(row)
+        self.rows[key] = row
+        undo.append(lambda: self.rows.pop(key, None))
+
+    def replace(self, key, row, undo):
+        old = self.rows.pop(key)
+        new_key = self.key(row)
+        if new_key != key and new_key in self.rows:
+            self.rows[key] = old
+            raise SqlError(
+                ER_DUP_ENTRY,
+                "Duplicate entry '{}' for key 'PRIMARY'".format(
+                    '-'.join(str(k) for k in new_key)),
+                '23000')
+        self.rows[new_key] = row
+
+        def restore():
+            self.rows.pop(new_key, None)
+            self.rows[key] = old
+        undo.append(restore)
+
+    def delete(self, key, undo):
+        old = self.rows.pop(key)
+        undo.append(lambda: self.rows.__setitem__(key, old))
+
+
+class Connection(object):
+    '''
+    state of one client connection
+    '''
+
+    def __init__(self, connection_id, db=None):
+        self.id = connection_id
+        self.db = db
+        self.variables = {}
+        self.autocommit = True
+        # undo log of the open transaction, None out of transaction
+        self.undo = None
+
+    @property
+    def status(self):
+        status = SERVER_STATUS_AUTOCOMMIT if self.autocommit else 0
+        if self.undo is not None:
+            status |= SERVER_STATUS_IN_TRANS
+        return status
+
+    def rollback(self):
+        undo, self.undo = self.undo, None
+        for func in reversed(undo or ()):
+            func()
+
+
+class OK(object):
+    def __init__(self, affected_rows=0, insert_id=0):
+        self.affected_rows = affected_rows
+        self.insert_id = insert_id
+
+
+class ResultSet(object):
+    def __init__(self, columns, rows):
+        # columns: [(name, python_type, type_code, charset)]
+        self.columns = columns
+        self.rows = rows
+
+
+class Parser(object):
+    def __init__(self, sql, connection):
+        self.sql = sql
+        self.tokens = tokenize(sql)
+        self.pos = 0
+        self.connection = connection
+        # seconds of SLEEP(), slept after the store lock is released
+        self.sleep = 0
+
+    def error(self):
+        near = ' '.join(str(t[1]) for t in self.tokens[self.pos:self.pos + 5])
+        return SqlError(
+            ER_PARSE_ERROR,
+            "You have an error in your SQL syntax near '{}'".format(near),
+            '42000')
+
+    def peek(self, offset=0):
+        if self.pos + offset < len(self.tokens):
+            return self.tokens[self.pos + offset]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise self.error()
+        self.pos += 1
+        return token
+
+    def at_word(self, *words):
+        kind, text = self.peek()
+        return kind == 'word' and text.upper() in words
+
+    def accept(self, *words):
+        if self.at_word(words[0]):
+            for i, word in enumerate(words):
+                kind, text = self.peek(i)
+                if kind != 'word' or text.upper() != word:
+                    return False
+            self.pos += len(words)
+            return True
+        return False
+
+    def expect(self, *words):
+        if not self.accept(*words):
+            raise self.error()
+
+    def accept_op(self, op):
+        if self.peek() == ('op', op):
+            self.pos += 1
+            return True
+        return False
+
+    def expect_op(self, op):
+        if not self.accept_op(op):
+            raise self.error()
+
+    def at_end(self):
+        while self.accept_op(';'):
+            pass
+        return self.peek()[0] is None
+
+    def ident(self):
+        kind, text = self.next()
+        if kind not in ('ident', 'word'):
+            raise self.error()
+        return text
+
+    def name(self):
+        '''
+        [db.]table
+        '''
+        name = self.ident()
+        if self.accept_op('.'):
+            return name, self.ident()
+        return self.connection.db, name
+
+    def column_name(self):
+        name = self.ident()
+        while self.accept_op('.'):
+            name = self.ident()
+        return name
+
+    def ident_list(self):
+        self.expect_op('(')
+        names = [self.column_name()]
+        while self.accept_op(','):
+            names.append(self.column_name())
+        self.expect_op(')')
+        return names
+
+    def skip_parens(self):
+        depth = 0
+        while True:
+            kind, text = self.next()
+            if (kind, text) == ('op', '('):
+                depth += 1
+            elif (kind, text) == ('op', ')'):
+                depth -= 1
+                if depth <= 0:
+                    return
+
+    def skip_rest(self):
+        self.pos = len(self.tokens)
+
+    def operand(self):
+        '''
+        expression node: ('const', v) / ('col', name) / ('row', [nodes]) /
+        ('values', name) / ('count', )
+        '''
+        kind, text = self.peek()
+        if kind == 'const':
+            self.pos += 1
+            return ('const', text)
+        elif kind == 'var':
+            self.pos += 1
+            return ('const', self.connection.variables.get(text.lstrip('@')))
+        elif (kind, text) == ('op', '('):
+            self.pos += 1
+            nodes = [self.operand()]
+            while self.accept_op(','):
+                nodes.append(self.operand())
+            self.expect_op(')')
+            return nodes[0] if len(nodes) == 1 else ('row', nodes)
+        elif kind == 'word' and self.peek(1) == ('op', '('):
+            return self.function()
+        elif kind in ('ident', 'word'):
+            return ('col', self.column_name())
+        raise self.error()
+
+    def function(self):
+        name = self.ident().upper()
+        self.expect_op('(')
+        if name == 'COUNT':
+            if not self.accept_op('*'):
+                self.operand()
+            self.expect_op(')')
+            return ('count', )
+        elif name == 'VALUES':
+            column = self.column_name()
+            self.expect_op(')')
+            return ('values', column)
+        args = []
+        if not self.accept_op(')'):
+            args.append(self.operand())
+            while self.accept_op(','):
+                args.append(self.operand())
+            self.expect_op(')')
+        values = [a[1] if a[0] == 'const' else None for a in args]
+        if name in ('COMPRESS', 'UNCOMPRESS', 'BINARY'):
+            return args[0]
+        elif name == 'SLEEP':
+            self.sleep += float(values[0])
+            return ('const', 0)
+        elif name == 'NOW':
+            return ('const', datetime.datetime.now().replace(microsecond=0))
+        elif name in ('DATABASE', 'SCHEMA'):
+            return ('const', self.connection.db)
+        elif name == 'CONNECTION_ID':
+            return ('const', self.connection.id)
+        raise SqlError(
+            1305, 'FUNCTION {} does not exist'.format(name), '42000')
+
+    def where(self):
+        conditions = []
+        if self.accept('WHERE'):
+            conditions.append(self.condition())
+            while self.accept('AND'):
+                conditions.append(self.condition())
+        return conditions
+
+    def condition(self):
+        left = self.operand()
+        if self.accept('IS', 'NOT'):
+            self.expect_null()
+            return (left, 'IS NOT', ('const', None))
+        elif self.accept('IS'):
+            self.expect_null()
+            return (left, 'IS', ('const', None))
+        elif self.accept('NOT', 'IN'):
+            return (left, 'NOT IN', self.in_list())
+        elif self.accept('IN'):
+            return (left, 'IN', self.in_list())
+        kind, op = self.next()
+        if kind != 'op' or op not in ('=', '!=', '<>', '<', '>', '<=', '>='):
+            raise self.error()
+        return (left, '!=' if op == '<>' else op, self.operand())
+
+    def expect_null(self):
+        if self.next() != ('const', None):
+            raise self.error()
+
+    def in_list(self):
+        self.expect_op('(')
+        nodes = [self.operand()]
+        while self.accept_op(','):
+            nodes.append(self.operand())
+        self.expect_op(')')
+        return ('row', nodes)
+
+    def order_by(self):
+        keys = []
+        if self.accept('ORDER', 'BY'):
+            while True:
+                name = self.column_name()
+                desc = self.accept('DESC')
+                if not desc:
+                    self.accept('ASC')
+                keys.append((name, desc))
+                if not self.accept_op(','):
+                    break
+        return keys
+
+    def limit(self):
+        limit, offset = None, 0
+        if self.accept('LIMIT'):
+            limit = self.next()[1]
+            if self.accept_op(','):
+                offset, limit = limit, self.next()[1]
+            elif self.accept('OFFSET'):
+                offset = self.next()[1]
+            if not isinstance(limit, int) or not isinstance(offset, int):
+                raise self.error()
+        return limit, offset
+
+    def assignments(self):
+        assignments = [self.assignment()]
+        while self.accept_op(','):
+            assignments.append(self.assignment())
+        return assignments
+
+    def assignment(self):
+        name = self.column_name()
+        self.expect_op('=')
+        return name, self.operand()
+
+
+class FakeMysqlStore(object):
+    '''
+    databases of in-memory tables, every statement runs under one lock
+    '''
+
+    def __init__(self):
+        self.databases = {}
+        self.lock = threading.RLock()
+
+    def table(self, db, name):
+        if db is None:
+            raise SqlError(ER_NO_DB_ERROR, 'No database selected', '3D000')
+        try:
+            return self.databases[db][name]
+        except KeyError:
+            raise SqlError(
+                ER_NO_SUCH_TABLE,
+                "Table '{}.{}' doesn't exist".format(db, name), '42S02')
+
+    def execute(self, sql, connection):
+        parser = Parser(sql, connection)
+        kind, word = parser.peek()
+        if kind != 'word':
+            raise parser.error()
+        handler = getattr(self, 'execute_' + word.lower(), None)
+        if handler is None:
+            raise parser.error()
+        parser.pos += 1
+
+        with self.lock:
+            undo = []
+            try:
+                result = handler(parser, connection, undo)
+                if not parser.at_end():
+                    raise parser.error()
+            except Exception:
+                for func in reversed(undo):
+                    func()
+                raise
+            if connection.undo is not None:
+                connection.undo.extend(undo)
+            elif undo and not connection.autocommit:
+                connection.undo = undo
+        if parser.sleep:
+            time.sleep(parser.sleep)
+        return result
+
+    # ddl
+
+    def execute_create(self, parser, connection, undo):
+        if parser.accept('DATABASE') or parser.accept('SCHEMA'):
+            if_not_exists = parser.accept('IF', 'NOT', 'EXISTS')
+            name = parser.ident()
+            parser.skip_rest()
+            if name in self.databases:
+                if if_not_exists:
+                    return OK()
+                raise SqlError(
+                    ER_DB_CREATE_EXISTS,
+                    "Can't create database '{}'; database exists".format(
+                        name))
+            self.databases[name] = {}
+            return OK(1)
+
+        parser.expect('TABLE')
+        if_not_exists = parser.accept('IF', 'NOT', 'EXISTS')
+        db, name = parser.name()
+        if db not in self.databases:
+            raise SqlError(
+                ER_BAD_DB_ERROR, "Unknown database '{}'".format(db), '42000')
+        if name in self.databases[db]:
+            if if_not_exists:
+                parser.skip_rest()
+                return OK()
+            raise SqlError(
+                ER_TABLE_EXISTS_ERROR,
+                "Table '{}' already exists".format(name), '42S01')
+
+        columns, primary_key = [], []
+        parser.expect_op('(')
+        while True:
+            if parser.accept('PRIMARY', 'KEY'):
+                primary_key = parser.ident_list()
+            elif parser.at_word('KEY', 'INDEX', 'UNIQUE', 'CONSTRAINT'):
+                while parser.peek() not in END_OF_DEFINITION:
+                    if parser.peek() == ('op', '('):
+                        parser.skip_parens()
+                    else:
+                        parser.next()
+            else:
+                columns.append(self.column_definition(parser, primary_key))
+            if not parser.accept_op(','):
+                break
+        parser.expect_op(')')
+
+        auto_increment = 1
+        while not parser.at_end():
+            if parser.accept('AUTO_INCREMENT'):
+                parser.accept_op('=')
+                auto_increment = parser.next()[1]
+            else:
+                parser.next()
+
+        table = Table(db, name, columns, primary_key, auto_increment)
+        self.databases[db][name] = table
+        return OK()
+
+    def column_definition(self, parser, primary_key):
+        name = parser.ident()
+        declared = parser.ident()
+        if parser.peek() == ('op', '('):
+            parser.skip_parens()
+        auto_increment = False
+        while parser.peek() not in END_OF_DEFINITION:
+            if parser.accept('AUTO_INCREMENT'):
+                auto_increment = True
+            elif parser.accept('PRIMARY', 'KEY'):
+                primary_key.append(name)
+            elif parser.peek() == ('op', '('):
+                parser.skip_parens()
+            else:
+                parser.next()
+        return Column(name, declared, auto_increment)
+
+    def execute_drop(self, parser, connection, undo):
+        if parser.accept('DATABASE') or parser.accept('SCHEMA'):
+            if_exists = parser.accept('IF', 'EXISTS')
+            name = parser.ident()
+            if name not in self.databases:
+                if if_exists:
+                    return OK()
+                raise SqlError(
+                    1008, "Can't drop database '{}'; database doesn't "
+                          "exist".format(name))
+            tables = self.databases.pop(name)
+            return OK(len(tables))
+
+        parser.expect('TABLE')
+        if_exists = parser.accept('IF', 'EXISTS')
+        db, name = parser.name()
+        try:
+            self.table(db, name)
+        except SqlError:
+            if if_exists:
+                return OK()
+            raise
+        del self.databases[db][name]
+        return OK()
+
+    def execute_truncate(self, parser, connection, undo):
+        parser.accept('TABLE')
+        table = self.table(*parser.name())
+        table.rows.clear()
+        return OK()
+
+    # session
+
+    def execute_use(self, parser, connection, undo):
+        name = parser.ident()
+        if name not in self.databases:
+            raise SqlError(
+                ER_BAD_DB_ERROR, "Unknown database '{}'".format(name),
+                '42000')
+        connection.db = name
+        return OK()
+
+    def execute_set(self, parser, connection, undo):
+        while True:
+            kind, text = parser.next()
+            if kind == 'var':
+                parser.expect_op('=')
+                node = parser.operand()
+                connection.variables[text.lstrip('@')] = node[1]
+            elif text.upper() == 'AUTOCOMMIT':
+                parser.expect_op('=')
+                autocommit = bool(parser.next()[1])
+                if autocommit and connection.undo is not None:
+                    connection.undo = None
+                connection.autocommit = autocommit
+            else:
+                # SET NAMES ..., SET SESSION ..., accepted and ignored
+                parser.skip_rest()
+                return OK()
+            if not parser.accept_op(','):
+                return OK()
+
+    def execute_show(self, parser, connection, undo):
+        parser.skip_rest()
+        return OK()
+
+    def execute_begin(self, parser, connection, undo):
+        parser.accept('WORK')
+        connection.undo = []
+        return OK()
+
+    def execute_start(self, parser, connection, undo):
+        parser.expect('TRANSACTION')
+        connection.undo = []
+        return OK()
+
+    def execute_commit(self, parser, connection, undo):
+        parser.accept('WORK')
+        connection.undo = None
+        return OK()
+
+    def execute_rollback(self, parser, connection, undo):
+        parser.accept('WORK')
+        connection.rollback()
+        return OK()
+
+    # dml
+
+    def execute_insert(self, parser, connection, undo, mode='INSERT'):
+        if parser.accept('IGNORE'):
+            mode = 'IGNORE'
+        parser.expect('INTO')
+        table = self.table(*parser.name())
+        names = parser.ident_list()
+        for name in names:
+            table.column(name)
+        parser.expect('VALUES')
+
+        rows = []
+        while True:
+            node = parser.operand()
+            values = node[1] if node[0] == 'row' else [node]
+            if len(values) != len(names):
+                raise SqlError(
+                    1136, "Column count doesn't match value count", '21S01')
+            rows.append([self.constant(parser, v) for v in values])
+            if not parser.accept_op(','):
+                break
+
+        updates = []
+        if parser.accept('ON', 'DUPLICATE', 'KEY', 'UPDATE'):
+            updates = parser.assignments()
+
+        affected, insert_id = 0, 0
+        for values in rows:
+            row = {c.name: None for c in table.columns}
+            for name, value in zip(names, values):
+                row[name] = table.cast(name, value)
+            for column in table.columns:
+                if column.auto_increment:
+                    if row[column.name] is None:
+                        row[column.name] = table.auto_increment
+                        insert_id = insert_id or table.auto_increment
+                    table.auto_increment = max(
+                        table.auto_increment, row[column.name] + 1)
+
+            key = table.key(row)
+            if key not in table.rows:
+                table.insert(row, undo)
+                affected += 1
+            elif mode == 'IGNORE':
+                continue
+            elif mode == 'REPLACE':
+                table.replace(key, row, undo)
+                affected += 2
+            elif updates:
+                old = table.rows[key]
+                new = dict(old)
+                for name, node in updates:
+                    if node[0] == 'values':
+                        new[name] = row[node[1]]
+                    else:
+                        new[name] = table.cast(
+                            name, self.evaluate(node, old, table))
+                if new != old:
+                    table.replace(key, new, undo)
+                    affected += 2
+            else:
+                raise SqlError(
+                    ER_DUP_ENTRY,
+                    "Duplicate entry '{}' for key 'PRIMARY'".format(
+                        '-'.join(str(k) for k in key)),
+                    '23000')
+        return OK(affected, insert_id)
+
+    def execute_replace(self, parser, connection, undo):
+        return self.execute_insert(parser, connection, undo, 'REPLACE')
+
+    def execute_update(self, parser, connection, undo):
+        table = self.table(*parser.name())
+        parser.expect('SET')
+        assignments = parser.assignments()
+        where = parser.where()
+        order_by = parser.order_by()
+        limit, _ = parser.limit()
+
+        affected = 0
+        for key, row in self.select_rows(table, where, order_by, limit):
+            new = dict(row)
+            for name, node in assignments:
+                new[name] = table.cast(
+                    name, self.evaluate(node, row, table))
+            if new != row:
+                table.replace(key, new, undo)
+                affected += 1
+        return OK(affected)
+
+    def execute_delete(self, parser, connection, undo):
+        parser.expect('FROM')
+        table = self.table(*parser.name())
+        where = parser.where()
+        order_by = parser.order_by()
+        limit, _ = parser.limit()
+
+        rows = self.select_rows(table, where, order_by, limit)
+        for key, _ in rows:
+            table.delete(key, undo)
+        return OK(len(rows))
+
+    def execute_explain(self, parser, connection, undo):
+        parser.expect('SELECT')
+        result = self.execute_select(parser, connection, undo)
+        columns = [
+            ('id', ) + value_type(1), ('select_type', ) + DEFAULT_COLUMN_TYPE,
+            ('type', ) + DEFAULT_COLUMN_TYPE, ('rows', ) + value_type(1),
+        ]
+        return ResultSet(columns, [(1, 'SIMPLE', 'ALL', len(result.rows))])
+
+    def execute_select(self, parser, connection, undo):
+        items = []
+        if not parser.accept_op('*'):
+            while True:
+                node = parser.operand()
+                if parser.accept('AS'):
+                    alias = parser.ident()
+                elif node[0] == 'col':
+                    alias = node[1]
+                elif node[0] == 'count':
+                    alias = 'COUNT(*)'
+                else:
+                    alias = str(node[1])
+                items.append((node, alias))
+                if not parser.accept_op(','):
+                    break
+
+        if not parser.accept('FROM'):
+            values = [self.evaluate(node, {}, None) for node, _ in items]
+            columns = [
+                (alias, ) + value_type(value)
+                for (_, alias), value in zip(items, values)
+            ]
+            return ResultSet(columns, [tuple(values)])
+
+        table = self.table(*parser.name())
+        where = parser.where()
+        order_by = parser.order_by()
+        limit, offset = parser.limit()
+        parser.accept('FOR', 'UPDATE')
+
+        if not items:
+            items = [(('col', c.name), c.name) for c in table.columns]
+        if any(node[0] == 'count' for node, _ in items):
+            count = len(self.select_rows(table, where))
+            return ResultSet(
+                [(alias, ) + value_type(count) for _, alias in items],
+                [tuple(count for _ in items)])
+
+        columns = []
+        for node, alias in items:
+            if node[0] == 'col':
+                column = table.column(node[1])
+                columns.append((alias, column.python_type, column.type_code,
+                                column.charset))
+            else:
+                columns.append((alias, ) + value_type(node[1]))
+        rows = self.select_rows(table, where, order_by, limit, offset)
+        return ResultSet(columns, [
+            tuple(self.evaluate(node, row, table) for node, _ in items)
+            for _, row in rows
+        ])
+
+    def select_rows(self, table, where, order_by=None, limit=None, offset=0):
+        rows = [
+            (key, row) for key, row in table.rows.items()
+            if all(self.match(c, row, table) for c in where)
+        ]
+        for name, desc in reversed(order_by or ()):
+            table.column(name)
+            rows.sort(key=partial(sort_key, name), reverse=desc)
+        if limit is not None:
+            return rows[offset:offset + limit]
+        return rows[offset:]
+
+    def constant(self, parser, node):
+        if node[0] != 'const':
+            raise parser.error()
+        return node[1]
+
+    def evaluate(self, node, row, table):
+        if node[0] == 'const':
+            return node[1]
+        elif node[0] == 'col':
+            if table is None:
+                raise SqlError(
+                    ER_BAD_FIELD_ERROR,
+                    "Unknown column '{}' in 'field list'".format(node[1]),
+                    '42S22')
+            table.column(node[1])
+            return row[node[1]]
+        elif node[0] == 'row':
+            return tuple(self.evaluate(n, row, table) for n in node[1])
+        raise SqlError(ER_PARSE_ERROR, 'unsupported expression', '42000')
+
+    def match(self, condition, row, table):
+        left, op, right = condition
+        value = self.evaluate(left, row, table)
+        if op == 'IS':
+            return value is None
+        elif op == 'IS NOT':
+            return value is not None
+        elif op in ('IN', 'NOT IN'):
+            values = [
+                self.coerce(left, n, row, table) for n in right[1]
+            ]
+            if value is None:
+                return False
+            return (value in values) == (op == 'IN')
+
+        other = self.coerce(left, right, row, table)
+        if value is None or other is None:
+            return False
+        if isinstance(value, tuple) and any(v is None for v in value):
+            return False
+        if op == '=':
+            return value == other
+        elif op == '!=':
+            return value != other
+        elif op == '<':
+            return value < other
+        elif op == '>':
+            return value > other
+        elif op == '<=':
+            return value <= other
+        return value >= other
+
+    def coerce(self, left, right, row, table):
+        '''
+        evaluate right side with the column types of left side
+        '''
+        value = self.evaluate(right, row, table)
+        if left[0] == 'col' and right[0] != 'col':
+            return table.cast(left[1], value)
+        elif left[0] == 'row' and right[0] == 'row':
+            return tuple(
+                self.coerce(l, r, row, table)
+                for l, r in zip(left[1], right[1])
+            )
+        return value
+
+
+class FakeMysqlServer(object):
+    '''
+    threaded tcp server, one thread per client connection
+    '''
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, slow_read=0,
+                 drop_rate=0, reject_rate=0, seed=None, store=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.slow_read = slow_read
+        self.drop_rate = drop_rate
+        self.reject_rate = reject_rate
+        self.store = store or FakeMysqlStore()
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._faults = []
+        self._sockets = set()
+        self._socket = None
+        self._thread = None
+        self._connection_id = 0
+        self.counters = {
+            'connections': 0, 'rejected': 0, 'queries': 0, 'dropped': 0,
+            'errors': 0,
+        }
+
+    @property
+    def conf(self):
+        return {
+            'host': self.host, 'port': self.port,
+            'user': 'root', 'password': '',
+        }
+
+    def start(self):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, self.port))
+        self._socket.listen(128)
+        self.port = self._socket.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._socket:
+            self._socket.close()
+            self._socket = None
+        self.kill_connections()
+        if self._thread:
+            self._thread.join(1)
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def fail_next(self, kind, count=1, code=ER_TOO_MANY_CONNECTIONS,
+                  delay=1):
+        '''
+        kind:
+            drop: close the socket instead of answering next queries
+            reject: refuse next connections with 1040
+            error: answer next queries with error `code`
+            slow: sleep `delay` seconds before the rows of next queries
+        '''
+        if kind not in FAULT_KINDS:
+            raise ValueError('unknown fault {}'.format(kind))
+        with self._lock:
+            self._faults.extend([(kind, code, delay)] * count)
+
+    def kill_connections(self):
+        '''
+        close every client socket, like a server restart
+        '''
+        with self._lock:
+            sockets, self._sockets = self._sockets, set()
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, active=len(self._sockets))
+
+    def _fault(self, kinds, rate_kind=None, rate=0):
+        with self._lock:
+            for i, fault in enumerate(self._faults):
+                if fault[0] in kinds:
+                    del self._faults[i]
+                    return fault
+            if rate and self._random.random() < rate:
+                return (rate_kind, ER_TOO_MANY_CONNECTIONS, 0)
+        return None
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _serve(self):
+        while True:
+            listener = self._socket
+            if listener is None:
+                return
+            try:
+                sock, _ = listener.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._lock:
+                self._connection_id += 1
+                connection_id = self._connection_id
+                self._sockets.add(sock)
+            threading.Thread(
+                target=self._handle, args=(sock, connection_id), daemon=True
+            ).start()
+
+    def _handle(self, sock, connection_id):
+        connection = Connection(connection_id)
+        stream = PacketStream(sock)
+        try:
+            if self._fault(('reject', ), 'reject', self.reject_rate):
+                self._count('rejected')
+                stream.send_error(
+                    ER_TOO_MANY_CONNECTIONS, 'Too many connections', '08004')
+                return
+            self._count('connections')
+            self._handshake(stream, connection)
+            while True:
+                payload = stream.read()
+                if not payload or payload[0] == COM_QUIT:
+                    return
+                command, data = payload[0], payload[1:]
+                if command == COM_PING:
+                    stream.send_ok(connection.status)
+                elif command == COM_INIT_DB:
+                    self._query(stream, connection,
+                                'USE `{}`'.format(data.decode()))
+                elif command == COM_QUERY:
+                    self._query(stream, connection,
+                                data.decode('utf8', 'surrogateescape'))
+                else:
+                    stream.send_error(
+                        ER_UNKNOWN_COM_ERROR, 'Unknown command', '08S01')
+        except (OSError, ConnectionDropped):
+            pass
+        finally:
+            # an unfinished transaction is rolled back on disconnect
+            if connection.undo is not None:
+                with self.store.lock:
+                    connection.rollback()
+            with self._lock:
+                self._sockets.discard(sock)
+            sock.close()
+
+    def _handshake(self, stream, connection):
+        salt = bytes(self._random.randrange(1, 128) for _ in range(20))
+        stream.send(
+            struct.pack('<B', PROTOCOL_VERSION) + SERVER_VERSION + b'\0' +
+            struct.pack('<I', connection.id) + salt[:8] + b'\0' +
+            struct.pack('<HBHHB', SERVER_CAPABILITIES & 0xffff,
+                        CHARSET_UTF8MB4, connection.status,
+                        SERVER_CAPABILITIES >> 16, len(salt) + 1) +
+            b'\0' * 10 + salt[8:] + b'\0' + b'mysql_native_password\0'
+        )
+
+        # credentials are not checked
+        data = stream.read()
+        client_flags = struct.unpack('<I', data[:4])[0]
+        i = data.index(b'\0', 32) + 1
+        if client_flags & CLIENT_PLUGIN_AUTH_LENENC_DATA:
+            i += 1 + data[i]
+        elif client_flags & CLIENT_SECURE_CONNECTION:
+            i += 1 + data[i]
+        else:
+            i = data.index(b'\0', i) + 1
+        if client_flags & CLIENT_CONNECT_WITH_DB and i < len(data):
+            db = data[i:data.index(b'\0', i)].decode()
+            if db:
+                if db not in self.store.databases:
+                    stream.send_error(
+                        ER_BAD_DB_ERROR, "Unknown database '{}'".format(db),
+                        '42000')
+                    raise ConnectionDropped()
+                connection.db = db
+        stream.send_ok(connection.status)
+
+    def _query(self, stream, connection, sql):
+        self._count('queries')
+        if self.latency:
+            time.sleep(self.latency)
+
+        fault, slow_read = None, self.slow_read
+        if not SET_RE.match(sql):
+            fault = self._fault(
+                ('drop', 'error', 'slow'), 'drop', self.drop_rate)
+        if fault and fault[0] == 'drop':
+            self._count('dropped')
+            raise ConnectionDropped()
+        elif fault and fault[0] == 'error':
+            self._count('errors')
+            stream.send_error(fault[1], 'injected error {}'.format(fault[1]))
+            return
+        elif fault and fault[0] == 'slow':
+            slow_read = fault[2]
+
+        try:
+            result = self.store.execute(sql, connection)
+        except SqlError as e:
+            self._count('errors')
+            stream.send_error(e.code, e.message, e.sqlstate)
+            return
+
+        if isinstance(result, OK):
+            stream.send_ok(
+                connection.status, result.affected_rows, result.insert_id)
+            return
+
+        stream.send(lenenc_int(len(result.columns)))
+        for name, _, type_code, charset in result.columns:
+            name = name.encode('utf8')
+            stream.send(
+                lenenc_str(b'def') + lenenc_str(b'') + lenenc_str(b'') +
+                lenenc_str(b'') + lenenc_str(name) + lenenc_str(name) +
+                struct.pack('<BHIBHBxx', 0x0c, charset, 0xffffff,
+                            type_code, 0, 0)
+            )
+        stream.send_eof(connection.status)
+        for row in result.rows:
+            if slow_read:
+                time.sleep(slow_read)
+            stream.send(b''.join(lenenc_str(encode_text(v)) for v in row))
+        stream.send_eof(connection.status)
+
+
+class PacketStream(object):
+    '''
+    3 bytes payload length, 1 byte sequence id, payload
+    '''
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.seq = 0
+
+    def _recv(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionDropped()
+            data += chunk
+        return data
+
+    def read(self):
+        payload = b''
+        while True:
+            header = self._recv(4)
+            length = struct.unpack('<I', header[:3] + b'\0')[0]
+            self.seq = (header[3] + 1) % 256
+            payload += self._recv(length)
+            if length < 0xffffff:
+                return payload
+
+    def send(self, payload):
+        packets = []
+        while True:
+            chunk, payload = payload[:0xffffff], payload[0xffffff:]
+            packets.append(
+                struct.pack('<I', len(chunk))[:3] +
+                struct.pack('<B', self.seq) + chunk)
+            self.seq = (self.seq + 1) % 256
+            if len(chunk) < 0xffffff:
+                break
+        self.sock.sendall(b''.join(packets))
+
+    def send_ok(self, status, affected_rows=0, insert_id=0):
+        self.send(
+            b'\0' + lenenc_int(affected_rows) + lenenc_int(insert_id) +
+            struct.pack('<HH', status, 0))
+
+    def send_eof(self, status):
+        self.send(b'\xfe' + struct.pack('<HH', 0, status))
+
+    def send_error(self, code, message, sqlstate='HY000'):
+        self.send(
+            b'\xff' + struct.pack('<H', code) + b'#' + sqlstate.encode() +
+            message.encode('utf8'))
@@ -1,11 +1,16 @@
 import pytest
 
 import time
+import asyncio
 
 from multiprocessing.pool import ThreadPool
 from threading import current_thread
 
-from curd import DuplicateKeyError, OperationFailure
+from curd import (
+    DuplicateKeyError, OperationFailure, BatchError, BufferedWriter
+)
+from curd.instrument import add_hook, remove_hook, HistogramHook
+from curd.profiler import Profiler
 
 
 def create(session, create_test_table):
@@ -24,7 +29,80 @@ def create(session, create_test_table):
     session.create(collection, data2, mode='replace')
 
     assert data != session.get(collection, [('=', 'id', 100)])
+
+    
+def create_many(session, create_test_table):
+    collection = create_test_table(session)
+    
+    rows = [{'id': i, 'text': 'test'} for i in range(1, 1001)]
+    session.create_many(collection, rows, chunk_size=300)
+    assert len(session.filter(collection, [('>=', 'id', 1)], limit=None)) == 1000
+    
+    rows = [{'id': i, 'text': 'test'} for i in range(995, 1011)]
+    with pytest.raises(BatchError) as e:
+        session.create_many(collection, rows, chunk_size=10)
+    assert sorted(e.value.errors) == [0, 1, 2, 3, 4, 5]
+    for error in e.value.errors.values():
+        assert isinstance(error, DuplicateKeyError)
+    assert len(session.filter(collection, [('>=', 'id', 1)], limit=None)) == 1010
+    
+    rows = [{'id': i, 'text': 't2'} for i in range(1001, 1021)]
+    session.create_many(collection, rows, mode='upsert', chunk_size=10)
+    assert len(session.filter(collection, [('>=', 'id', 1)], limit=None)) == 1020
+    assert session.get(collection, [('=', 'id', 1001)])['text'] == 't2'
+    
+    
+def get_many(session, create_test_table):
+    collection = create_test_table(session)
+    session.create_many(
+        collection, [{'id': i, 'text': str(i)} for i in range(1, 200)])
     
+    values = [5, 500, 3, 5]
+    items = session.get_many(collection, 'id', values)
+    assert [item and item['text'] for item in items] == ['5', None, '3', '5']
+    
+    items = session.get_many(collection, 'id', range(1, 300), as_dict=True)
+    assert sorted(items) == list(range(1, 200))
+    
+    items = session.get_many(
+        collection, 'id', list(range(300, 0, -1)) * 2, fields=['text'],
+        chunk_size=50)
+    assert len(items) == 600
+    assert items[:101] == [None] * 101
+    assert items[101:103] == [{'text': '199'}, {'text': '198'}]
+    assert items[300:] == items[:300]
+    
+    session.create_many(
+        collection, [{'id': 500, 'text': '500'}], row_format='dict')
+    items = session.get_many(collection, 'id', [500, 1], row_format='dict')
+    assert [item['text'] for item in items] == ['500', '1']
+
+    
+def lwt(session, create_test_table):
+    collection = create_test_table(session)
+    data = {'id': 1, 'text': 'test'}
+    
+    session.create(collection, data, lwt=False)
+    session.create(collection, {'id': 1, 'text': 't2'}, lwt=False)
+    assert session.get(collection, [('=', 'id', 1)])['text'] == 't2'
+    with pytest.raises(DuplicateKeyError):
+        session.create(collection, data, lwt=True)
+    
+    session.update(collection, {'text': 't3'}, [('=', 'id', 2)], lwt=False)
+    assert session.get(collection, [('=', 'id', 2)])['text'] == 't3'
+
+
+def cached_get(session, create_test_table):
+    collection = create_test_table(session)
+    session.create(collection, {'id': 1, 'text': 'test'})
+    
+    assert session.get(collection, [('=', 'id', 1)])['text'] == 'test'
+    assert session.get(collection, [('=', 'id', 1)])['text'] == 'test'
+    assert session.cache.stats()['hits'] == 1
+    
+    session.update(collection, {'text': 't2'}, [('=', 'id', 1)])
+    assert session.get(collection, [('=', 'id', 1)])['text'] == 't2'
+
     
 def update(session, create_test_table):
     collection = create_test_table(session)
@@ -57,6 +135,52 @@ def normal_filter(session, create_test_table):
         assert not item.get('id')
 
     
+def row_format(session, create_test_table):
+    collection = create_test_table(session)
+    session.create_many(
+        collection, [{'id': i, 'text': 'test'} for i in range(1, 21)])
+    
+    rows = session.filter(
+        collection, [('<=', 'id', 10)], fields=['id', 'text'],
+        row_format='tuple')
+    assert rows.columns == ['id', 'text']
+    assert sorted(rows)[0] == (1, 'test')
+    columns = session.filter(
+        collection, [('<=', 'id', 10)], fields=['id', 'text'],
+        row_format='columnar')
+    assert sorted(columns['id']) == list(range(1, 11))
+
+    
+def iter_filter(session, create_test_table):
+    collection = create_test_table(session)
+    session.create_many(
+        collection, [{'id': i, 'text': 'test'} for i in range(1, 2000)])
+
+    items = session.iter_filter(
+        collection, [('<=', 'id', 1000)], fields=['id'], batch_size=100)
+    assert sorted(item['id'] for item in items) == list(range(1, 1001))
+    
+    items = session.iter_filter(collection, [('>=', 'id', 1)], batch_size=10)
+    assert next(items)['text'] == 'test'
+    items.close()
+    assert session.get(collection, [('=', 'id', 1)])['text'] == 'test'
+
+        
+def scan(session, create_test_table):
+    collection = create_test_table(session)
+    session.create_many(
+        collection, [{'id': i, 'text': str(i % 3)} for i in range(1, 2000)])
+
+    items = session.scan(collection, batch_size=100, fields=['text'])
+    assert [item['id'] for item in items] == list(range(1, 2000))
+
+    items = session.scan(
+        collection, key=['-text', '-id'], batch_size=7,
+        filters=[('<=', 'id', 100)])
+    assert [(item['text'], item['id']) for item in items] == sorted(
+        [(str(i % 3), i) for i in range(1, 101)], reverse=True)
+
+    
 def filter_with_order_by(session, create_test_table):
     collection = create_test_table(session)
     for i in range(1, 2000):
@@ -73,6 +197,99 @@ def filter_with_order_by(session, create_test_table):
     assert [item['id'] for item in items] == [32, 16, 1]
     
     
+def transaction(session, create_test_table):
+    collection = create_test_table(session)
+    
+    with session.transaction() as tx:
+        for i in range(1, 101):
+            tx.create(collection, {'id': i, 'text': 'test'})
+        tx.update(collection, {'text': 't2'}, [('=', 'id', 1)])
+    assert len(session.filter(collection, [('>=', 'id', 1)])) == 100
+    assert session.get(collection, [('=', 'id', 1)])['text'] == 't2'
+    
+    with pytest.raises(DuplicateKeyError):
+        with session.transaction() as tx:
+            tx.create(collection, {'id': 101, 'text': 'test'})
+            tx.create(collection, {'id': 1, 'text': 'test'})
+    assert session.get(collection, [('=', 'id', 101)]) is None
+    
+    with session.pinned() as conn:
+        conn.execute('SET @curd_pinned = 1')
+        assert conn.execute('SELECT @curd_pinned AS v')[0]['v'] == 1
+    
+    # writes between pages of a scan on the same connection
+    with session.pinned() as conn:
+        for row in conn.scan(collection, batch_size=10):
+            conn.update(
+                collection, {'text': 'scanned'}, [('=', 'id', row['id'])])
+    assert len(session.filter(
+        collection, [('=', 'text', 'scanned')])) == 100
+
+
+def buffered_writer(session, create_test_table):
+    collection = create_test_table(session)
+    errors = []
+    
+    with BufferedWriter(
+            session, collection, max_rows=100, max_latency_ms=50,
+            on_error=lambda *args: errors.append(args)) as writer:
+        for i in range(1, 1001):
+            writer.create({'id': i, 'text': 'test'})
+        writer.update({'text': 't2'}, [('=', 'id', 1)])
+        time.sleep(0.5)
+        assert writer.stats()['flushes'] > 0
+    
+    assert not errors
+    assert writer.stats()['flushed'] == 1001
+    assert len(session.filter(collection, [('>=', 'id', 1)])) == 1000
+    assert session.get(collection, [('=', 'id', 1)])['text'] == 't2'
+    
+    with BufferedWriter(session, collection, max_latency_ms=50) as writer:
+        writer.update({'text': 'a'}, [('=', 'id', 1)])
+        writer.update({'text': 'b'}, [('IN', 'id', [1, 2])])
+        writer.update({'text': 'c'}, [('=', 'id', 1)])
+        writer.flush()
+        assert session.get(collection, [('=', 'id', 1)])['text'] == 'c'
+        assert session.get(collection, [('=', 'id', 2)])['text'] == 'b'
+        
+        # deadline of a row queued after a flush
+        writer.update({'text': 'd'}, [('=', 'id', 3)])
+        time.sleep(0.5)
+        assert writer.stats()['pending'] == 0
+        assert session.get(collection, [('=', 'id', 3)])['text'] == 'd'
+
+
+def hooks(session, create_test_table):
+    collection = create_test_table(session)
+    events = []
+    histogram = HistogramHook()
+    profiler = Profiler(slow_threshold=0)
+    add_hook(events.append)
+    add_hook(histogram)
+    add_hook(profiler)
+    try:
+        session.create(collection, {'id': 1, 'text': 'test'})
+        session.filter(collection, [('>=', 'id', 1)])
+        session.filter(collection, [('>=', 'id', 2)])
+    finally:
+        remove_hook(events.append)
+        remove_hook(histogram)
+        remove_hook(profiler)
+        profiler.close()
+    
+    assert [(e.op, e.collection) for e in events] == [
+        ('create', collection), ('filter', collection), ('filter', collection)]
+    assert events[1].rows == 1 and events[1].error is None
+    assert events[1].network_time > 0
+    assert sum(series['count'] for series in histogram.dump()) == 3
+    
+    top = profiler.top(by='count')
+    assert len(top) == 2
+    assert top[0]['op'] == 'filter' and top[0]['count'] == 2
+    assert top[0]['p99'] <= top[0]['max']
+    assert len(profiler.slow_queries()) == 3
+
+    
 def timeout(session, create_test_table):
     collection = create_test_table(session)
     for i in range(1, 2000):
@@ -104,3 +321,31 @@ def thread_pool(session, create_test_table):
     for item in items:
         t_names.add(item['text'])
     assert len(t_names) == pool_size
+
+
+def async_operations(session, async_session, create_test_table):
+    collection = create_test_table(session)
+    
+    async def run():
+        data = {'id': 100, 'text': 'test'}
+        await async_session.create(collection, data)
+        with pytest.raises(DuplicateKeyError):
+            await async_session.create(collection, data)
+        assert data == await async_session.get(collection, [('=', 'id', 100)])
+        
+        await async_session.create_many(
+            collection, [{'id': i, 'text': 'test'} for i in range(1, 100)])
+        items = await async_session.filter(
+            collection, [('<=', 'id', 1000)], limit=None)
+        assert len(items) == 100
+        
+        await async_session.update(
+            collection, {'text': 't2'}, [('=', 'id', 100)])
+        d = await async_session.get(collection, [('=', 'id', 100)])
+        assert d['text'] == 't2'
+        
+        await async_session.delete(collection, [('=', 'id', 100)])
+        assert not await async_session.exist(collection, [('=', 'id', 100)])
+        await async_session.close()
+        
+    asyncio.get_event_loop().run_until_complete(run())
@@ -1,8 +1,10 @@
 from .operations import (
-    create, delete, normal_filter, thread_pool, update, timeout
+    create, create_many, hooks, cached_get, get_many, delete, normal_filter,
+    row_format, iter_filter, thread_pool, update, timeout, async_operations,
+    buffered_writer, lwt
 )
 
-from curd import Session
+from curd import Session, AsyncSession, LocalCache
 from .conf import cassandra_conf
 
     
@@ -16,8 +18,27 @@ def create_test_table(session):
 def test_cassandra():
     session = Session([cassandra_conf])
     create(session, create_test_table)
+    create_many(session, create_test_table)
+    lwt(session, create_test_table)
+    get_many(session, create_test_table)
     update(session, create_test_table)
+    buffered_writer(session, create_test_table)
+    hooks(session, create_test_table)
     delete(session, create_test_table)
     normal_filter(session, create_test_table)
+    row_format(session, create_test_table)
+    iter_filter(session, create_test_table)
     thread_pool(session, create_test_table)
     timeout(session, create_test_table)
+
+
+
+def test_cached_cassandra():
+    session = Session([cassandra_conf], cache=LocalCache())
+    cached_get(session, create_test_table)
+
+
+def test_async_cassandra():
+    session = Session([cassandra_conf])
+    async_session = AsyncSession([cassandra_conf])
+    async_operations(session, async_session, create_test_table)
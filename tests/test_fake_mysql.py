@@ -0,0 +1,488 @@
+import gc
+import os
+import sys
+import signal
+import asyncio
+import pytest
+import pymysql
+
+from multiprocessing.pool import ThreadPool
+
+from .operations import (
+    create_many, get_many, update, delete, normal_filter, iter_filter, scan,
+    row_format, filter_with_order_by, thread_pool, transaction, buffered_writer,
+    cached_get, hooks
+)
+from .fake_mysql import FakeMysqlServer
+from .test_mysql import create_test_table
+
+from curd import (
+    Session, AsyncSession, OperationFailure, ConnectError, CircuitOpenError,
+    BatchError, UnexpectedError, ProgrammingError, ShardMap, ShardedCollection,
+    RetryBudget, LocalCache
+)
+from curd.instrument import add_hook, remove_hook
+
+
+@pytest.fixture
+def server():
+    with FakeMysqlServer(seed=0) as server:
+        yield server
+
+
+def fake_session(server, **conf):
+    return Session([{'type': 'mysql', 'conf': dict(server.conf, **conf)}])
+
+
+def test_fake_mysql(server):
+    session = fake_session(server)
+    create_many(session, create_test_table)
+    get_many(session, create_test_table)
+    update(session, create_test_table)
+    transaction(session, create_test_table)
+    normal_filter(session, create_test_table)
+    row_format(session, create_test_table)
+    iter_filter(session, create_test_table)
+    scan(session, create_test_table)
+    filter_with_order_by(session, create_test_table)
+    thread_pool(session, create_test_table)
+    buffered_writer(session, create_test_table)
+    delete(session, create_test_table)
+
+
+def test_cache(server):
+    session = Session(
+        [{'type': 'mysql', 'conf': server.conf}], cache=LocalCache())
+    cached_get(session, create_test_table)
+    collection = 'curd.test'
+    
+    # a write finished between fetch and set of a read
+    conn = session.using()
+    pool_get = conn._conn.get
+    
+    def get(*args, **kwargs):
+        rows = pool_get(*args, **kwargs)
+        session.update(collection, {'text': 't3'}, [('=', 'id', 1)])
+        return rows
+    
+    conn._conn.get = get
+    try:
+        assert session.get(collection, [('=', 'id', 1)], ['text']) == \
+            {'text': 't2'}
+    finally:
+        conn._conn.get = pool_get
+    assert session.get(collection, [('=', 'id', 1)], ['text']) == \
+        {'text': 't3'}
+    session.close()
+    
+    # skipping cache of a session without cache
+    session = fake_session(server)
+    assert session.get(
+        collection, [('=', 'id', 1)], use_cache=False)['text'] == 't3'
+    assert session.exist(collection, [('=', 'id', 1)], use_cache=False)
+    session.close()
+
+
+def test_hooks(server):
+    session = fake_session(server)
+    hooks(session, create_test_table)
+    
+    collection = 'curd.test'
+    session.create_many(
+        collection, [{'id': i, 'text': 'test'} for i in range(2, 1001)])
+    events = []
+    add_hook(events.append)
+    try:
+        rows = session.filter(collection, [('>=', 'id', 1)])
+    finally:
+        remove_hook(events.append)
+    assert rows[0] == {'id': 1, 'text': 'test'}
+    # dicts of 1000 rows built after rows are read, not in network time
+    assert events[0].rows == 1000
+    assert events[0].network_time > 0 and events[0].convert_time > 2e-5
+    
+    # duplicated name prefixed by table, same as DictCursor
+    query = 'SELECT id, text AS id FROM {} WHERE id = 1'.format(collection)
+    conn = pymysql.connect(**server.conf)
+    with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+        cursor.execute(query)
+        assert session.execute(query) == list(cursor.fetchall())
+    conn.close()
+    session.close()
+
+
+def test_iter_filter_closed_early(server, monkeypatch):
+    unraisable = []
+    monkeypatch.setattr(sys, 'unraisablehook', unraisable.append)
+    session = fake_session(server)
+    collection = create_test_table(session)
+    session.create_many(
+        collection, [{'id': i, 'text': 'test'} for i in range(1, 101)])
+    
+    rows = session.iter_filter(collection, [('>=', 'id', 1)], batch_size=10)
+    assert next(rows)['id'] == 1
+    rows.close()
+    del rows
+    gc.collect()
+    assert not unraisable
+    
+    assert len(list(session.iter_filter(collection, batch_size=10))) == 100
+    session.close()
+
+
+def test_retry_dropped_connection(server):
+    session = fake_session(
+        server, max_op_fail_retry=2, retry_backoff=0.001)
+    assert session.execute('SELECT 1 AS v') == [{'v': 1}]
+
+    server.fail_next('drop')
+    assert session.execute('SELECT 1 AS v') == [{'v': 1}]
+    assert server.stats()['dropped'] == 1
+
+    server.fail_next('drop', 3)
+    with pytest.raises(OperationFailure):
+        session.execute('SELECT 1 AS v')
+
+    server.fail_next('error', code=1040)
+    assert session.execute('SELECT 1 AS v') == [{'v': 1}]
+
+
+def test_rejected_connection(server):
+    session = fake_session(server)
+    server.fail_next('reject')
+    with pytest.raises(ConnectError):
+        session.execute('SELECT 1 AS v')
+    assert session.execute('SELECT 1 AS v') == [{'v': 1}]
+    assert server.stats()['rejected'] == 1
+
+
+def test_read_timeout(server):
+    session = fake_session(server, timeout=0.2)
+    with pytest.raises(OperationFailure):
+        session.execute('SELECT SLEEP(1)')
+    assert session.execute('SELECT SLEEP(0) AS v', timeout=2) == [{'v': 0}]
+
+    collection = create_test_table(session)
+    session.create_many(
+        collection, [{'id': i, 'text': 'test'} for i in range(1, 11)])
+    server.fail_next('slow', delay=0.5)
+    with pytest.raises(OperationFailure):
+        list(session.iter_filter(
+            collection, [('>=', 'id', 1)], batch_size=2, timeout=0.25))
+    assert len(list(session.iter_filter(
+        collection, [('>=', 'id', 1)], batch_size=2))) == 10
+
+
+def test_circuit_breaker(server):
+    session = fake_session(
+        server, max_op_fail_retry=1, retry_backoff=0.001,
+        breaker_failure_threshold=2, breaker_reset_timeout=60)
+    server.fail_next('drop', 4)
+    for _ in range(2):
+        with pytest.raises(OperationFailure):
+            session.execute('SELECT 1 AS v')
+    with pytest.raises(CircuitOpenError):
+        session.execute('SELECT 1 AS v')
+
+
+
+def test_circuit_breaker_ignores_deadlocks(server):
+    # errors of a healthy host, like deadlocks, don't open circuit
+    session = fake_session(
+        server, breaker_failure_threshold=2, breaker_reset_timeout=60)
+    for code in (1213, 1205, 1213):
+        server.fail_next('error', code=code)
+        with pytest.raises(UnexpectedError):
+            session.execute('SELECT 1 AS v')
+    assert session.execute('SELECT 1 AS v') == [{'v': 1}]
+    assert session.using().stats()['retry']['breaker']['state'] == 'closed'
+
+
+def test_pool_under_latency(server):
+    server.latency = 0.005
+    session = fake_session(server, pool_max_size=4)
+
+    def query(i):
+        return session.execute('SELECT {} AS v'.format(i))[0]['v']
+
+    with ThreadPool(16) as pool:
+        assert pool.map(query, range(200)) == list(range(200))
+
+    stats = session.using().stats()
+    assert stats['in_use'] == 0
+    assert stats['size'] <= 4
+    assert server.stats()['connections'] <= 4
+
+
+def test_replica_set_get_many():
+    with FakeMysqlServer() as primary, FakeMysqlServer() as replica:
+        shared = {
+            k: v for k, v in primary.conf.items()
+            if k not in ('host', 'port')}
+        replica_set = {'type': 'mysql', 'conf': dict(
+            shared,
+            primary={'host': primary.host, 'port': primary.port},
+            replicas=[{'host': replica.host, 'port': replica.port}])}
+        session = Session([replica_set])
+        for server in (primary, replica):
+            conn = Session([{'type': 'mysql', 'conf': server.conf}])
+            collection = create_test_table(conn)
+            conn.create_many(
+                collection, [{'id': i, 'text': 'test'} for i in range(1, 6)])
+            conn.close()
+
+        with pytest.raises(ProgrammingError):
+            session.get_many(collection, 'id', [1], row_format='tuple')
+
+        # failed chunk of replica looked up again on primary
+        replica.fail_next('drop')
+        rows = session.get_many(collection, 'id', [3, 1, 9], chunk_size=2)
+        assert [row and row['id'] for row in rows] == [3, 1, None]
+        assert session.using().stats()['replicas'][0]['ejected']
+        assert primary.stats()['queries'] > 0
+        session.close()
+
+
+def test_async_session_unsupported_conf(server):
+    address = {'host': server.conf['host'], 'port': server.conf['port']}
+    replica_set = {'type': 'mysql', 'conf': dict(
+        server.conf, primary=address, replicas=[address])}
+    with pytest.raises(ProgrammingError):
+        AsyncSession([replica_set])
+    with pytest.raises(ProgrammingError):
+        AsyncSession(
+            [{'type': 'mysql', 'conf': server.conf}], cache=LocalCache())
+
+
+def test_execute_concurrent(server):
+    shared = {
+        k: v for k, v in server.conf.items() if k not in ('host', 'port')}
+    address = {'host': server.conf['host'], 'port': server.conf['port']}
+    replica_set = {'type': 'mysql', 'conf': dict(
+        shared, primary=address, replicas=[address])}
+    session = fake_session(server)
+    collection = create_test_table(session)
+    statements = [
+        ('INSERT INTO {} (id, text) VALUES (%s, %s)'.format(collection),
+         (i, 'test'))
+        for i in range(1, 11)
+    ]
+    assert session.execute_concurrent(statements, concurrency=4) == \
+        [[]] * 10
+    
+    with session.pinned() as conn:
+        rows = conn.execute_concurrent([
+            ('SELECT COUNT(*) AS n FROM {}'.format(collection), None)])
+    assert rows == [[{'n': 10}]]
+    
+    with pytest.raises(BatchError) as e:
+        session.using(replica_set).execute_concurrent(
+            statements[8:] + [(statements[0][0], (11, 'test'))])
+    assert list(e.value.errors) == [0, 1]
+    assert session.get(collection, [('=', 'id', 11)])['text'] == 'test'
+    session.close()
+
+
+def test_warmup(server):
+    session = fake_session(server, pool_min_size=2)
+    assert session.warmup() == 2
+    assert session.warmup(3) == 1
+    stats = session.using().stats()
+    assert stats['idle'] == 3 and stats['size'] == 3
+    assert server.stats()['connections'] == 3
+    assert session.execute('SELECT 1 AS v') == [{'v': 1}]
+    assert server.stats()['connections'] == 3
+    session.close()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='no fork')
+def test_fork(server):
+    session = fake_session(server, pool_fork_warmup=1)
+    collection = create_test_table(session)
+    session.create(collection, {'id': 1, 'text': 'test'})
+    assert server.stats()['connections'] == 1
+
+    pid = os.fork()
+    if pid == 0:
+        # child: connection of parent dropped, a new one opened
+        code = 1
+        try:
+            pool = session.using()
+            if pool.stats()['size'] <= 1 and \
+                    session.get(collection, [('=', 'id', 1)])['text'] == 'test':
+                code = 0
+        finally:
+            os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+
+    # socket of parent untouched by child, no reconnect
+    assert session.get(collection, [('=', 'id', 1)])['text'] == 'test'
+    assert session.using().stats()['created'] == 1
+    session.close()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='no fork')
+def test_fork_with_locks_held(server):
+    shared = {
+        k: v for k, v in server.conf.items() if k not in ('host', 'port')}
+    address = {'host': server.conf['host'], 'port': server.conf['port']}
+    session = Session([{'type': 'mysql', 'conf': dict(
+        shared, primary=address, replicas=[address],
+        breaker_failure_threshold=5)}], retry_budget=RetryBudget())
+    collection = create_test_table(session)
+    replica_set = session.using()
+    pool = replica_set.replicas[0]
+    locks = [
+        replica_set._lock, pool.retry_policy.breaker._lock,
+        pool.retry_policy.budget._lock
+    ]
+
+    # held by a thread of parent at fork
+    for lock in locks:
+        lock.acquire()
+    try:
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                signal.alarm(10)
+                if session.get(collection, [('=', 'id', 1)]) is None:
+                    code = 0
+            finally:
+                os._exit(code)
+    finally:
+        for lock in locks:
+            lock.release()
+    _, status = os.waitpid(pid, 0)
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+    session.close()
+
+
+def test_session_dispatch(server):
+    conf = {'type': 'mysql', 'conf': server.conf}
+    other_conf = {'type': 'mysql', 'conf': dict(server.conf, timeout=10)}
+    session = Session([conf])
+    collection = create_test_table(session)
+    session.create(collection, {'id': 1, 'text': 'test'})
+
+    assert session.using(conf) is session.using(dict(conf))
+    assert session.filter is session.using(conf).filter
+
+    test = session.collection(collection)
+    assert test.get([('=', 'id', 1)]) == {'id': 1, 'text': 'test'}
+    test.update({'text': 'updated'}, [('=', 'id', 1)])
+    assert session.get(collection, [('=', 'id', 1)])['text'] == 'updated'
+
+    # a conf changed in place is another db
+    changed = dict(conf)
+    pool = session.using(changed)
+    changed['conf'] = other_conf['conf']
+    assert session.using(changed) is not pool
+    
+    session.set_default_connection(other_conf)
+    assert session.using() is session.using(other_conf)
+    assert session.filter is session.using(other_conf).filter
+    assert session.get(collection, [('=', 'id', 1)])['text'] == 'updated'
+    session.close()
+
+
+@pytest.mark.parametrize('strategy, bounds, lookup, default', [
+    ('hash', None, None, None),
+    ('range', [100], None, None),
+    ('lookup', None, {i: i % 2 for i in range(1, 201)}, 0),
+])
+def test_sharded_collection(strategy, bounds, lookup, default):
+    with FakeMysqlServer() as server1, FakeMysqlServer() as server2:
+        shards = [
+            {'type': 'mysql', 'conf': server1.conf},
+            {'type': 'mysql', 'conf': server2.conf},
+        ]
+        session = Session(shards)
+        for db in shards:
+            create_test_table(session.using(db))
+        shard_map = ShardMap('id', shards, strategy, bounds, lookup, default)
+        test = ShardedCollection(session, 'curd.test', shard_map)
+
+        test.create_many([{'id': i, 'text': str(i)} for i in range(1, 201)])
+        counts = [len(conn.filter('curd.test')) for conn in test.conns]
+        assert sum(counts) == 200 and all(counts)
+
+        assert test.get([('=', 'id', 7)]) == {'id': 7, 'text': '7'}
+        rows = test.filter(
+            [('>', 'id', 50)], ['text'], order_by=['-id'], limit=5)
+        assert rows == [{'text': str(i)} for i in range(200, 195, -1)]
+        rows = test.filter([('IN', 'id', [3, 150, 4])], order_by=['id'])
+        assert [row['id'] for row in rows] == [3, 4, 150]
+        assert test.exist([('=', 'text', '150')])
+        assert test.get_many('id', [150, 3, 999]) == [
+            {'id': 150, 'text': '150'}, {'id': 3, 'text': '3'}, None]
+
+        test.update({'text': 'updated'}, [('IN', 'id', [1, 2])])
+        assert test.get([('=', 'id', 2)])['text'] == 'updated'
+        test.delete([('<=', 'id', 10)])
+        assert len(test.filter()) == 190
+
+        with pytest.raises(BatchError) as e:
+            test.create_many(
+                [{'id': 11, 'text': 'new'}, {'id': 5, 'text': 'new'}])
+        assert list(e.value.errors) == [0]
+        test.close()
+        session.close()
+
+
+def test_filter_all():
+    with FakeMysqlServer() as server1, FakeMysqlServer() as server2:
+        dbs = [
+            {'type': 'mysql', 'conf': server1.conf},
+            {'type': 'mysql', 'conf': server2.conf},
+        ]
+        session = Session(dbs)
+        for index, db in enumerate(dbs):
+            create_test_table(session.using(db))
+            session.using(db).create_many('curd.test', [
+                {'id': i, 'text': str(i % 3)}
+                for i in range(index + 1, 100, 2)
+            ])
+
+        rows = session.filter_all(
+            dbs, 'curd.test', [('>', 'id', 10)], ['id'],
+            order_by=['text', '-id'], limit=4)
+        assert rows == [
+            {'id': 99, '_source': 0}, {'id': 96, '_source': 1},
+            {'id': 93, '_source': 0}, {'id': 90, '_source': 1},
+        ]
+        assert rows.errors == {}
+
+        server2.fail_next('error', code=1105)
+        with pytest.raises(UnexpectedError):
+            session.filter_all(dbs, 'curd.test', limit=1)
+
+        server2.fail_next('error', code=1105)
+        rows = session.filter_all(
+            dbs, 'curd.test', fields=['id'], order_by=['id'], limit=3,
+            on_error='partial', source_field=None)
+        assert rows == [{'id': 1}, {'id': 3}, {'id': 5}]
+        assert list(rows.errors) == [1]
+        
+        with pytest.raises(ProgrammingError):
+            session.filter_all(dbs, 'curd.test', row_format='tuple')
+        session.close()
+        
+        async_session = AsyncSession(dbs)
+        
+        async def run():
+            rows = await async_session.filter_all(
+                dbs, 'curd.test', [('>', 'id', 10)], ['id'],
+                order_by=['text', '-id'], limit=2)
+            assert rows == [{'id': 99, '_source': 0}, {'id': 96, '_source': 1}]
+            
+            server2.fail_next('error', code=1105)
+            rows = await async_session.filter_all(
+                dbs, 'curd.test', fields=['id'], order_by=['id'], limit=2,
+                on_error='partial')
+            assert rows == [{'id': 1, '_source': 0}, {'id': 3, '_source': 0}]
+            assert list(rows.errors) == [1]
+            await async_session.close()
+        
+        asyncio.run(run())
@@ -1,9 +1,11 @@
 from .operations import (
-    create, delete, normal_filter, filter_with_order_by, thread_pool, update
+    create, create_many, get_many, hooks, cached_get, delete, normal_filter,
+    row_format, iter_filter, scan, filter_with_order_by, thread_pool, update,
+    async_operations, transaction, buffered_writer
 )
 
-from curd import Session
-from .conf import mysql_conf
+from curd import Session, AsyncSession, LocalCache, RetryBudget
+from .conf import mysql_conf, mysql_replica_set_conf
 
     
 def create_test_table(session):
@@ -14,10 +16,47 @@ def create_test_table(session):
 
 
 def test_mysql():
-    session = Session([mysql_conf])
+    session = Session([mysql_conf], retry_budget=RetryBudget())
     create(session, create_test_table)
+    create_many(session, create_test_table)
+    get_many(session, create_test_table)
     update(session, create_test_table)
+    transaction(session, create_test_table)
+    buffered_writer(session, create_test_table)
+    hooks(session, create_test_table)
     delete(session, create_test_table)
     normal_filter(session, create_test_table)
+    row_format(session, create_test_table)
+    iter_filter(session, create_test_table)
+    scan(session, create_test_table)
     filter_with_order_by(session, create_test_table)
     thread_pool(session, create_test_table)
+    
+    stats = session.using().stats()
+    assert stats['in_use'] == 0
+    assert stats['size'] <= stats['max_size']
+    assert stats['statement_cache']['hits'] > 0
+    assert stats['retry']['budget']['requests'] > 0
+
+
+
+def test_mysql_replica_set():
+    session = Session([mysql_replica_set_conf])
+    create(session, create_test_table)
+    update(session, create_test_table)
+    normal_filter(session, create_test_table)
+    
+    stats = session.using().stats()
+    assert stats['replicas'][0]['created'] > 0
+    assert not stats['replicas'][0]['ejected']
+
+
+def test_cached_mysql():
+    session = Session([mysql_conf], cache=LocalCache())
+    cached_get(session, create_test_table)
+
+
+def test_async_mysql():
+    session = Session([mysql_conf])
+    async_session = AsyncSession([mysql_conf])
+    async_operations(session, async_session, create_test_table)